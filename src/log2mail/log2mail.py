@@ -8,6 +8,10 @@ License: `MIT`_ (Please look at license of surrounding project)
 
 This file contains `log2mail`, a module that sends an email.
 
+Large attachments are streamed: the message is written to a temporary
+file chunk by chunk (optionally truncated and `gzip` compressed) and
+sent to the mail server from there.
+
 Functions:
     log2mail(str, str, str, str, list, list): sends an email
 
@@ -16,17 +20,157 @@ Functions:
 """
 
 import base64
+import email.policy
+import io
 import json
+import mimetypes
 import os
+import secrets
 import smtplib
 import ssl
 import sys
+import tempfile
+import zlib
 from email.message import EmailMessage
-from email.mime.application import MIMEApplication
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from getpass import getpass
 
+__policy = email.policy.SMTP.clone(cte_type="7bit")  # CRLF, no 8bit
+CHUNK_SIZE = 57 * 1024  # Bytes read at once (multiple of a base64 line)
+SEND_SIZE = 65536  # Bytes sent to the mail server at once
+
+
+def __write_headers(f, message: EmailMessage):
+  """Write the headers of `message` to `f`
+
+  Args:
+      f (file): the message file
+      message (EmailMessage): the message with the headers
+  """
+
+  for name, value in message.items():
+    f.write(__policy.fold_binary(name, value))
+  f.write(b"\r\n")
+
+
+def __write_attachment(f, boundary: str, filename: str, source, size: int,
+                       max_size: int, compress: bool):
+  """Write an attachment to `f` without reading it into memory
+
+  Args:
+      f (file): the message file
+      boundary (str): the boundary of the multipart message
+      filename (str): the filename of the attachment
+      source (file): the content of the attachment (binary)
+      size (int): the size of the content
+      max_size (int): only the last `max_size` bytes are attached
+          (None: no limit)
+      compress (bool): compress the attachment with `gzip`
+  """
+
+  part = EmailMessage(policy=__policy)
+  if compress:
+    part["Content-Type"] = "application/gzip"
+    filename += ".gz"
+  else:
+    part["Content-Type"] = (mimetypes.guess_type(filename)[0] or
+                            "application/octet-stream")
+  part.add_header("Content-Disposition", "attachment", filename=filename)
+  part["Content-Transfer-Encoding"] = "base64"
+  f.write(f"--{boundary}\r\n".encode())
+  __write_headers(f, part)
+
+  compressor = zlib.compressobj(wbits=31) if compress else None
+  rest = b""
+
+  def write(data: bytes, final: bool = False):
+    nonlocal rest
+    if compressor:
+      data = compressor.compress(data)
+      if final:
+        data += compressor.flush()
+    data = rest + data
+    # Only whole base64 lines (57 bytes) until the end
+    n = len(data) if final else len(data) - len(data) % 57
+    rest = data[n:]
+    f.write(base64.encodebytes(data[:n]).replace(b"\n", b"\r\n"))
+
+  if max_size is not None and size > max_size:
+    # Keep the end of the file (the latest lines), starting with a line.
+    # The start of the line is searched chunk by chunk; without a
+    # complete line in the end, the end is kept as it is.
+    skipped = size - max_size
+    source.seek(skipped)
+    while True:
+      chunk = source.read(CHUNK_SIZE)
+      if not chunk:
+        skipped = size - max_size
+        break
+      i = chunk.find(b"\n")
+      if i >= 0:
+        skipped += i + 1
+        if skipped >= size:
+          skipped = size - max_size
+        break
+      skipped += len(chunk)
+    source.seek(skipped)
+    write(f"[log2mail: first {skipped} bytes truncated]\n".encode())
+
+  while True:
+    chunk = source.read(CHUNK_SIZE)
+    if not chunk:
+      break
+    write(chunk)
+  write(b"", final=True)
+
+
+def __send(server: smtplib.SMTP, sender: str, recipients: list, f):
+  """Send the message file `f` without reading it into memory
+
+  Args:
+      server (smtplib.SMTP): the connected server
+      sender (str): the envelope sender
+      recipients (list): the envelope recipients
+      f (file): the message file (lines end with CRLF)
+
+  Raises:
+      smtplib.SMTPException: if the server refuses the mail
+  """
+
+  server.ehlo_or_helo_if_needed()
+  code, response = server.mail(sender)
+  if code != 250:
+    raise smtplib.SMTPSenderRefused(code, response, sender)
+  refused = {}
+  for r in recipients:
+    code, response = server.rcpt(r)
+    if code not in (250, 251):
+      refused[r] = (code, response)
+  if len(refused) == len(recipients):
+    server.rset()
+    raise smtplib.SMTPRecipientsRefused(refused)
+
+  code, response = server.docmd("data")
+  if code != 354:
+    raise smtplib.SMTPDataError(code, response)
+  f.seek(0)
+  buffer = []
+  size = 0
+  for line in f:
+    if line.startswith(b"."):
+      # Dot-stuffing (RFC 5321 4.5.2)
+      line = b"." + line
+    buffer.append(line)
+    size += len(line)
+    if size >= SEND_SIZE:
+      server.send(b"".join(buffer))
+      buffer = []
+      size = 0
+  buffer.append(b".\r\n")
+  server.send(b"".join(buffer))
+  code, response = server.getreply()
+  if code != 250:
+    raise smtplib.SMTPDataError(code, response)
+
 
 def log2mail(config_path: str,
              subject: str,
@@ -34,21 +178,37 @@ def log2mail(config_path: str,
              sender: str,
              recipients: list,
              file_paths: list = None,
-             askpass: bool = False):
+             askpass: bool = False,
+             attachments: dict = None,
+             max_size: int = None,
+             compress: bool = False):
   """Send an email
 
+  The message is written to a temporary file and streamed to the mail
+  server, so large attachments are never read into memory.
+
   Args:
       config_path (str): path to config file that contains login data
       subject (str): subject of the mail
       message_text (str): content of the mail
       sender (str): sender of the mail
       recipients (list): recipient of the mail
-      file_paths (list, optional): Path to a text file that gets
-          attached. Defaults to None.
+      file_paths (list, optional): Paths to files that get attached.
+          Defaults to None.
+      askpass (bool, optional): ask for the password instead of using
+          the one of the config file. Defaults to False.
+      attachments (dict, optional): contents (str) that get attached
+          as files, by filename. Defaults to None.
+      max_size (int, optional): attach only the last `max_size` bytes
+          of larger attachments. Defaults to None (no limit).
+      compress (bool, optional): compress the attachments with `gzip`.
+          Defaults to False.
   """
 
   if file_paths == None:
     file_paths = []
+  if attachments == None:
+    attachments = {}
 
   # Read config data
   try:
@@ -79,37 +239,52 @@ def log2mail(config_path: str,
   port = 465
   context = ssl.create_default_context()
 
+  # Collect attachments: (filename, binary file, size)
+  sources = []
+  for fp in file_paths:
+    try:
+      source = open(fp, "rb")
+    except FileNotFoundError:
+      pass
+    else:
+      sources.append(
+          (os.path.basename(fp), source, os.fstat(source.fileno()).st_size))
+  for filename, content in attachments.items():
+    content = content.encode("utf-8")
+    sources.append((filename, io.BytesIO(content), len(content)))
+
   # Create message
-  if file_paths:
-    message = MIMEMultipart()
-  else:
-    message = EmailMessage()
+  message = EmailMessage(policy=__policy)
   message["Subject"] = subject
   message["From"] = sender
   message["To"] = ", ".join(recipients)
 
-  if file_paths:
-    # Attach message text
-    message.attach(MIMEText(message_text))
-
-    # Attach file
-    for fp in file_paths:
-      try:
-        with open(fp, "rb") as f:
-          attachment = MIMEApplication(f.read())
-      except FileNotFoundError:
-        pass
-      else:
-        attachment.add_header("Content-Disposition",
-                              "attachment",
-                              filename=f"{os.path.basename(fp)}")
-        message.attach(attachment)
-  else:
-    message.set_content(message_text)
+  with tempfile.TemporaryFile() as f:
+    if sources:
+      boundary = f"==============={secrets.token_hex(16)}=="
+      message["MIME-Version"] = "1.0"
+      message["Content-Type"] = f'multipart/mixed; boundary="{boundary}"'
+      __write_headers(f, message)
+
+      # Attach message text
+      text = EmailMessage(policy=__policy)
+      text.set_content(message_text)
+      f.write(f"--{boundary}\r\n".encode())
+      f.write(text.as_bytes())
 
-  message = message.as_bytes()
+      # Attach files
+      for filename, source, size in sources:
+        with source:
+          __write_attachment(f, boundary, filename, source, size, max_size,
+                             compress)
+      f.write(f"--{boundary}--\r\n".encode())
+    else:
+      message.set_content(message_text)
+      f.write(message.as_bytes())
 
-  # Send mail
-  with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-    server.login(username, password)
-    server.sendmail(username, receiver_mail, message)
+    # Send mail
+    if isinstance(receiver_mail, str):
+      receiver_mail = [receiver_mail]
+    with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
+      server.login(username, password)
+      __send(server, username, receiver_mail, f)
@@ -18,6 +18,12 @@ An action gets calles with the following parameters:
     brief_information (str): brief event information
     stdout (str): captured watcher output (which contains the event)
     timestamp (time.struct_time): a timestamp (which denotes the event time)
+    fields (dict, keyword argument): named fields of the event, e.g. the
+        named groups of the event regexp (may be None)
+    handler_name (str, keyword argument): the handler of the event
+    event_name (str, keyword argument): the name of the event
+
+The keyword arguments are only passed if the action accepts them.
 
 The action can deal with this information as it like. It may also
 access configuration data stored in the config file via calling
@@ -29,7 +35,10 @@ keywords. These keywords can be parsed by importing logdog.strings and
 using the function parse_string().
 
 Functions:
+    file(str, str, str): Write into file
     log2mail(str, str, str): Send mail
+    store(str, str, str): Append event to the event store
+    webhook(str, str, str): Post event to an HTTP endpoint
 
 .. _MIT:
    https://github.com/TheTimmoth/logdog/blob/main/LICENSE
@@ -37,8 +46,12 @@ Functions:
 
 from .file import file
 from .log2mail import log2mail
+from .store import store
+from .webhook import webhook
 
 __all__ = [
-    "file"
+    "file",
     "log2mail",
+    "store",
+    "webhook",
 ]
@@ -20,13 +20,21 @@ import logdog.strings as strings
 
 
 def file(detailed_information: str, brief_information: str, stdout: str,
-         timestamp: time.struct_time):
+         timestamp: time.struct_time,
+         fields: dict = None,
+         handler_name: str = "",
+         event_name: str = ""):
   """Sends a mail according to the `config`
 
   Args:
       detailed_information (str): used as message text of the mail
       brief_information (str): used as subject of the mail
       stdout (str): may be included in the mail (keyword $STDOUT)
+      fields (dict, optional): may be included in the mail (keywords
+          $NAME of the field). Defaults to None.
+      handler_name (str, optional): the handler of the event.
+          Defaults to "".
+      event_name (str, optional): the event. Defaults to "".
   """
 
   action_data = config.get_action_data(file.__name__)
@@ -41,4 +49,5 @@ def file(detailed_information: str, brief_information: str, stdout: str,
             brief_information=brief_information,
             stdout=stdout,
             timestamp=timestamp,
+            fields=fields,
         ))
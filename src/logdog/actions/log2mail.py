@@ -23,30 +23,58 @@ import logdog.strings as strings
 
 
 def log2mail(detailed_information: str, brief_information: str, stdout: str,
-             timestamp: time.struct_time):
+             timestamp: time.struct_time,
+             fields: dict = None,
+             handler_name: str = "",
+             event_name: str = ""):
   """Sends a mail according to the `config`
 
+  Files of `attach` are attached to the mail (only the last
+  `max_attachment_size` bytes, compressed if `compress` is set). If
+  `attach_stdout` is set, `stdout` is attached as `stdout.txt` instead
+  of being inlined (keyword $STDOUT refers to the attachment).
+
   Args:
       detailed_information (str): used as message text of the mail
       brief_information (str): used as subject of the mail
       stdout (str): may be included in the mail (keyword $STDOUT)
+      fields (dict, optional): may be included in the mail (keywords
+          $NAME of the field). Defaults to None.
+      handler_name (str, optional): the handler of the event.
+          Defaults to "".
+      event_name (str, optional): the event. Defaults to "".
   """
 
   action_data = config.get_action_data(log2mail.__name__)
 
   print("Sending mail...")
 
-  for s in action_data["to"]:
-    strings.parse_string(s, detailed_information, brief_information, stdout),
+  to = [
+      strings.parse_string(s, detailed_information, brief_information, stdout,
+                           timestamp, fields) for s in action_data["to"]
+  ]
+  attach = [
+      strings.parse_string(s, detailed_information, brief_information, stdout,
+                           timestamp, fields)
+      for s in action_data.get("attach", [])
+  ]
+  attachments = {}
+  if action_data.get("attach_stdout", False):
+    attachments["stdout.txt"] = stdout
+    stdout = "(attached as stdout.txt)"
 
   l2m(
       strings.parse_string(action_data["config"], detailed_information,
-                           brief_information, stdout, timestamp),
+                           brief_information, stdout, timestamp, fields),
       strings.parse_string(action_data["subject"], detailed_information,
-                           brief_information, stdout, timestamp),
+                           brief_information, stdout, timestamp, fields),
       strings.parse_string(action_data["message"], detailed_information,
-                           brief_information, stdout, timestamp),
+                           brief_information, stdout, timestamp, fields),
       strings.parse_string(action_data["from"], detailed_information,
-                           brief_information, stdout, timestamp),
-      action_data["to"],
+                           brief_information, stdout, timestamp, fields),
+      to,
+      attach,
+      attachments=attachments,
+      max_size=action_data.get("max_attachment_size"),
+      compress=action_data.get("compress", False),
   )
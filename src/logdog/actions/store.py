@@ -0,0 +1,211 @@
+"""store action
+
+Filename: store.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+The store action appends events to the event store (see
+`logdog.eventstore`), so they can be queried with `logdog events`.
+Events are queued and inserted in batches by a background thread.
+
+Functions:
+    store(str, str, str, time.struct_time): queue event for storing
+    flush(): store the queued events and stop the writer thread
+    probe(callable): call a function once the queued events are stored
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+
+import logdog.config as config
+import logdog.eventstore as eventstore
+import logdog.scheduler as scheduler
+import logdog.strings as strings
+
+__queue = None  # Queued records (None: writer thread not started yet)
+__writer = None  # Running writer thread
+__pid = None  # Process the writer thread belongs to
+
+__STOP = None  # Sentinel that stops the writer thread
+
+
+class __Flush:
+  """Sentinel that completes the current batch (queued by its timer)
+  """
+
+
+class __Probe:
+  """Queued behind the records by `probe()`
+
+  Args:
+      done (callable): called once the records before have been stored
+  """
+
+  def __init__(self, done):
+    self.done = done
+
+
+def __flush(flush: __Flush):
+  """Queue the sentinel that completes the current batch
+  """
+
+  try:
+    __queue.put_nowait(flush)
+  except queue.Full:
+    # The batch is completed by its size
+    pass
+
+
+def __write():
+  """Take queued records and append them to the store in batches
+
+  A batch is written as soon as it has `batch_size` records or
+  `batch_timeout` seconds after its first record was queued. The
+  timeout is a timer of the scheduler of the process (see
+  `logdog.scheduler`).
+  """
+
+  action_data = config.get_action_data(store.__name__)
+  batch_size = action_data.get("batch_size", 100)
+  batch_timeout = action_data.get("batch_timeout", 1)
+  s = eventstore.Store(action_data["directory"], action_data.get("retention"))
+  timers = scheduler.get()
+
+  stop = False
+  while not stop:
+    record = __queue.get()
+    if record is __STOP:
+      break
+    if isinstance(record, __Flush):
+      # Timer of a batch that has been completed by its size
+      continue
+    if isinstance(record, __Probe):
+      record.done()
+      continue
+    batch = [record]
+    probe = None
+    flush = __Flush()
+    timer = timers.call_later(batch_timeout, __flush, flush)
+    while len(batch) < batch_size:
+      record = __queue.get()
+      if record is flush:
+        break
+      if record is __STOP:
+        stop = True
+        break
+      if isinstance(record, __Probe):
+        # Store the records before the probe first
+        probe = record
+        break
+      if not isinstance(record, __Flush):
+        batch.append(record)
+    timers.cancel(timer)
+
+    try:
+      s.add(batch)
+    except Exception as e:
+      sys.stderr.write(f"Storing {len(batch)} events failed: {e}\n")
+    if probe is not None:
+      probe.done()
+  s.close()
+
+
+def flush():
+  """Store the queued events and stop the writer thread
+
+  Handler processes exit without running `atexit` functions, so they
+  call this when their input has ended. The writer is started again by
+  the next event.
+  """
+
+  global __pid
+
+  if __pid != os.getpid():
+    return
+  __pid = None
+  __queue.put(__STOP)
+  __writer.join(10)
+
+
+def probe(done):
+  """Call `done` once the records queued before have been stored
+
+  Used by canaries to measure the backlog of the writer (see
+  `actions_.probe_actions()`).
+
+  Args:
+      done (callable): called without arguments by the writer thread
+          (or at once if the writer is not running). It is not called
+          if the queue is full.
+  """
+
+  if __pid != os.getpid():
+    done()
+    return
+  try:
+    __queue.put_nowait(__Probe(done))
+  except queue.Full:
+    pass
+
+
+def __start_writer():
+  """Start the writer thread of the current process
+  """
+
+  global __queue
+  global __writer
+  global __pid
+
+  action_data = config.get_action_data(store.__name__)
+
+  __pid = os.getpid()
+  __queue = queue.Queue(action_data.get("queue_size", 10000))
+  __writer = threading.Thread(target=__write, daemon=True)
+  __writer.start()
+  atexit.register(flush)
+
+
+def store(detailed_information: str, brief_information: str, stdout: str,
+          timestamp: time.struct_time,
+          fields: dict = None,
+          handler_name: str = "",
+          event_name: str = ""):
+  """Queues the event for appending it to the event store of the `config`
+
+  Args:
+      detailed_information (str): not stored
+      brief_information (str): stored with its keywords replaced
+      stdout (str): stored as context of the event
+      timestamp (time.struct_time): the time of the event
+      fields (dict, optional): stored as fields of the event.
+          Defaults to None.
+      handler_name (str, optional): the handler of the event.
+          Defaults to "".
+      event_name (str, optional): the event. Defaults to "".
+  """
+
+  # Handlers run in forked processes: start own writer in each process
+  if __pid != os.getpid():
+    __start_writer()
+
+  try:
+    __queue.put_nowait({
+        "time": time.mktime(timestamp) if timestamp else time.time(),
+        "handler": handler_name,
+        "event": event_name,
+        "brief_information": strings.parse_string(brief_information,
+                                                  fields=fields),
+        "fields": dict(fields or {}),
+        "context": stdout,
+    })
+  except queue.Full:
+    sys.stderr.write("Store queue is full, dropping event\n")
@@ -0,0 +1,376 @@
+"""webhook action
+
+Filename: webhook.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+The webhook action posts events as `json` payloads to an HTTP endpoint.
+Events are queued and sent by background threads, so the handler that
+detected the event is not blocked by the network. The sender threads
+share a pool of persistent (HTTP/1.1 keep-alive) connections, may
+collect several events into one array payload and retry failed
+requests with exponential backoff and jitter.
+
+Functions:
+    webhook(str, str, str, time.struct_time): queue event for sending
+    flush(): send the queued events and stop the sender threads
+    probe(callable): call a function once the queued events are sent
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import atexit
+import gzip
+import http.client
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+import logdog.config as config
+import logdog.strings as strings
+
+__queue = None  # Queued events (None: sender threads not started yet)
+__pool = None  # Connection pool shared by the sender threads
+__senders = []  # Running sender threads
+__pid = None  # Process the sender threads belong to
+
+__STOP = None  # Sentinel that stops a sender thread
+
+
+class __Probe:
+  """Queued behind the events by `probe()`
+
+  Args:
+      done (callable): called once the events before have been sent
+  """
+
+  def __init__(self, done):
+    self.done = done
+
+
+class ConnectionPool:
+  """A pool of persistent HTTP connections to one host
+
+  Connections are kept open after a request (keep-alive) and handed
+  out again to the next request. Broken connections are closed and
+  replaced by new ones.
+
+  Args:
+      url (str): the url whose host the connections are opened to
+      size (int): maximum number of idle connections to keep
+      timeout (float): socket timeout in seconds
+  """
+
+  def __init__(self, url: str, size: int, timeout: float):
+    u = urllib.parse.urlsplit(url)
+    if u.scheme == "https":
+      self.connection_class = http.client.HTTPSConnection
+    elif u.scheme == "http":
+      self.connection_class = http.client.HTTPConnection
+    else:
+      raise ValueError(f"Unsupported url scheme {u.scheme} in {url}")
+    self.host = u.hostname
+    self.port = u.port
+    self.path = u.path or "/"
+    if u.query:
+      self.path += "?" + u.query
+    self.size = size
+    self.timeout = timeout
+    self.__idle = []
+    self.__lock = threading.Lock()
+
+  def get(self) -> http.client.HTTPConnection:
+    """Get an idle connection or open a new one
+
+    Returns:
+        http.client.HTTPConnection: a connection to the host
+    """
+
+    with self.__lock:
+      if self.__idle:
+        return self.__idle.pop()
+    return self.new()
+
+  def new(self) -> http.client.HTTPConnection:
+    """Open a new connection
+
+    Returns:
+        http.client.HTTPConnection: a connection to the host
+    """
+
+    return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+  def put(self, connection: http.client.HTTPConnection):
+    """Return a connection after a successful request
+
+    Args:
+        connection (http.client.HTTPConnection): the connection
+    """
+
+    with self.__lock:
+      if len(self.__idle) < self.size:
+        self.__idle.append(connection)
+        return
+    connection.close()
+
+  def close(self):
+    """Close all idle connections
+    """
+
+    with self.__lock:
+      for c in self.__idle:
+        c.close()
+      self.__idle = []
+
+
+def __render(template, event: tuple):
+  """Replace keywords in all strings of a payload template
+
+  Args:
+      template: the payload template (str, list or dict)
+      event (tuple): (detailed_information, brief_information, stdout,
+          timestamp, fields) of the event
+
+  Returns:
+      the payload with keywords replaced
+  """
+
+  if isinstance(template, str):
+    return strings.parse_string(template, *event)
+  if isinstance(template, list):
+    return [__render(t, event) for t in template]
+  if isinstance(template, dict):
+    return {k: __render(v, event) for k, v in template.items()}
+  return template
+
+
+def __send(connection: http.client.HTTPConnection, body: bytes,
+           headers: dict) -> http.client.HTTPResponse:
+  """Send the request and read the status line of the response
+
+  Returns:
+      http.client.HTTPResponse: the response
+  """
+
+  connection.request("POST", __pool.path, body=body, headers=headers)
+  return connection.getresponse()
+
+
+def __post(action_data: dict, body: bytes) -> bool:
+  """Post `body` to the webhook url, retrying on failures
+
+  Connection errors, `429` and `5xx` responses are retried up to
+  `retries` times. The delay before a retry is drawn uniformly from
+  [0, backoff * 2^attempt] ("full jitter") to spread out retries of
+  several hosts. If the server has closed an idle keep-alive connection
+  before it responded, the request is sent again at once on a new
+  connection without counting it as attempt.
+
+  Args:
+      action_data (dict): the config data of the action
+      body (bytes): the request body
+
+  Returns:
+      bool: `True` if the request succeeded, `False` otherwise
+  """
+
+  headers = {"Content-Type": "application/json"}
+  headers.update(action_data.get("headers", {}))
+  if action_data.get("gzip", False):
+    body = gzip.compress(body)
+    headers["Content-Encoding"] = "gzip"
+
+  retries = max(0, action_data.get("retries", 3))
+  backoff = action_data.get("backoff", 0.5)
+
+  error = ""
+  for attempt in range(retries + 1):
+    if attempt:
+      time.sleep(random.uniform(0, backoff * 2**(attempt - 1)))
+
+    connection = __pool.get()
+    reused = connection.sock is not None
+    try:
+      try:
+        response = __send(connection, body, headers)
+      except ConnectionError:
+        if not reused:
+          raise
+        # Idle connection closed by the server (RemoteDisconnected etc.)
+        connection.close()
+        connection = __pool.new()
+        response = __send(connection, body, headers)
+      response.read()
+    except (OSError, http.client.HTTPException) as e:
+      connection.close()
+      error = str(e)
+      continue
+
+    if response.will_close:
+      connection.close()
+    else:
+      __pool.put(connection)
+
+    if response.status < 300:
+      return True
+    error = f"{response.status} {response.reason}"
+    if response.status != 429 and response.status < 500:
+      break
+
+  sys.stderr.write(f"Webhook {action_data['url']} failed: {error}\n")
+  return False
+
+
+def __sender():
+  """Take queued events, build payloads and send them
+
+  Up to `batch_size` events are sent as one array payload. A batch is
+  sent as soon as it is full or `batch_timeout` seconds after its first
+  event was queued.
+  """
+
+  action_data = config.get_action_data(webhook.__name__)
+  template = action_data.get("payload", {
+      "brief_information": "$BRIEF_INFORMATION",
+      "detailed_information": "$DETAILED_INFORMATION",
+      "timestamp": "$TIMESTAMP",
+  })
+  batch_size = action_data.get("batch_size", 1)
+  batch_timeout = action_data.get("batch_timeout", 5)
+
+  stop = False
+  while not stop:
+    event = __queue.get()
+    if event is __STOP:
+      break
+    if isinstance(event, __Probe):
+      event.done()
+      continue
+    batch = [event]
+    probe = None
+    deadline = time.monotonic() + batch_timeout
+    while len(batch) < batch_size:
+      try:
+        event = __queue.get(timeout=max(0, deadline - time.monotonic()))
+      except queue.Empty:
+        break
+      if event is __STOP:
+        stop = True
+        break
+      if isinstance(event, __Probe):
+        # Send the events before the probe first
+        probe = event
+        break
+      batch.append(event)
+
+    payloads = [__render(template, e) for e in batch]
+    body = payloads if batch_size > 1 else payloads[0]
+    __post(action_data, json.dumps(body).encode("UTF-8"))
+    if probe is not None:
+      probe.done()
+
+
+def probe(done):
+  """Call `done` once the events queued before have been sent
+
+  Used by canaries to measure the backlog of the senders (see
+  `actions_.probe_actions()`).
+
+  Args:
+      done (callable): called without arguments by a sender thread (or
+          at once if no sender is running). It is not called if the
+          queue is full.
+  """
+
+  if __pid != os.getpid():
+    done()
+    return
+  try:
+    __queue.put_nowait(__Probe(done))
+  except queue.Full:
+    pass
+
+
+def flush():
+  """Send the queued events and stop the sender threads
+
+  Handler processes exit without running `atexit` functions, so they
+  call this when their input has ended. The senders are started again
+  by the next event.
+  """
+
+  global __pid
+
+  if __pid != os.getpid():
+    return
+  __pid = None
+  for _ in __senders:
+    __queue.put(__STOP)
+  for t in __senders:
+    t.join(config.get_action_data(webhook.__name__).get("timeout", 10))
+  __pool.close()
+
+
+def __start_senders():
+  """Start the sender threads of the current process
+  """
+
+  global __queue
+  global __pool
+  global __senders
+  global __pid
+
+  action_data = config.get_action_data(webhook.__name__)
+  connections = action_data.get("connections", 1)
+
+  __pid = os.getpid()
+  __queue = queue.Queue(action_data.get("queue_size", 10000))
+  __pool = ConnectionPool(action_data["url"], connections,
+                          action_data.get("timeout", 10))
+  __senders = []
+  for _ in range(connections):
+    __senders.append(threading.Thread(target=__sender, daemon=True))
+    __senders[-1].start()
+  atexit.register(flush)
+
+
+def webhook(detailed_information: str, brief_information: str, stdout: str,
+            timestamp: time.struct_time,
+            fields: dict = None,
+            handler_name: str = "",
+            event_name: str = ""):
+  """Queues the event for posting it to the webhook url of the `config`
+
+  Args:
+      detailed_information (str): may be used in the payload
+          (keyword $DETAILED_INFORMATION)
+      brief_information (str): may be used in the payload
+          (keyword $BRIEF_INFORMATION)
+      stdout (str): may be used in the payload (keyword $STDOUT)
+      timestamp (time.struct_time): may be used in the payload
+          (keyword $TIMESTAMP)
+      fields (dict, optional): may be used in the payload (keywords
+          $NAME of the field). Defaults to None.
+      handler_name (str, optional): the handler of the event.
+          Defaults to "".
+      event_name (str, optional): the event. Defaults to "".
+  """
+
+  # Handlers run in forked processes: start own senders in each process
+  if __pid != os.getpid():
+    __start_senders()
+
+  try:
+    __queue.put_nowait(
+        (detailed_information, brief_information, stdout, timestamp,
+         fields))
+  except queue.Full:
+    sys.stderr.write("Webhook queue is full, dropping event\n")
@@ -9,17 +9,24 @@ License: `MIT`_ (Please look at license of surrounding project)
 Functions:
     discover_actions(): get all callable action names
     check_action_existence(str): check if action is callable
-    run_action(str, *args): run action
+    run_action(str, *args, **kwargs): run action
+    flush_actions(): send the events queued by actions
+    probe_actions(list, callable): call a function once the queued
+        events of actions have been handled
 
 .. _MIT:
    https://github.com/TheTimmoth/logdog/blob/main/LICENSE
 """
 
+import inspect
 import re
+import sys
+import threading
 
 import logdog.actions as actions
 
 __action_names = []  # Names of actions
+__parameters = {}  # Keyword parameters per action (None: any)
 
 
 def discover_actions():
@@ -50,12 +57,84 @@ def check_action_existence(action: str) -> bool:
   return (True if action in __action_names else False)
 
 
-def run_action(action: str, *args):
-  """Runs action with arguments `*args`
+def run_action(action: str, *args, **kwargs):
+  """Runs action with arguments `*args` and `**kwargs`
+
+  Keyword arguments the action does not accept are left out, so actions
+  that only take the positional parameters keep working.
 
   Args:
       action (str): name of the action
       *args: paramters that are passed to the action
+      **kwargs: keyword paramters that are passed to the action
+  """
+
+  f = getattr(actions, action)
+  if action not in __parameters:
+    p = inspect.signature(f).parameters.values()
+    if any(x.kind is x.VAR_KEYWORD for x in p):
+      __parameters[action] = None
+    else:
+      __parameters[action] = {
+          x.name
+          for x in p
+          if x.kind in (x.POSITIONAL_OR_KEYWORD, x.KEYWORD_ONLY)
+      }
+  names = __parameters[action]
+  if names is not None:
+    kwargs = {k: v for k, v in kwargs.items() if k in names}
+  f(*args, **kwargs)
+
+
+def flush_actions():
+  """Send the events queued by actions of the current process
+
+  Actions that queue events (e.g. `webhook`) provide a function
+  `flush()` in their module.
+  """
+
+  for a in __action_names:
+    flush = getattr(sys.modules[getattr(actions, a).__module__], "flush", None)
+    if flush is not None:
+      flush()
+
+
+def probe_actions(action_names: list, done):
+  """Call `done` once the events queued by actions have been handled
+
+  Actions that queue events provide a function `probe(callable)` in
+  their module, which queues a probe behind the events and calls the
+  function once the probe has been taken from the queue and the events
+  before it have been handled. `done` is called (in a thread of an
+  action or at once if no action queues events) after all probes. It
+  is not called if an action dropped its probe (e.g. its queue is
+  full).
+
+  Args:
+      action_names (list): the actions
+      done (callable): called without arguments
   """
 
-  getattr(actions, action)(*args)
+  probes = []
+  for a in set(action_names):
+    if check_action_existence(a):
+      probe = getattr(sys.modules[getattr(actions, a).__module__], "probe",
+                      None)
+      if probe is not None:
+        probes.append(probe)
+  if not probes:
+    done()
+    return
+
+  remaining = [len(probes)]
+  lock = threading.Lock()
+
+  def handled():
+    with lock:
+      remaining[0] -= 1
+      if remaining[0]:
+        return
+    done()
+
+  for probe in probes:
+    probe(handled)
@@ -0,0 +1,487 @@
+"""Benchmark a handler under each engine mode
+
+Filename: benchmark.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+A benchmark feeds recorded log files (or synthetic lines) through the
+reading, prefilter, multi-line and matching path of a handler under
+each engine mode:
+    inline: in the benchmark process, like `logdog replay`
+    fork: in a handler process forked from the benchmark process
+    forkserver: in a handler process forked from a server process
+
+A writer thread writes the input into a pipe that the engine reads like
+the output of a watcher. Every `sample` lines it inserts a canary line
+(see `logdog.canary`) with the time it has been written, so the latency
+from writing a line until the engine has checked it against the events
+is sampled throughout the run. Actions are not run.
+
+The results (lines per second, latency percentiles, CPU time per line
+and peak RSS per mode) are compared with a baseline file: a metric
+that got worse by more than its threshold (in percent) is a
+regression. The results are saved as new baseline if there is no
+baseline yet or nothing regressed, so a regression is reported until
+it is fixed or the baseline is updated explicitly. A baseline of
+another handler or input is never compared.
+
+Functions:
+    synthetic_lines(list, int) -> generator: yield synthetic log lines
+    run(str, str, iterable, int) -> dict: run an engine mode
+    compare(dict, dict, dict) -> list: compare results with a baseline
+    bench(str, str, list, ...) -> list: run the benchmark of a config
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import contextlib
+import json
+import multiprocessing as mp
+import multiprocessing.connection
+import os
+import queue
+import random
+import resource
+import socket
+import threading
+import time
+
+import logdog.actions_ as actions
+import logdog.canary as canary
+import logdog.config as config
+import logdog.matcher as matcher
+import logdog.multiline as multiline
+import logdog.prefilter as prefilter
+import logdog.preload as preload
+import logdog.sources as sources
+import logdog.timestamps as timestamps
+
+MODES = ("inline", "fork", "forkserver")  # Engine modes
+KEY = b"logdog-bench"  # Key of the canaries of the benchmark (all modes)
+
+# Regression thresholds in percent per metric
+THRESHOLDS = {
+    "lines_per_second": 10,
+    "latency_p99": 25,
+    "cpu_per_line": 10,
+    "rss": 20,
+}
+
+# Metrics that are better if they are higher
+__higher = ("lines_per_second",)
+
+__words = ("session", "opened", "closed", "for", "user", "root", "from",
+           "port", "connection", "accepted", "request", "GET", "/index.html",
+           "200", "timeout", "queue", "worker", "started", "finished")
+
+
+def synthetic_lines(literals: list, count: int):
+  """Yield synthetic syslog lines
+
+  Every 100th line contains one of `literals`, so prefilters pass it
+  and events with these literals are checked. The lines are the same
+  for every run.
+
+  Args:
+      literals (list): the literals of the events
+      count (int): number of lines
+
+  Yields:
+      bytes: the lines without newline
+  """
+
+  r = random.Random(0)
+  host = socket.gethostname()
+  for i in range(count):
+    t = time.strftime("%b %d %H:%M:%S", time.localtime(1620126000 + i // 100))
+    words = " ".join(r.choice(__words) for _ in range(r.randint(4, 12)))
+    if literals and i % 100 == 99:
+      words += " " + literals[i // 100 % len(literals)]
+    yield f"{t} {host} app[{r.randint(100, 9999)}]: {words}".encode("UTF-8")
+
+
+def __recorded_lines(files: list):
+  """Yield the lines of `files`
+  """
+
+  for path in files:
+    with open(path, "rb") as f:
+      for l in f:
+        yield l.rstrip(b"\n")
+
+
+def __write(fd: int, lines, sample: int, result: dict):
+  """Write `lines` into `fd` with a canary every `sample` lines
+
+  The number of lines and the CPU time of the writer are put into
+  `result`.
+  """
+
+  cpu = time.thread_time()
+  count = 0
+  serial = 0
+  chunk = []
+  size = 0
+  try:
+    for l in lines:
+      chunk.append(l)
+      size += len(l) + 1
+      count += 1
+      if count % sample == 0:
+        serial += 1
+        chunk.append(
+            canary.line(KEY, "bench", serial, time.time()).encode("UTF-8"))
+      if size >= sources.CHUNK_SIZE:
+        os.write(fd, b"\n".join(chunk) + b"\n")
+        chunk = []
+        size = 0
+    if chunk:
+      os.write(fd, b"\n".join(chunk) + b"\n")
+  except BrokenPipeError:
+    pass
+  finally:
+    os.close(fd)
+  result["lines"] = count
+  result["cpu"] = time.thread_time() - cpu
+
+
+def __engine(handler_name: str, fd: int) -> dict:
+  """Read the lines of `fd` and check them for the events of a handler
+
+  Returns:
+      dict: `matches`, `latencies` (seconds), `cpu` (CPU time of the
+          process in seconds) and `rss` (peak RSS in KiB)
+  """
+
+  handler_data = config.get_handler_data(handler_name)
+  events = preload.events(handler_name)
+  parser = None
+  if "timestamp" in handler_data:
+    parser = timestamps.Parser(**handler_data["timestamp"])
+  result = {"matches": 0, "latencies": []}
+
+  def emit(event: dict, lines: list, fields: dict):
+    if event is canary.PROBE:
+      result["latencies"].append(time.time() - fields["sent"])
+    else:
+      result["matches"] += 1
+
+  m = matcher.Matcher(handler_name,
+                      events,
+                      emit,
+                      timestamps=parser,
+                      probe=lambda line: canary.parse(line, KEY))
+
+  literals = None
+  if handler_data.get("prefilter") and "multiline" not in handler_data:
+    literals = prefilter.required_literals(events)
+  if literals is not None:
+    lines = prefilter.filter_lines(
+        fd, literals + [canary.MARK],
+        max([e["prev_lines"] for e in events], default=0),
+        max([e["next_lines"] for e in events], default=0))
+  elif "multiline" in handler_data:
+    lines = multiline.assemble(sources.read_lines(fd, keep_indent=True),
+                               handler_data["multiline"])
+  else:
+    lines = sources.read_lines(fd)
+
+  cpu = time.process_time()
+  # Matches are printed like in a handler process, but not shown
+  with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    for line in lines:
+      m.feed(line)
+    m.flush()
+  result["cpu"] = time.process_time() - cpu
+  result["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return result
+
+
+def __worker(handler_name: str, reader, results, inherited: int):
+  """Run the engine in a handler process and put the result into
+  `results`
+
+  A forked process has inherited the write end of the pipe (`inherited`,
+  None for other start methods), which is closed so the pipe ends. If
+  the engine fails, the error is put into `results` as `error`.
+  """
+
+  if inherited is not None:
+    os.close(inherited)
+  fd = os.dup(reader.fileno())
+  reader.close()
+  try:
+    result = __engine(handler_name, fd)
+  except Exception as e:
+    result = {"error": f"{type(e).__name__}: {e}"}
+  finally:
+    os.close(fd)
+  results.put(result)
+
+
+def __result(p: mp.Process, results) -> dict:
+  """Wait for the result of the handler process `p`
+
+  Raises:
+      RuntimeError: if the engine failed or the process exited without
+          a result
+  """
+
+  while True:
+    try:
+      result = results.get(timeout=1)
+      break
+    except queue.Empty:
+      if p.exitcode is None:
+        continue
+    # The result may still be on its way through the queue
+    try:
+      result = results.get(timeout=1)
+      break
+    except queue.Empty:
+      raise RuntimeError(
+          f"{p.name} exited with code {p.exitcode} without a result")
+  if "error" in result:
+    raise RuntimeError(f"{p.name} failed: {result['error']}")
+  return result
+
+
+def run(mode: str, handler_name: str, lines, sample: int = 1000) -> dict:
+  """Run the benchmark of a handler under an engine mode
+
+  The config file has to be parsed before.
+
+  Args:
+      mode (str): the engine mode (see `MODES`)
+      handler_name (str): the handler
+      lines (iterable): the input lines (bytes without newline)
+      sample (int, optional): lines per latency sample. Defaults to 1000.
+
+  Returns:
+      dict: the results: `lines`, `seconds`, `lines_per_second`,
+          `matches`, `samples`, `latency_p50`, `latency_p90`,
+          `latency_p99`, `latency_max` (milliseconds), `cpu_per_line`
+          (microseconds) and `rss` (peak RSS in KiB)
+
+  Raises:
+      ValueError: if the mode is not supported
+      RuntimeError: if the handler process failed
+  """
+
+  if mode not in MODES:
+    raise ValueError(f"Unsupported engine mode {mode}")
+  written = {}
+  r, w = os.pipe()
+
+  if mode == "inline":
+    start = time.perf_counter()
+    writer = threading.Thread(target=__write,
+                              args=(w, lines, sample, written))
+    writer.start()
+    try:
+      result = __engine(handler_name, r)
+    finally:
+      os.close(r)
+    writer.join()
+    seconds = time.perf_counter() - start
+    result["cpu"] -= written["cpu"]
+  else:
+    context = mp.get_context(mode)
+    if mode == "forkserver":
+      os.environ[preload.CONFIG_VARIABLE] = os.path.abspath(config.config_path)
+      context.set_forkserver_preload(["logdog.forkserver"])
+    else:
+      preload.load()
+    results = context.Queue()
+    reader = mp.connection.Connection(r, writable=False)
+    p = context.Process(target=__worker,
+                        args=(handler_name, reader, results,
+                              w if mode == "fork" else None),
+                        name=f"Benchmark: {handler_name}")
+    p.start()
+    reader.close()
+    os.environ.pop(preload.CONFIG_VARIABLE, None)
+
+    # The process has started: measure the engine, not its start
+    start = time.perf_counter()
+    writer = threading.Thread(target=__write,
+                              args=(w, lines, sample, written))
+    writer.start()
+    writer.join()
+    try:
+      result = __result(p, results)
+      seconds = time.perf_counter() - start
+    finally:
+      p.join()
+
+  latencies = sorted(result["latencies"])
+  count = max(written["lines"], 1)
+  report = {
+      "lines": written["lines"],
+      "seconds": seconds,
+      "lines_per_second": written["lines"] / max(seconds, 1e-9),
+      "matches": result["matches"],
+      "samples": len(latencies),
+      "cpu_per_line": result["cpu"] / count * 1e6,
+      "rss": result["rss"],
+  }
+  for k, q in (("latency_p50", 0.5), ("latency_p90", 0.9),
+               ("latency_p99", 0.99), ("latency_max", 1)):
+    report[k] = (latencies[min(len(latencies) - 1, int(q * len(latencies)))] *
+                 1000 if latencies else None)
+  return report
+
+
+def compare(previous: dict, current: dict, thresholds: dict) -> list:
+  """Compare the results with the previous baseline
+
+  Args:
+      previous (dict): the results of the previous baseline per mode
+      current (dict): the new results per mode
+      thresholds (dict): the regression threshold in percent per metric
+
+  Returns:
+      list: the regressions (mode, metric, previous value, new value,
+          change in percent)
+  """
+
+  regressions = []
+  for mode, results in current.items():
+    if mode not in previous:
+      continue
+    for metric, threshold in thresholds.items():
+      old = previous[mode].get(metric)
+      new = results.get(metric)
+      if not old or new is None:
+        continue
+      change = (new - old) / old * 100
+      worse = -change if metric in __higher else change
+      if worse > threshold:
+        regressions.append((mode, metric, old, new, change))
+  return regressions
+
+
+def __print_results(current: dict, previous: dict, regressions: list):
+  """Print the results and their change against the previous baseline
+  """
+
+  flagged = set((r[0], r[1]) for r in regressions)
+  metrics = ("lines_per_second", "latency_p50", "latency_p99", "cpu_per_line",
+             "rss")
+  print(f"{'mode':<12} {'metric':<18} {'previous':>12} {'current':>12} "
+        f"{'change':>9}")
+  for mode, results in current.items():
+    for metric in metrics:
+      new = results.get(metric)
+      old = previous.get(mode, {}).get(metric)
+      change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else ""
+      mark = "  REGRESSION" if (mode, metric) in flagged else ""
+      print(f"{mode:<12} {metric:<18} {'-' if old is None else f'{old:.1f}':>12} "
+            f"{'-' if new is None else f'{new:.1f}':>12} {change:>9}{mark}")
+
+
+def bench(config_file: str,
+          handler_name: str,
+          files: list,
+          lines: int = 100000,
+          sample: int = 1000,
+          modes: list = None,
+          baseline: str = "logdog-baseline.json",
+          thresholds: dict = None,
+          update_baseline: bool = False) -> list:
+  """Run the benchmark of a handler and compare it with the baseline
+
+  The results are printed. They are saved as new baseline if there is
+  no baseline yet, if no metric regressed or if `update_baseline` is
+  set. The baseline keeps the results of the modes that have not been
+  run.
+
+  Args:
+      config_file (str): the config file
+      handler_name (str): the handler
+      files (list): recorded log files (synthetic lines if empty)
+      lines (int, optional): number of synthetic lines.
+          Defaults to 100000.
+      sample (int, optional): lines per latency sample. Defaults to 1000.
+      modes (list, optional): the engine modes. Defaults to None (all
+          modes the platform supports).
+      baseline (str, optional): the baseline file.
+          Defaults to "logdog-baseline.json".
+      thresholds (dict, optional): regression thresholds in percent
+          per metric that replace the defaults of `THRESHOLDS`.
+          Defaults to None.
+      update_baseline (bool, optional): save the results as new
+          baseline even if metrics regressed or the baseline has been
+          recorded with another handler or input (which is not
+          compared then). Defaults to False.
+
+  Returns:
+      list: the regressions (see `compare()`)
+
+  Raises:
+      FileNotFoundError: if `config_file` or a file does not exist
+      JSONDecodeError: if content of `config_file` has wrong format
+      KeyError: if the handler does not exist
+      ValueError: if the baseline has been recorded with another
+          handler or input and `update_baseline` is not set
+      RuntimeError: if a handler process failed
+  """
+
+  config.parse_config(config_file)
+  actions.discover_actions()
+  handler_data = config.get_handler_data(handler_name)
+  if modes is None:
+    modes = [m for m in MODES if m == "inline" or
+             m in mp.get_all_start_methods()]
+  thresholds = dict(THRESHOLDS, **(thresholds or {}))
+
+  if files:
+    description = {"files": files}
+  else:
+    literals = prefilter.required_literals(
+        matcher.compile_events(handler_data)) or []
+    description = {"synthetic": lines}
+
+  previous = {}
+  if os.path.exists(baseline):
+    with open(baseline, "r") as f:
+      b = json.load(f)
+    if b.get("handler") == handler_name and b.get("input") == description:
+      previous = b.get("modes", {})
+    elif update_baseline:
+      print(f"Baseline {baseline} has been recorded with another handler or "
+            "input, it is replaced without comparison")
+    else:
+      raise ValueError(
+          f"Baseline {baseline} has been recorded with another handler or "
+          "input (use another baseline file or update it)")
+
+  current = {}
+  for mode in modes:
+    source = (__recorded_lines(files)
+              if files else synthetic_lines(literals, lines))
+    current[mode] = run(mode, handler_name, source, sample)
+
+  regressions = compare(previous, current, thresholds)
+  __print_results(current, previous, regressions)
+
+  if regressions and not update_baseline:
+    print(f"Baseline {baseline} has not been updated because of the "
+          "regressions")
+    return regressions
+  with open(baseline, "w") as f:
+    json.dump(
+        {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": os.path.abspath(config_file),
+            "handler": handler_name,
+            "input": description,
+            "thresholds": thresholds,
+            "modes": dict(previous, **current),
+        },
+        f,
+        indent=2)
+  return regressions
@@ -0,0 +1,315 @@
+"""Probe handlers with canary lines
+
+Filename: canary.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+A canary is a marked line that the main process writes into the input
+of a handler (its file, named pipe or syslog socket) every `interval`
+seconds.
+The handler recognizes the line, checks it against its events like any
+other line (dropping the matches) and emits it as the internal event
+`PROBE`, which is never passed to lookups, statistics, correlations or
+actions. The handler dispatches it behind the events queued by the
+actions of its events (e.g. the batches of `webhook` and `store`) and
+reports it to the main process once these have been handled. The time
+from writing the line until then is the detection latency of the
+handler, including the watcher, the prefilter, matching, action
+dispatch and any backlog. If a canary is not seen within `deadline`
+seconds, the handler is not detecting events in time.
+
+A canary line looks like `logdog-canary HANDLER SERIAL SENT MAC`, where
+SENT is the time it has been written and MAC authenticates the canary
+with a key that is created for every run of logdog. A handler only
+treats a line as canary if it contains a canary with a valid MAC whose
+serial is newer than the last one it has seen (see `Filter`). A logged
+text that only contains the mark (e.g. a user name chosen by an
+attacker) or a copied canary runs the actions of its events as usual.
+
+Classes:
+    Filter: recognize the canaries a handler has to drop
+    Probes: send canaries and collect their latencies
+
+Functions:
+    new_key() -> bytes: create a key for the canaries of a run
+    line(bytes, str, int, float) -> str: get a canary line
+    parse(str, bytes) -> tuple: get the handler, serial and time of a
+        canary
+    inject(dict, str): write a line into the input of a handler
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import collections
+import glob
+import hashlib
+import hmac
+import os
+import re
+import socket
+import time
+
+import logdog.sources as sources
+
+MARK = "logdog-canary"  # Marks canary lines
+EVENT = "canary"  # Name of the records of seen canaries
+PROBE = {"name": EVENT}  # Internal event of a recognized canary
+
+# A canary ends the line it has been written into
+__pattern = re.compile(
+    MARK + " (\\S+) (\\d+) (\\d+\\.\\d+) ([0-9a-f]{32})\\s*$")
+
+
+def new_key() -> bytes:
+  """Create a key for the canaries of a run
+
+  Returns:
+      bytes: the key
+  """
+
+  return os.urandom(16)
+
+
+def __mac(key: bytes, text: str) -> str:
+  """Get the MAC of the canary `text` (without the MAC)
+  """
+
+  return hmac.new(key, text.encode("UTF-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def line(key: bytes, handler_name: str, serial: int, sent: float) -> str:
+  """Get a canary line
+
+  Args:
+      key (bytes): the key of the run
+      handler_name (str): the probed handler
+      serial (int): the serial of the canary
+      sent (float): the time it is written
+
+  Returns:
+      str: the line
+  """
+
+  text = f"{MARK} {handler_name} {serial} {sent:.6f}"
+  return f"{text} {__mac(key, text)}"
+
+
+def parse(line: str, key: bytes) -> tuple:
+  """Get the handler, serial and time of a canary line
+
+  Args:
+      line (str): the line
+      key (bytes): the key of the run
+
+  Returns:
+      tuple: (handler (str), serial (int), time it has been sent
+          (float)) or None if `line` contains no canary with a valid MAC
+  """
+
+  m = __pattern.search(line)
+  if m is None:
+    return None
+  text = line[m.start():m.start(4) - 1]
+  if not hmac.compare_digest(__mac(key, text), m.group(4)):
+    return None
+  return (m.group(1), int(m.group(2)), float(m.group(3)))
+
+
+class Filter:
+  """Recognize the canaries a handler has to drop
+
+  A canary is only recognized once: its serial has to be newer than
+  the serials seen before for its handler, so a copy of a canary that
+  is logged again is not dropped.
+
+  Args:
+      key (bytes): the key of the run
+  """
+
+  def __init__(self, key: bytes):
+    self.key = key
+    self.serials = {}  # Last serial seen per probed handler
+
+  def check(self, line: str) -> tuple:
+    """Check if `line` is a new canary
+
+    Args:
+        line (str): the line
+
+    Returns:
+        tuple: (handler (str), serial (int), time it has been sent
+            (float)) or None if `line` has to be matched as usual
+    """
+
+    c = parse(line, self.key)
+    if c is None or c[1] <= self.serials.get(c[0], 0):
+      return None
+    self.serials[c[0]] = c[1]
+    return c
+
+
+def inject(handler_data: dict, line: str):
+  """Write a line into the input of a handler
+
+  Lines are written to named pipe inputs (after the `route` of the
+  handler), sent as syslog messages (of the first of the handler's
+  `programs` and `facilities`) to socket inputs and appended to the
+  `file` of other handlers (the most recently modified file of a glob).
+
+  Args:
+      handler_data (dict): the config data of the handler
+      line (str): the line
+
+  Raises:
+      OSError: if the line cannot be written
+      ValueError: if the handler has no input a line can be written to
+  """
+
+  if handler_data.get("input", {}).get("type") == "fifo":
+    input_data = handler_data["input"]
+    if "route" in input_data:
+      line = f"{input_data['route']} {line}"
+    fd = os.open(input_data["path"], os.O_WRONLY | os.O_NONBLOCK)
+    try:
+      os.write(fd, (line + "\n").encode("UTF-8"))
+    finally:
+      os.close(fd)
+    return
+
+  if "input" in handler_data:
+    input_data = handler_data["input"]
+    facility = sources.FACILITIES[(handler_data.get("facilities") or
+                                   ["user"])[0]]
+    program = (handler_data.get("programs") or ["logdog"])[0]
+    message = (f"<{facility * 8 + 6}>{time.strftime('%b %d %H:%M:%S')} "
+               f"{socket.gethostname()} {program}: {line}").encode("UTF-8")
+
+    if input_data["type"] == "unix":
+      with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+        s.sendto(message, input_data["path"])
+      return
+    address = input_data.get("address", "0.0.0.0")
+    if address in ("0.0.0.0", "::", ""):
+      address = "localhost"
+    port = input_data.get("port", 514)
+    if input_data["type"] == "udp":
+      with socket.socket(socket.AF_INET6 if ":" in address else socket.AF_INET,
+                         socket.SOCK_DGRAM) as s:
+        s.sendto(message, (address, port))
+    else:
+      with socket.create_connection((address, port), timeout=1) as s:
+        s.sendall(message + b"\n")
+    return
+
+  path = handler_data.get("file", "")
+  if any(c in path for c in "*?["):
+    paths = glob.glob(path)
+    if not paths:
+      raise ValueError(f"No file matches {path}")
+    path = max(paths, key=os.path.getmtime)
+  if not path:
+    raise ValueError("Handler has neither input nor file")
+  with open(path, "a") as f:
+    f.write(line + "\n")
+
+
+class Probes:
+  """Send canaries and collect their latencies
+
+  Args:
+      handlers (dict): the config data per probed handler
+      deadline (float): seconds until a canary is missed
+      missed (callable): called with the handler name (str) and the
+          serial (int) of a canary that has not been seen in time
+      key (bytes): the key of the run (see `new_key()`)
+      samples (int, optional): number of latencies kept per handler.
+          Defaults to 1000.
+  """
+
+  def __init__(self,
+               handlers: dict,
+               deadline: float,
+               missed,
+               key: bytes,
+               samples: int = 1000):
+    self.handlers = handlers
+    self.key = key
+    self.deadline = deadline
+    self.missed = missed
+    self.serial = 0
+    self.pending = {}  # (handler, serial) -> time sent
+    self.latencies = {h: collections.deque(maxlen=samples) for h in handlers}
+    self.misses = {h: 0 for h in handlers}
+
+  def send(self, now: float) -> list:
+    """Write a canary into the input of every probed handler
+
+    Args:
+        now (float): the current time
+
+    Returns:
+        list: (handler name, exception) per canary that could not be
+            written
+    """
+
+    self.serial += 1
+    errors = []
+    for h, handler_data in self.handlers.items():
+      try:
+        inject(handler_data, line(self.key, h, self.serial, now))
+      except (OSError, ValueError) as e:
+        errors.append((h, e))
+        continue
+      self.pending[(h, self.serial)] = now
+    return errors
+
+  def seen(self, handler_name: str, serial: int, sent: float, now: float):
+    """Record a canary that a handler has seen
+
+    Args:
+        handler_name (str): the handler
+        serial (int): the serial of the canary
+        sent (float): the time the canary has been written
+        now (float): the time the handler has seen the canary
+    """
+
+    if self.pending.pop((handler_name, serial), None) is None:
+      # Missed before or written by another logdog
+      return
+    self.latencies[handler_name].append(now - sent)
+
+  def expire(self, now: float):
+    """Report the canaries that have not been seen in time
+
+    Args:
+        now (float): the current time
+    """
+
+    for (h, serial), sent in list(self.pending.items()):
+      if now - sent >= self.deadline:
+        del self.pending[(h, serial)]
+        self.misses[h] += 1
+        self.missed(h, serial)
+
+  def report(self, handler_name: str) -> dict:
+    """Get the latency distribution of a handler and start a new one
+
+    Args:
+        handler_name (str): the handler
+
+    Returns:
+        dict: `count`, `missed` and the latencies `min`, `p50`, `p90`,
+            `p99` and `max` in seconds (None if no canary has been seen)
+    """
+
+    l = sorted(self.latencies[handler_name])
+    r = {"count": len(l), "missed": self.misses[handler_name]}
+    for k, q in (("min", 0), ("p50", 0.5), ("p90", 0.9), ("p99", 0.99),
+                 ("max", 1)):
+      r[k] = l[min(len(l) - 1, int(q * len(l)))] if l else None
+    self.latencies[handler_name].clear()
+    self.misses[handler_name] = 0
+    return r
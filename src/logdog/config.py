@@ -14,6 +14,7 @@ Functions:
     parse_config(str): Set up the configuration
     get_handler_names() -> list: get names of handlers
     get_handler_data(str) -> dict: get data for a handler
+    set_handler_data(str, dict): set data for a handler
     get_action_names() -> list: get action names for handler
     get_action_data(str) -> dict: get data for action of handler
     get_event_names(str, str) -> list: get event names for action of
@@ -27,6 +28,20 @@ Functions:
     get_default_event() -> dict: get default action data
     get_watcher_names() -> list: get watcher names
     get_watcher_data(str) -> dict: get data for a watcher
+    get_correlation_names() -> list: get correlation names
+    get_correlation_data(str) -> dict: get data for a correlation
+    get_table_names() -> list: get lookup table names
+    get_table_data(str) -> dict: get data for a lookup table
+    get_table_dir() -> str: get the directory of lookup table indexes
+    get_state_dir() -> str: get the directory of the state of logdog
+    get_profile_data() -> dict: get profiling settings
+    set_profile_data(dict): set profiling settings
+    get_regexp_guard_data() -> dict: get default regexp guard settings
+    get_overload_data() -> dict: get default overload settings
+    get_agent_data() -> dict: get agent settings
+    get_aggregator_data() -> dict: get aggregator settings
+    get_workers_data() -> dict: get handler process settings
+    get_canary_data() -> dict: get canary settings
 
 .. _MIT:
    https://github.com/TheTimmoth/logdog/blob/main/LICENSE
@@ -43,6 +58,8 @@ __config = {}  # Config data
 
 debug = False
 
+config_path = ""  # Path of the parsed config file
+
 
 def parse_config(config_file: str):
   """Set up the configuration
@@ -54,9 +71,11 @@ def parse_config(config_file: str):
 
   global __config
   global debug
+  global config_path
 
   with open(config_file, "r") as f:
     __config = json.load(f)
+  config_path = config_file
 
   try:
     debug = __config["logdog"]["debug"]
@@ -99,6 +118,23 @@ def get_handler_data(handler: str) -> dict:
   return __config["handlers"][handler]
 
 
+def set_handler_data(handler: str, d: dict):
+  """Set the config data for `handler`
+
+  Args:
+      handler (str): the `handler`
+      d (dict): The data for the `handler`
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  __config["handlers"][handler] = d
+
+
 def get_event_names(handler: str) -> list:
   """Get the names of events for handler
 
@@ -252,3 +288,227 @@ def get_watcher_data(watcher: str) -> dict:
   """
 
   return __config["watchers"][watcher]
+
+
+def get_correlation_names() -> list:
+  """Get the names of correlations
+
+  Returns:
+      list: The names of the correlations
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return list(__config["correlations"].keys())
+
+
+def get_correlation_data(correlation: str) -> dict:
+  """Get the config data of `correlation`
+
+  Returns:
+      dict: The data for the correlation
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["correlations"][correlation]
+
+
+def get_table_names() -> list:
+  """Get the names of lookup tables
+
+  Returns:
+      list: The names of the lookup tables
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return list(__config["tables"].keys())
+
+
+def get_table_data(table: str) -> dict:
+  """Get the config data of lookup table `table`
+
+  Returns:
+      dict: The data for the lookup table
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["tables"][table]
+
+
+def get_table_dir() -> str:
+  """Get the directory of the lookup table index files
+
+  Returns:
+      str: The directory
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["table_dir"]
+
+
+def get_state_dir() -> str:
+  """Get the directory of the state of logdog (e.g. table indexes)
+
+  Returns:
+      str: The directory
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["state_dir"]
+
+
+def get_profile_data() -> dict:
+  """Get the profiling settings
+
+  Returns:
+      dict: The profiling settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["profile"]
+
+
+def set_profile_data(d: dict):
+  """Set the profiling settings
+
+  Args:
+      d (dict): The profiling settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  __config["logdog"]["profile"] = d
+
+
+def get_regexp_guard_data() -> dict:
+  """Get the default settings of the regexp guard
+
+  Returns:
+      dict: The regexp guard settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["regexp_guard"]
+
+
+def get_overload_data() -> dict:
+  """Get the default settings of the overload detection
+
+  Returns:
+      dict: The overload settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["overload"]
+
+
+def get_agent_data() -> dict:
+  """Get the agent settings (forward events to an aggregator)
+
+  Returns:
+      dict: The agent settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["agent"]
+
+
+def get_aggregator_data() -> dict:
+  """Get the aggregator settings (receive events of agents)
+
+  Returns:
+      dict: The aggregator settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["aggregator"]
+
+
+def get_workers_data() -> dict:
+  """Get the settings of the handler processes
+
+  Returns:
+      dict: The handler process settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["workers"]
+
+
+def get_canary_data() -> dict:
+  """Get the settings of the canary probes
+
+  Returns:
+      dict: The canary settings
+
+  Raises:
+      KeyError: if config file violates `reference`_
+
+  .. _reference:
+     https://example.com (TODO)
+  """
+
+  return __config["logdog"]["canary"]
@@ -0,0 +1,227 @@
+"""Correlate events of handlers over time
+
+Filename: correlation.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Correlations fire if events of one or several handlers occur in a
+certain way within a time window, e.g. "5 `su_failure` from the same
+`ip` within 60 s" (type `threshold`) or "`login` after 3
+`su_failure` of the same `user`" (type `sequence`). Events are grouped
+by the value of a field (the `key`).
+
+The state of a key is kept in a small structure: a threshold counts
+events in time buckets (not a list of timestamps), a sequence only
+remembers its current step. Keys that have not been seen for a window
+are removed by a timer of the scheduler (see `logdog.scheduler`), so
+the memory stays bounded.
+
+The handler processes send the events that take part in correlations
+to the main process, which runs the `Correlator`.
+
+Classes:
+    Correlator: correlate events
+
+Functions:
+    get_steps(dict) -> list: get the steps of a correlation
+    watched_events(str) -> dict: get the events of a handler that take
+        part in correlations
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import array
+import time
+
+import logdog.config as config
+import logdog.strings as strings
+
+
+def get_steps(correlation_data: dict) -> list:
+  """Get the steps of a correlation
+
+  A threshold correlation has exactly one step.
+
+  Args:
+      correlation_data (dict): the config data of the correlation
+
+  Returns:
+      list: the steps (dicts with `handler`, `event` and `count`)
+  """
+
+  if correlation_data["type"] == "sequence":
+    return correlation_data["steps"]
+  return [correlation_data]
+
+
+def watched_events(handler_name: str) -> dict:
+  """Get the events of a handler that take part in correlations
+
+  Args:
+      handler_name (str): the handler
+
+  Returns:
+      dict: the key fields needed by the correlations per event name
+  """
+
+  watched = {}
+  try:
+    names = config.get_correlation_names()
+  except KeyError:
+    return watched
+  for name in names:
+    correlation_data = config.get_correlation_data(name)
+    for step in get_steps(correlation_data):
+      if step["handler"] == handler_name:
+        keys = watched.setdefault(step["event"], [])
+        if "key" in correlation_data and correlation_data["key"] not in keys:
+          keys.append(correlation_data["key"])
+  return watched
+
+
+class Correlator:
+  """Correlate events and fire correlations
+
+  Args:
+      fire (callable): called with the correlation name (str), its
+          config data (dict), the key (str) and the number of
+          correlated events (int) whenever a correlation fires
+      timers (scheduler.Scheduler): the scheduler of the expiry timers
+          (run by the thread that records the events)
+  """
+
+  def __init__(self, fire, timers):
+    self.fire = fire
+    self.timers = timers
+    self.rules = {}  # (handler, event) -> [(name, data, step)]
+    self.states = {}  # (name, key) -> state (see __threshold/__sequence)
+    self.expiries = {}  # (name, key) -> expiry timer of the state
+
+    for name in config.get_correlation_names():
+      data = config.get_correlation_data(name)
+      for i, step in enumerate(get_steps(data)):
+        self.rules.setdefault((step["handler"], step["event"]), []).append(
+            (name, data, i))
+
+  def record(self, handler_name: str, event_name: str, fields: dict,
+             t: float):
+    """Record an event
+
+    Args:
+        handler_name (str): the handler of the event
+        event_name (str): the event
+        fields (dict): the fields of the event
+        t (float): the time of the event
+    """
+
+    for name, data, step in self.rules.get((handler_name, event_name), []):
+      if "key" in data:
+        key = strings.get_field(fields, data["key"])
+        if key is None:
+          continue
+      else:
+        key = None
+
+      if data["type"] == "sequence":
+        self.__sequence(name, data, step, key, t)
+      else:
+        self.__threshold(name, data, key, t)
+
+  def __threshold(self, name: str, data: dict, key: str, t: float):
+    """Count an event of a threshold correlation
+
+    The window is split into `buckets` buckets. The state of a key is
+    [expiry (float), last bucket (int), counts (array)].
+    """
+
+    n = data.get("buckets", 10)
+    width = data["window"] / n
+    bucket = int(t / width)
+
+    state = self.states.get((name, key))
+    if state is None:
+      state = [0, bucket, array.array("I", bytes(4 * n))]
+      self.states[(name, key)] = state
+      self.__schedule((name, key), t + data["window"])
+
+    counts = state[2]
+    gap = bucket - state[1]
+    if gap >= n:
+      counts[:] = array.array("I", bytes(4 * n))
+    elif gap > 0:
+      for b in range(state[1] + 1, bucket + 1):
+        counts[b % n] = 0
+    elif gap <= -n:
+      # Too old for the window
+      return
+    counts[bucket % n] += 1
+    state[0] = max(state[0], t + data["window"])
+    state[1] = max(state[1], bucket)
+
+    count = sum(counts)
+    if count >= data["count"]:
+      self.__remove((name, key))
+      self.fire(name, data, key, count)
+
+  def __sequence(self, name: str, data: dict, step: int, key: str,
+                 t: float):
+    """Advance a sequence correlation
+
+    The state of a key is [expiry (float), step (int), count (int),
+    start (float)].
+    """
+
+    state = self.states.get((name, key))
+    if state is not None and t - state[3] > data["window"]:
+      self.__remove((name, key))
+      state = None
+    if state is None:
+      if step != 0:
+        return
+      state = [t + data["window"], 0, 0, t]
+      self.states[(name, key)] = state
+      self.__schedule((name, key), state[0])
+    if state[1] != step:
+      return
+
+    state[2] += 1
+    if state[2] >= data["steps"][step].get("count", 1):
+      state[1] += 1
+      state[2] = 0
+      if state[1] == len(data["steps"]):
+        self.__remove((name, key))
+        self.fire(name, data, key,
+                  sum(s.get("count", 1) for s in data["steps"]))
+
+  def __schedule(self, item: tuple, expiry: float):
+    """Schedule the expiry of a state at the time `expiry`
+    """
+
+    self.expiries[item] = self.timers.call_later(
+        max(0, expiry - time.time()), self.__expire, item)
+
+  def __remove(self, item: tuple):
+    """Remove a state and cancel its expiry
+    """
+
+    del self.states[item]
+    self.timers.cancel(self.expiries.pop(item))
+
+  def __expire(self, item: tuple):
+    """Remove a state if its window has expired
+
+    The expiry of a state moves with its events, so a state that is
+    still in its window is scheduled again.
+    """
+
+    self.expiries.pop(item, None)
+    state = self.states.get(item)
+    if state is None:
+      return
+    if state[0] > time.time():
+      self.__schedule(item, state[0])
+    else:
+      del self.states[item]
@@ -0,0 +1,276 @@
+"""Discover and follow the files that match a glob
+
+Filename: discovery.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+A handler whose `file` is a glob (e.g. `/var/log/nginx/*.access.log`)
+follows all matching files itself instead of running a watcher. The
+directories the glob can match are watched with inotify (one watch per
+directory, not per file), so files are picked up as they appear and
+released as they disappear without rescanning.
+
+Files that exist when logdog starts are followed from their end, files
+that appear later from their beginning. Moved and deleted files (e.g.
+by log rotation) are read to their end before they are closed.
+Truncated files are read from their beginning again.
+
+Classes:
+    Inotify: a minimal inotify binding
+
+Functions:
+    is_glob(str) -> bool: check if a path is a glob
+    follow(str) -> generator: yield the lines of all matching files
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import resource
+import struct
+
+import logdog.sources as sources
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+# Watched events of directories that contain matching files
+FILE_DIRECTORY_MASK = (IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_FROM |
+                       IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR)
+# Watched events of directories that contain matching directories
+DIRECTORY_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_DELETE_SELF | IN_ONLYDIR)
+
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, length of name
+
+
+class Inotify:
+  """A minimal inotify binding
+
+  Raises:
+      OSError: if inotify is not available
+  """
+
+  def __init__(self):
+    self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+    if self.fd < 0:
+      e = ctypes.get_errno()
+      raise OSError(e, os.strerror(e))
+
+  def add_watch(self, path: str, mask: int) -> int:
+    """Watch `path`
+
+    Args:
+        path (str): the path
+        mask (int): the events to watch
+
+    Returns:
+        int: the watch descriptor
+
+    Raises:
+        OSError: if `path` cannot be watched
+    """
+
+    wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      e = ctypes.get_errno()
+      raise OSError(e, os.strerror(e), path)
+    return wd
+
+  def read(self) -> list:
+    """Wait for events
+
+    Returns:
+        list: (watch descriptor (int), mask (int), name (str)) per event
+    """
+
+    data = os.read(self.fd, 65536)
+    events = []
+    offset = 0
+    while offset < len(data):
+      wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+      offset += EVENT.size
+      name = data[offset:offset + length].rstrip(b"\0")
+      offset += length
+      events.append((wd, mask, os.fsdecode(name)))
+    return events
+
+  def close(self):
+    """Close the inotify instance and remove all watches
+    """
+
+    os.close(self.fd)
+
+
+def is_glob(path: str) -> bool:
+  """Check if `path` is a glob
+
+  Args:
+      path (str): the path
+
+  Returns:
+      bool: True if `path` contains `*`, `?` or `[`
+  """
+
+  return any(c in path for c in "*?[")
+
+
+def __raise_file_limit():
+  """Raise the limit of open files to the hard limit
+  """
+
+  try:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+      resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+  except (ValueError, OSError):
+    pass
+
+
+def follow(pattern: str,
+           chunk_size: int = sources.CHUNK_SIZE,
+           keep_indent: bool = False):
+  """Yield the lines of all files that match `pattern`
+
+  Args:
+      pattern (str): the glob
+      chunk_size (int, optional): bytes to read at once.
+          Defaults to sources.CHUNK_SIZE.
+      keep_indent (bool, optional): keep leading whitespace of the
+          lines. Defaults to False.
+
+  Yields:
+      tuple: (path (str), line (str)). The line is None if the file has
+          been closed.
+
+  Raises:
+      OSError: if inotify is not available or the directory of the
+          glob cannot be watched
+  """
+
+  # Split the glob into the static base directory and one pattern per
+  # level below it
+  parts = os.path.abspath(pattern).split(os.sep)[1:]
+  static = 0
+  while static < len(parts) - 1 and not is_glob(parts[static]):
+    static += 1
+  base = os.path.join(os.sep, *parts[:static])
+  parts = parts[static:]
+
+  strip = str.rstrip if keep_indent else str.strip
+  inotify = Inotify()
+  directories = {}  # wd -> (path, level)
+  files = {}  # path -> [fd, incomplete last line]
+  __raise_file_limit()
+
+  def read(path: str, final: bool = False) -> list:
+    f = files[path]
+    if os.fstat(f[0]).st_size < os.lseek(f[0], 0, os.SEEK_CUR):
+      # Truncated
+      os.lseek(f[0], 0, os.SEEK_SET)
+      f[1] = b""
+    lines = []
+    while True:
+      chunk = os.read(f[0], chunk_size)
+      if not chunk:
+        break
+      l = (f[1] + chunk).split(b"\n")
+      f[1] = l.pop()
+      lines.extend(l)
+    if final and f[1]:
+      lines.append(f[1])
+    return [(path, strip(l.decode("UTF-8", "replace"))) for l in lines]
+
+  def close(path: str) -> list:
+    lines = read(path, final=True)
+    os.close(files.pop(path)[0])
+    lines.append((path, None))
+    return lines
+
+  def add_directory(path: str, level: int, existing: bool) -> list:
+    mask = FILE_DIRECTORY_MASK if level == len(parts) - 1 else DIRECTORY_MASK
+    try:
+      directories[inotify.add_watch(path, mask)] = (path, level)
+      names = os.listdir(path)
+    except OSError:
+      return []
+    lines = []
+    for name in names:
+      lines.extend(add(path, level, name, existing))
+    return lines
+
+  def add(directory: str, level: int, name: str, existing: bool) -> list:
+    if name.startswith(".") and not parts[level].startswith("."):
+      # Like glob: hidden entries only match explicit patterns
+      return []
+    if not fnmatch.fnmatchcase(name, parts[level]):
+      return []
+    path = os.path.join(directory, name)
+    if level < len(parts) - 1:
+      if os.path.isdir(path):
+        return add_directory(path, level + 1, existing)
+      return []
+    if path in files or not os.path.isfile(path):
+      return []
+    try:
+      fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+      return []
+    if existing:
+      os.lseek(fd, 0, os.SEEK_END)
+    files[path] = [fd, b""]
+    return read(path)
+
+  yield from add_directory(base, 0, True)
+  if not directories:
+    raise FileNotFoundError(f"Cannot watch {base}")
+
+  while directories:
+    modified = set()
+    for wd, mask, name in inotify.read():
+      if mask & IN_Q_OVERFLOW:
+        # Events have been lost: check all directories and files
+        for path, level in list(directories.values()):
+          yield from add_directory(path, level, False)
+        modified.update(files)
+        continue
+      if wd not in directories:
+        continue
+
+      directory, level = directories[wd]
+      if mask & IN_IGNORED:
+        # The directory has been removed
+        del directories[wd]
+        for path in [p for p in files if p.startswith(directory + os.sep)]:
+          yield from close(path)
+        continue
+
+      path = os.path.join(directory, name)
+      if mask & (IN_CREATE | IN_MOVED_TO):
+        yield from add(directory, level, name, False)
+      elif mask & (IN_DELETE | IN_MOVED_FROM):
+        if path in files:
+          modified.discard(path)
+          yield from close(path)
+      elif mask & IN_MODIFY and path in files:
+        modified.add(path)
+
+    for path in modified:
+      if path in files:
+        yield from read(path)
+  inotify.close()
@@ -0,0 +1,357 @@
+"""Store events in an indexed store and query them
+
+Filename: eventstore.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+The event store keeps one record per handled event (time, handler,
+event, brief information, fields and context lines). Records are
+appended to daily segments: one SQLite database per day in write-ahead
+log mode, indexed by time and by handler and event. A query only opens
+the segments of its time range and uses the indexes within them.
+Segments older than the retention are deleted as a whole.
+
+Classes:
+    Store: append records to the segments of a directory
+
+Functions:
+    connect(str) -> sqlite3.Connection: open a segment
+    parse_time(str) -> float: parse an absolute or relative time
+    segments(str, float, float) -> list: get the segments of a range
+    query(str, ...) -> generator: yield the matching records
+    count(str, ...) -> dict: count the matching records
+    events(str, ...): print the records or counts of a config file
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import datetime
+import json
+import os
+import re
+import sqlite3
+import time
+
+import logdog.config as config
+
+SEGMENT = "events-%Y%m%d.db"  # Name of a segment (date of its records)
+
+# Tables and indexes of a segment
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS events (time REAL NOT NULL, "
+    "handler TEXT NOT NULL, event TEXT NOT NULL, brief_information TEXT, "
+    "fields TEXT, context TEXT)",
+    "CREATE INDEX IF NOT EXISTS events_time ON events (time)",
+    "CREATE INDEX IF NOT EXISTS events_event ON events (handler, event, time)",
+)
+
+SEGMENT_NAME = re.compile("^events-(\\d{8})\\.db$")  # Matches segments
+__relative_time = re.compile("^(\\d+(?:\\.\\d+)?)([smhdw])$")
+__units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def connect(path: str) -> sqlite3.Connection:
+  """Open a segment
+
+  Args:
+      path (str): the path of the segment
+
+  Returns:
+      sqlite3.Connection: the connection
+  """
+
+  connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+  connection.execute("PRAGMA journal_mode=WAL")
+  connection.execute("PRAGMA synchronous=NORMAL")
+  return connection
+
+
+class Store:
+  """Append records to the segments of a directory
+
+  Several processes may append to the same directory at the same time.
+
+  Args:
+      directory (str): the directory of the segments
+      retention (float, optional): days to keep segments. Defaults to
+          None (keep all segments).
+  """
+
+  def __init__(self, directory: str, retention: float = None):
+    self.directory = directory
+    self.retention = retention
+    self.connections = {}  # Segment name -> connection
+    os.makedirs(directory, exist_ok=True)
+    self.expire()
+
+  def __segment(self, name: str) -> sqlite3.Connection:
+    """Get the connection of segment `name`
+    """
+
+    if name not in self.connections:
+      if self.connections:
+        # A new day has begun: older segments are not written anymore
+        self.close()
+        self.expire()
+      connection = connect(os.path.join(self.directory, name))
+      for s in SCHEMA:
+        connection.execute(s)
+      self.connections[name] = connection
+    return self.connections[name]
+
+  def add(self, records: list):
+    """Append records
+
+    The records of a segment are inserted in one transaction.
+
+    Args:
+        records (list): a dict per record with the keys `time` (float),
+            `handler`, `event`, `brief_information`, `fields` (dict) and
+            `context` (str)
+    """
+
+    segments = {}
+    for r in records:
+      segments.setdefault(time.strftime(SEGMENT, time.localtime(r["time"])),
+                          []).append(
+                              (r["time"], r["handler"], r["event"],
+                               r["brief_information"],
+                               json.dumps(dict(r["fields"] or {}),
+                                          default=str), r["context"]))
+
+    for name, rows in sorted(segments.items()):
+      connection = self.__segment(name)
+      with connection:
+        connection.execute("BEGIN")
+        connection.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                               rows)
+
+  def expire(self):
+    """Delete the segments that are older than the retention
+    """
+
+    if self.retention is None:
+      return
+    oldest = time.strftime(SEGMENT,
+                           time.localtime(time.time() - self.retention * 86400))
+    for name in os.listdir(self.directory):
+      m = SEGMENT_NAME.match(name)
+      if m and name < oldest and name not in self.connections:
+        for suffix in ("", "-wal", "-shm"):
+          try:
+            os.remove(os.path.join(self.directory, name + suffix))
+          except FileNotFoundError:
+            pass
+
+  def close(self):
+    """Close all segments
+    """
+
+    for connection in self.connections.values():
+      connection.close()
+    self.connections = {}
+
+
+def parse_time(s: str) -> float:
+  """Parse an absolute or relative time
+
+  Args:
+      s (str): "now", a duration before now (e.g. "30m", "2h", "7d";
+          units: s, m, h, d, w) or a local date and time in ISO 8601
+          format (e.g. "2021-05-04" or "2021-05-04 13:00")
+
+  Returns:
+      float: the time in seconds since the epoch
+
+  Raises:
+      ValueError: if `s` is not a valid time
+  """
+
+  if s == "now":
+    return time.time()
+  m = __relative_time.match(s)
+  if m:
+    return time.time() - float(m.group(1)) * __units[m.group(2)]
+  return datetime.datetime.fromisoformat(s).timestamp()
+
+
+def segments(directory: str, since: float = None, until: float = None) -> list:
+  """Get the segments that contain records of a time range
+
+  Args:
+      directory (str): the directory of the segments
+      since (float, optional): start of the range. Defaults to None.
+      until (float, optional): end of the range. Defaults to None.
+
+  Returns:
+      list: the paths of the segments, oldest first
+  """
+
+  first = time.strftime(SEGMENT, time.localtime(since)) if since else ""
+  last = time.strftime(SEGMENT, time.localtime(until)) if until else "~"
+  try:
+    names = os.listdir(directory)
+  except FileNotFoundError:
+    return []
+  return [
+      os.path.join(directory, n)
+      for n in sorted(names)
+      if SEGMENT_NAME.match(n) and first <= n <= last
+  ]
+
+
+def __where(since: float, until: float, handler: str, event: str,
+            fields: dict) -> tuple:
+  """Build the condition of a query
+
+  Returns:
+      tuple: (condition (str), parameters (list))
+  """
+
+  conditions = []
+  parameters = []
+  if handler is not None:
+    conditions.append("handler = ?")
+    parameters.append(handler)
+  if event is not None:
+    conditions.append("event = ?")
+    parameters.append(event)
+  if since is not None:
+    conditions.append("time >= ?")
+    parameters.append(since)
+  if until is not None:
+    conditions.append("time < ?")
+    parameters.append(until)
+  for k, v in (fields or {}).items():
+    conditions.append("CAST(json_extract(fields, ?) AS TEXT) = ?")
+    parameters.extend((f'$."{k}"', v))
+  return (" AND ".join(conditions) or "1", parameters)
+
+
+def query(directory: str,
+          since: float = None,
+          until: float = None,
+          handler: str = None,
+          event: str = None,
+          fields: dict = None,
+          limit: int = None):
+  """Yield the records that match all given filters
+
+  Args:
+      directory (str): the directory of the segments
+      since (float, optional): earliest time. Defaults to None.
+      until (float, optional): time after the latest time.
+          Defaults to None.
+      handler (str, optional): the handler. Defaults to None.
+      event (str, optional): the event. Defaults to None.
+      fields (dict, optional): required values of fields.
+          Defaults to None.
+      limit (int, optional): maximum number of records.
+          Defaults to None.
+
+  Yields:
+      dict: the record (see `Store.add()`), oldest first
+  """
+
+  where, parameters = __where(since, until, handler, event, fields)
+  for path in segments(directory, since, until):
+    connection = connect(path)
+    try:
+      cursor = connection.execute(
+          "SELECT time, handler, event, brief_information, fields, context "
+          f"FROM events WHERE {where} ORDER BY time", parameters)
+      for row in cursor:
+        if limit is not None:
+          if limit <= 0:
+            return
+          limit -= 1
+        yield {
+            "time": row[0],
+            "handler": row[1],
+            "event": row[2],
+            "brief_information": row[3],
+            "fields": json.loads(row[4]) if row[4] else {},
+            "context": row[5],
+        }
+    finally:
+      connection.close()
+
+
+def count(directory: str,
+          since: float = None,
+          until: float = None,
+          handler: str = None,
+          event: str = None,
+          fields: dict = None) -> dict:
+  """Count the records that match all given filters per event
+
+  Args:
+      see `query()`
+
+  Returns:
+      dict: the number of records per (handler, event)
+  """
+
+  where, parameters = __where(since, until, handler, event, fields)
+  counts = {}
+  for path in segments(directory, since, until):
+    connection = connect(path)
+    try:
+      for h, e, n in connection.execute(
+          f"SELECT handler, event, COUNT(*) FROM events WHERE {where} "
+          "GROUP BY handler, event", parameters):
+        counts[(h, e)] = counts.get((h, e), 0) + n
+    finally:
+      connection.close()
+  return counts
+
+
+def events(config_file: str,
+           since: str = None,
+           until: str = None,
+           handler: str = None,
+           event: str = None,
+           fields: dict = None,
+           limit: int = None,
+           counts: bool = False):
+  """Print the stored records or their counts
+
+  The store is the `directory` of the `store` action of `config_file`.
+
+  Args:
+      config_file (str): the config file
+      since (str, optional): earliest time (see `parse_time()`).
+          Defaults to None.
+      until (str, optional): latest time (see `parse_time()`).
+          Defaults to None.
+      handler (str, optional): the handler. Defaults to None.
+      event (str, optional): the event. Defaults to None.
+      fields (dict, optional): required values of fields.
+          Defaults to None.
+      limit (int, optional): maximum number of printed records.
+          Defaults to None.
+      counts (bool, optional): print the number of records per event
+          instead of the records. Defaults to False.
+  """
+
+  config.parse_config(config_file)
+  directory = config.get_action_data("store")["directory"]
+  since = parse_time(since) if since else None
+  until = parse_time(until) if until else None
+
+  if counts:
+    result = count(directory, since, until, handler, event, fields)
+    print(f"{'handler':<16} {'event':<24} {'count':>9}")
+    for (h, e), n in sorted(result.items()):
+      print(f"{h:<16} {e:<24} {n:>9}")
+    print(f"{'total':<41} {sum(result.values()):>9}")
+    return
+
+  for r in query(directory, since, until, handler, event, fields, limit):
+    t = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["time"]))
+    f = " ".join(f"{k}={v}" for k, v in r["fields"].items())
+    print(f"{t} {r['handler']}[{r['event']}]: {r['brief_information']} {f}"
+          .rstrip())
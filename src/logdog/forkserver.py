@@ -0,0 +1,22 @@
+"""Preload the state of the server that forks the handler processes
+
+Filename: forkserver.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+The server process of the start method `forkserver` imports this module
+(see `handlers.spawn_handlers()`). It is not imported by any other
+module, so all logdog modules have been imported completely when the
+state is loaded.
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import os
+
+import logdog.preload as preload
+
+preload.load(os.environ[preload.CONFIG_VARIABLE])
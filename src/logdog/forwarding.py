@@ -0,0 +1,490 @@
+"""Forward events from agents to a central aggregator
+
+Filename: forwarding.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+In agent mode, logdog does not run the actions of the events of its
+handlers. It forwards the events to a central aggregator logdog, which
+runs the actions and correlates the events of all hosts.
+
+Events are encoded as compact binary records (length-prefixed UTF-8
+strings). A `Forwarder` collects records into batches, compresses a
+batch with `zlib` and sends it as a frame over a persistent TCP
+connection. The aggregator acknowledges a frame after it has handled
+its records. Frames that cannot be delivered (e.g. the aggregator is
+down) are appended to a spool file and sent first once the
+aggregator is reachable again. Delivery is at least once: if an
+acknowledgement is lost, the frame is sent again and its events are
+handled twice.
+
+Agents and the aggregator share a key. The aggregator starts every
+connection with a random nonce. Frames and acknowledgements carry an
+HMAC-SHA256 of the nonce and their content, and the sequence numbers
+of a connection must increase. The aggregator closes a connection at
+the first frame that does not authenticate, so a peer without the key
+cannot inject events and a recorded frame cannot be replayed. The
+frames are not encrypted.
+
+Nonce: random bytes (16 bytes).
+Frame: sequence number (8 bytes), number of records (4 bytes), length
+of the compressed records (4 bytes), compressed records, MAC (32
+bytes).
+Acknowledgement: sequence number of the frame (8 bytes), MAC (32
+bytes).
+
+Classes:
+    Forwarder: send records to an aggregator
+
+Functions:
+    parse_address(str) -> tuple: split "host:port"
+    encode_record(dict) -> bytes: encode an event record
+    decode_records(bytes) -> list: decode the records of a frame
+    encode_frame(int, list) -> bytes: encode a frame of records
+    mac(bytes, bytes, bytes) -> bytes: authenticate a frame or an
+        acknowledgement
+    receive(socket.socket, int) -> bytes: receive a number of bytes
+    serve(tuple, bytes, callable): start an aggregator server
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import hashlib
+import hmac
+import os
+import queue
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+RECORD = struct.Struct("!dH")  # Time, number of strings
+LENGTH = struct.Struct("!I")  # Length of a string
+FRAME = struct.Struct("!QII")  # Sequence, records, compressed length
+ACK = struct.Struct("!Q")  # Sequence of the acknowledged frame
+NONCE = 16  # Size of the nonce of a connection
+MAC = hashlib.sha256().digest_size  # Size of the MAC of a message
+MAX_FRAME = 64 * 1024 * 1024  # Maximum size of a frame (compressed/not)
+
+# Strings of a record before the fields
+__keys = ("host", "handler", "event", "brief_information",
+          "detailed_information", "stdout")
+
+
+def parse_address(address: str) -> tuple:
+  """Split an address
+
+  Args:
+      address (str): "host:port"
+
+  Returns:
+      tuple: (host (str), port (int))
+  """
+
+  host, _, port = address.rpartition(":")
+  return (host.strip("[]"), int(port))
+
+
+def encode_record(record: dict) -> bytes:
+  """Encode an event record
+
+  Args:
+      record (dict): the record with the keys `time` (float), `host`,
+          `handler`, `event`, `brief_information`,
+          `detailed_information`, `stdout` and `fields` (dict)
+
+  Returns:
+      bytes: the encoded record
+  """
+
+  strings = [record[k] for k in __keys]
+  for k, v in record["fields"].items():
+    strings.append(k)
+    strings.append(str(v))
+
+  parts = [RECORD.pack(record["time"], len(strings))]
+  for s in strings:
+    b = s.encode("UTF-8", "replace")
+    parts.append(LENGTH.pack(len(b)))
+    parts.append(b)
+  return b"".join(parts)
+
+
+def decode_records(data: bytes) -> list:
+  """Decode the records of a frame
+
+  Args:
+      data (bytes): the uncompressed records
+
+  Returns:
+      list: the records (see `encode_record()`)
+  """
+
+  records = []
+  offset = 0
+  while offset < len(data):
+    t, n = RECORD.unpack_from(data, offset)
+    offset += RECORD.size
+    strings = []
+    for _ in range(n):
+      (length, ) = LENGTH.unpack_from(data, offset)
+      offset += LENGTH.size
+      strings.append(data[offset:offset + length].decode("UTF-8", "replace"))
+      offset += length
+
+    record = dict(zip(__keys, strings))
+    record["time"] = t
+    fields = strings[len(__keys):]
+    record["fields"] = dict(zip(fields[::2], fields[1::2]))
+    records.append(record)
+  return records
+
+
+def encode_frame(sequence: int, records: list) -> bytes:
+  """Encode a frame of records
+
+  Args:
+      sequence (int): the sequence number of the frame
+      records (list): the encoded records
+
+  Returns:
+      bytes: the frame
+  """
+
+  payload = zlib.compress(b"".join(records))
+  return FRAME.pack(sequence, len(records), len(payload)) + payload
+
+
+def mac(key: bytes, nonce: bytes, message: bytes) -> bytes:
+  """Authenticate a frame or an acknowledgement
+
+  Args:
+      key (bytes): the shared key
+      nonce (bytes): the nonce of the connection
+      message (bytes): the frame or acknowledgement (without the MAC)
+
+  Returns:
+      bytes: the MAC
+  """
+
+  return hmac.new(key, nonce + message, hashlib.sha256).digest()
+
+
+def receive(sock: socket.socket, n: int) -> bytes:
+  """Receive exactly `n` bytes
+
+  Args:
+      sock (socket.socket): the connection
+      n (int): the number of bytes
+
+  Returns:
+      bytes: the data or None if the connection has been closed
+  """
+
+  data = bytearray()
+  while len(data) < n:
+    chunk = sock.recv(n - len(data))
+    if not chunk:
+      return None
+    data += chunk
+  return bytes(data)
+
+
+class Forwarder:
+  """Send records to an aggregator
+
+  `run()` collects the records of `records` into batches and delivers
+  them. It is meant to run in a thread.
+
+  Args:
+      records (queue.Queue): the encoded records to forward
+      address (tuple): (host, port) of the aggregator
+      key (bytes): the key shared with the aggregator
+      spool (str): the spool file (in a directory only the current
+          user can write, see `state.private_directory()`)
+      batch_size (int, optional): maximum records per frame.
+          Defaults to 100.
+      batch_timeout (float, optional): seconds to wait for more
+          records. Defaults to 1.
+      retry (float, optional): seconds between connection attempts.
+          Defaults to 5.
+      max_spool (int, optional): maximum size of the spool file in
+          bytes. Defaults to 100 MiB.
+      timeout (float, optional): seconds to wait for an
+          acknowledgement. Defaults to 30.
+  """
+
+  def __init__(self,
+               records,
+               address: tuple,
+               key: bytes,
+               spool: str,
+               batch_size: int = 100,
+               batch_timeout: float = 1,
+               retry: float = 5,
+               max_spool: int = 100 * 1024 * 1024,
+               timeout: float = 30):
+    self.records = records
+    self.address = address
+    self.key = key
+    self.spool = spool
+    self.batch_size = batch_size
+    self.batch_timeout = batch_timeout
+    self.retry = retry
+    self.max_spool = max_spool
+    self.timeout = timeout
+
+    self.sock = None
+    self.nonce = None  # Nonce of the connection
+    self.next_attempt = 0
+    self.sequence = int(time.time() * 1000)
+    self.dropped = 0  # Frames dropped because the spool was full
+
+  def run(self):
+    """Forward the records forever
+    """
+
+    while True:
+      batch = self.__batch()
+      if not batch:
+        # Deliver the spooled frames
+        self.__connect()
+        continue
+      frame = encode_frame(self.sequence, batch)
+      self.sequence += 1
+      if not self.__deliver(frame):
+        self.__spool(frame)
+
+  def __batch(self) -> list:
+    """Wait for the next batch of records
+
+    Returns:
+        list: the records (empty if frames are spooled and no records
+            have been received for `retry` seconds)
+    """
+
+    try:
+      batch = [
+          self.records.get(
+              timeout=self.retry if os.path.exists(self.spool) else None)
+      ]
+    except queue.Empty:
+      return []
+    deadline = time.monotonic() + self.batch_timeout
+    while len(batch) < self.batch_size:
+      try:
+        batch.append(
+            self.records.get(timeout=max(0, deadline - time.monotonic())))
+      except queue.Empty:
+        break
+    return batch
+
+  def __connect(self) -> bool:
+    """Connect to the aggregator and send the spooled frames
+
+    Returns:
+        bool: True if connected and the spool is empty
+    """
+
+    if self.sock is not None:
+      return True
+    if time.monotonic() < self.next_attempt:
+      return False
+    self.next_attempt = time.monotonic() + self.retry
+    try:
+      self.sock = socket.create_connection(self.address, timeout=self.timeout)
+      self.nonce = receive(self.sock, NONCE)
+      if self.nonce is None:
+        raise ConnectionError("connection closed")
+    except OSError as e:
+      sys.stderr.write(f"Aggregator {self.address} not reachable: {e}\n")
+      if self.sock is not None:
+        self.sock.close()
+        self.sock = None
+      return False
+    print(f"logdog: connected to aggregator {self.address}")
+    return self.__send_spool()
+
+  def __send(self, frame: bytes) -> bool:
+    """Send a frame and wait for the acknowledgement
+
+    The frame is authenticated for the current connection.
+
+    Returns:
+        bool: True if the frame has been acknowledged
+    """
+
+    try:
+      self.sock.sendall(frame + mac(self.key, self.nonce, frame))
+      ack = receive(self.sock, ACK.size + MAC)
+      if ack is None or ACK.unpack_from(ack)[0] != FRAME.unpack_from(frame)[0]:
+        raise ConnectionError("no acknowledgement")
+      if not hmac.compare_digest(ack[ACK.size:],
+                                 mac(self.key, self.nonce, ack[:ACK.size])):
+        raise ConnectionError("acknowledgement does not authenticate")
+    except OSError as e:
+      sys.stderr.write(f"Forwarding to aggregator failed: {e}\n")
+      self.sock.close()
+      self.sock = None
+      return False
+    return True
+
+  def __deliver(self, frame: bytes) -> bool:
+    return self.__connect() and self.__send(frame)
+
+  def __spool(self, frame: bytes):
+    """Append a frame to the spool file
+    """
+
+    try:
+      size = os.path.getsize(self.spool)
+    except OSError:
+      size = 0
+    if size + len(frame) > self.max_spool:
+      self.dropped += 1
+      sys.stderr.write(
+          f"Spool {self.spool} is full, {self.dropped} frames dropped\n")
+      return
+    try:
+      with self.__open(os.O_WRONLY | os.O_APPEND | os.O_CREAT) as f:
+        f.write(frame)
+    except OSError as e:
+      self.dropped += 1
+      sys.stderr.write(f"Spooling to {self.spool} failed: {e}, "
+                       f"{self.dropped} frames dropped\n")
+
+  def __open(self, flags: int):
+    """Open the spool file (never a symlink, created with mode 0600)
+
+    Returns:
+        file: the binary file object
+    """
+
+    fd = os.open(self.spool, flags | os.O_NOFOLLOW, 0o600)
+    return os.fdopen(fd, "rb" if flags == os.O_RDONLY else "ab")
+
+  def __send_spool(self) -> bool:
+    """Send the spooled frames
+
+    Frames that could not be sent are kept in the spool file.
+
+    Returns:
+        bool: True if all frames have been sent
+    """
+
+    try:
+      f = self.__open(os.O_RDONLY)
+    except FileNotFoundError:
+      return True
+    except OSError as e:
+      # E.g. the spool has been replaced by a symlink
+      sys.stderr.write(f"Reading spool {self.spool} failed: {e}\n")
+      return True
+
+    with f:
+      sent = 0
+      while True:
+        offset = f.tell()
+        header = f.read(FRAME.size)
+        if len(header) < FRAME.size:
+          break
+        frame = header + f.read(FRAME.unpack(header)[2])
+        if not self.__send(frame):
+          # Keep the frames that have not been sent
+          f.seek(offset)
+          fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.spool) or ".")
+          with os.fdopen(fd, "wb") as rest:
+            shutil.copyfileobj(f, rest)
+          os.replace(tmp, self.spool)
+          return False
+        sent += 1
+
+    os.remove(self.spool)
+    if sent:
+      print(f"logdog: {sent} spooled frames sent to aggregator")
+    return True
+
+
+def __connection(sock: socket.socket, key: bytes, handle):
+  """Handle the frames of an agent connection
+
+  The connection is closed at the first frame that does not
+  authenticate.
+
+  Args:
+      sock (socket.socket): the connection
+      key (bytes): the key shared with the agents
+      handle (callable): called with every record
+  """
+
+  with sock:
+    nonce = os.urandom(NONCE)
+    last = -1  # Sequence number of the last frame
+    try:
+      sock.sendall(nonce)
+    except OSError:
+      return
+    while True:
+      try:
+        header = receive(sock, FRAME.size)
+        if header is None:
+          return
+        sequence, count, length = FRAME.unpack(header)
+        if length > MAX_FRAME:
+          raise ValueError(f"frame of {length} bytes")
+        payload = receive(sock, length + MAC)
+        if payload is None:
+          return
+        payload, frame_mac = payload[:length], payload[length:]
+        if not hmac.compare_digest(frame_mac, mac(key, nonce,
+                                                  header + payload)):
+          raise ValueError("frame does not authenticate")
+        if sequence <= last:
+          raise ValueError(f"frame {sequence} after frame {last}")
+        last = sequence
+        data = zlib.decompressobj().decompress(payload, MAX_FRAME)
+        records = decode_records(data)
+      except (OSError, ValueError, struct.error, zlib.error) as e:
+        sys.stderr.write(f"Aggregator: connection closed: {e}\n")
+        return
+
+      for r in records:
+        try:
+          handle(r)
+        except Exception as e:
+          sys.stderr.write(f"Aggregator: handling a record failed: {e}\n")
+      try:
+        ack = ACK.pack(sequence)
+        sock.sendall(ack + mac(key, nonce, ack))
+      except OSError:
+        return
+
+
+def serve(address: tuple, key: bytes, handle):
+  """Start an aggregator server in a thread
+
+  Each agent connection is handled in its own thread.
+
+  Args:
+      address (tuple): (host, port) to listen on
+      key (bytes): the key shared with the agents
+      handle (callable): called with every received and authenticated
+          record
+  """
+
+  server = socket.create_server(address)
+
+  def accept():
+    while True:
+      sock, _ = server.accept()
+      threading.Thread(target=__connection, args=(sock, key, handle),
+                       daemon=True).start()
+
+  threading.Thread(target=accept, daemon=True).start()
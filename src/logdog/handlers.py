@@ -10,6 +10,9 @@ Functions:
     handle_event(str, str, str, str, str): run actions for an event
     handle_exit(*args): handle exit signals
     handle_exception(str): handles an exception
+    emitter(str) -> callable: get the event handling of a handler
+    fire_correlation(str, dict, str, int): run the actions of a
+        correlation
     monitor_handlers(): serveil handler subprocesses
     spawn_handlers(): spawn handler subprocesses
 
@@ -17,18 +20,48 @@ Functions:
    https://github.com/TheTimmoth/logdog/blob/main/LICENSE
 """
 
-import re
 import subprocess as sp
 import multiprocessing as mp
+import multiprocessing.connection
+import os
+import queue
+import socket
 import sys
+import threading
 import time
 
 import logdog.actions_ as actions
+import logdog.canary as canary
 import logdog.config as config
+import logdog.correlation as correlation
+import logdog.discovery as discovery
+import logdog.forwarding as forwarding
+import logdog.lookup as lookup
+import logdog.matcher as matcher
+import logdog.multiline as multiline
+import logdog.overload as overload
+import logdog.prefilter as prefilter
+import logdog.preload as preload
+import logdog.profiling as profiling
+import logdog.regexguard as regexguard
+import logdog.scheduler as scheduler
+import logdog.state as state
+import logdog.sources as sources
+import logdog.statistics as statistics
+import logdog.streams as streams
 import logdog.strings as strings
+import logdog.timestamps as timestamps
 
 __processes = []  # Running watchers
 __output_lock = mp.Lock()  # Lock for stdout/stderr
+__records = mp.Queue()  # Events of handlers that take part in correlations
+__forwarded = mp.Queue()  # Encoded events of handlers (agent mode)
+__ready = mp.Queue()  # Names of handlers that have started reading input
+__stream = None  # Pipe of the routed lines of a stream (handler process)
+__stream_writers = []  # Write ends of the pipes of stream handlers
+__routers = []  # (input object, streams.Router) per stream
+__stdin_closed = threading.Event()  # Stdin has been read until EOF
+__canary_key = canary.new_key()  # Authenticates the canaries of this run
 
 
 def handle_event(handler_name: str,
@@ -36,7 +69,9 @@ def handle_event(handler_name: str,
                  brief_information: str = "",
                  detailed_information: str = "",
                  stdout: str = "",
-                 timestamp: time.struct_time = None):
+                 timestamp: time.struct_time = None,
+                 fields: dict = None,
+                 action_names: list = None):
   """Runs actions for an event discovered by a handler
 
   A handler discovers an event. The handler provides brief and
@@ -52,13 +87,22 @@ def handle_event(handler_name: str,
           Defaults to "".
       stdout (str, optional): additional data from stdout.
           Defaults to "".
+      timestamp (time.struct_time, optional): the event time.
+          Defaults to None.
+      fields (dict, optional): named fields of the event (e.g. the
+          named groups of the event regexp). Defaults to None.
+      action_names (list, optional): actions to perform instead of the
+          actions of the event in the config file. Defaults to None.
   """
 
   actions_to_perform = []
   try:
-    # Look for specific actions
-    actions_to_perform = config.get_event_data(handler_name,
-                                               event_name)["actions"]
+    if action_names is not None:
+      actions_to_perform = action_names
+    else:
+      # Look for specific actions
+      actions_to_perform = config.get_event_data(handler_name,
+                                                 event_name)["actions"]
   except KeyError:
     try:
       # Use default actions if no specific actions exists
@@ -98,6 +142,9 @@ def handle_event(handler_name: str,
             brief_information,
             stdout,
             timestamp,
+            fields=fields,
+            handler_name=handler_name,
+            event_name=event_name,
         )
       except Exception as e:
         __output_lock.release()
@@ -135,7 +182,7 @@ def handle_exit(*args):
       brief_information="[logdog] Program exited",
       timestamp=time.localtime(),
   )
-  for p in __processes:
+  for p in list(__processes):
     p.kill()
 
 
@@ -163,49 +210,427 @@ def handle_exception(s: str = "") -> str:
   return s
 
 
-def __handler(handler_name: str):
-  """Runs the watcher for `handler_name` to discover and process events
-
-  Runs a watcher for a handler. Events that are disccovered from
-  `stdout` of the watcher are getting processed.
+def __start_statistics(handler_name: str) -> tuple:
+  """Set up the field statistics of the events of `handler_name`
 
-  This is the main entrypoint for the spawning handler processes. For
-  each handler this function gets called exactly once.
+  Events with a `statistics` object (or a list of them) track the
+  most frequent values and the number of distinct values of a field.
+  A timer of the scheduler reports the statistics every `interval`
+  seconds as the internal event `logdog`/`statistics` and starts a new
+  interval.
 
   Args:
-      handler_name (str): the handler a watcher should be spawned for
+      handler_name (str): the handler
+
+  Returns:
+      tuple: (dict: `statistics.FieldStatistics` per event name,
+          threading.Lock: lock for the statistics)
   """
 
-  # Initializations
-  handler_data = config.get_handler_data(handler_name)
-  events = []  # Events the handler handles
-  history = []  # Recent output of stdout of the watcher
-  max_prev_lines = 0  # Highest number of watcher output to store for all events
-
-  # Initialize the events the handler should handle
-  for e in handler_data["events"]:
-    if handler_data["events"][e]["active"]:
-      # Get next and previous lines to output for event `e`
-      try:
-        num_prev_lines = handler_data["events"][e]["prev_lines"]
-      except KeyError:
-        num_prev_lines = 0
+  field_statistics = {}
+  intervals = {}  # Reporting interval per event name
+  lock = threading.Lock()
+
+  for e, event_data in config.get_handler_data(handler_name)["events"].items():
+    if not event_data["active"] or "statistics" not in event_data:
+      continue
+    l = event_data["statistics"]
+    if isinstance(l, dict):
+      l = [l]
+    field_statistics[e] = [
+        statistics.FieldStatistics(
+            s["field"],
+            top=s.get("top", 10),
+            width=s.get("width", 2048),
+            depth=s.get("depth", 4),
+            precision=s.get("precision", 12),
+        ) for s in l
+    ]
+    intervals[e] = min(s.get("interval", 3600) for s in l)
+
+  timers = scheduler.get()
+
+  def report(e: str, deadline: float):
+    timers.call_at(deadline + intervals[e], report, e, deadline + intervals[e])
+    with lock:
+      reports = [s.report() for s in field_statistics[e]]
+      for s in field_statistics[e]:
+        s.reset()
+    handle_event(
+        "logdog",
+        "statistics",
+        brief_information=f"[logdog] Statistics {handler_name}:{e}",
+        detailed_information=
+        f"$TIMESTAMP logdog[statistics]: Statistics of event {e} of handler {handler_name}\n"
+        + "\n".join(reports),
+        timestamp=time.localtime(),
+        fields={
+            "handler": handler_name,
+            "event": e
+        },
+    )
+
+  now = time.monotonic()
+  for e, interval in intervals.items():
+    timers.call_at(now + interval, report, e, now + interval)
+
+  return (field_statistics, lock)
+
+
+def __dispatching_actions(handler_name: str) -> list:
+  """Get the actions the events of a handler are dispatched to
+
+  Returns:
+      list: the action names
+  """
+
+  names = []
+  for e, event_data in config.get_handler_data(handler_name)["events"].items():
+    if not event_data["active"]:
+      continue
+    if "actions" in event_data:
+      names += event_data["actions"]
+    else:
       try:
-        num_next_lines = handler_data["events"][e]["next_lines"]
+        names += config.get_default_action_names()
       except KeyError:
-        num_next_lines = 0
+        pass
+  return names
+
+
+def __handle(handler_name: str):
+  """Get a function that runs the actions of the events of a handler
+
+  In agent mode the events are forwarded to the aggregator instead of
+  running their actions.
+
+  The canaries of the handler (`canary.PROBE`) are reported to the main
+  process once the events queued before by the actions of the handler
+  have been handled (see `actions_.probe_actions()`), so their latency
+  includes the backlog of action dispatch. Canaries of other handlers
+  are dropped.
+
+  Args:
+      handler_name (str): the handler the events belong to
+
+  Returns:
+      callable: a function that takes an event, its context lines, its
+          fields and its time (float)
+  """
+
+  try:
+    host = config.get_agent_data().get("host", socket.gethostname())
+  except KeyError:
+    host = None
+  dispatching = [] if host is not None else __dispatching_actions(handler_name)
+
+  def handle(event: dict, lines: list, fields: dict, event_time: float):
+    if event is canary.PROBE:
+      if fields["handler"] == handler_name:
+        actions.probe_actions(
+            dispatching, lambda: __records.put(
+                ("logdog", canary.EVENT, fields, time.time())))
+      return
+
+    event_data = config.get_event_data(handler_name, event["name"])
+    if host is not None:
+      # Agent mode: the aggregator runs the actions
+      __forwarded.put(
+          forwarding.encode_record({
+              "time": event_time,
+              "host": host,
+              "handler": handler_name,
+              "event": event["name"],
+              "brief_information": event_data["brief_information"],
+              "detailed_information": event_data["detailed_information"],
+              "stdout": strings.list_to_string(lines, "\n\n"),
+              "fields": fields,
+          }))
+      return
+
+    handle_event(
+        handler_name,
+        event["name"],
+        brief_information=event_data["brief_information"],
+        detailed_information=event_data["detailed_information"],
+        stdout=strings.list_to_string(lines, "\n\n"),
+        timestamp=time.localtime(event_time),
+        fields=fields,
+    )
+
+  return handle
+
+
+def emitter(handler_name: str, handle=None, correlate=None):
+  """Get a function that handles the events emitted by a `Matcher`
+
+  Events with `lookups` are dropped or tagged depending on whether a
+  field is contained in a lookup table. Events that take part in
+  correlations are sent to the main process.
+  Events with a `dedup` object are suppressed if the same event with
+  the same values of the `dedup` `keys` fields has been handled within
+  the last `window` seconds. A timer of the scheduler forgets a key
+  when its window has expired. In agent mode the events are forwarded to
+  the aggregator instead of running their actions.
+  If the handler has a `timestamp` object, events are stamped with the
+  time of their log line and get the fields `log_time`,
+  `detection_time` and `lag`. Canaries (`canary.PROBE`) are passed to
+  `handle` at once.
+
+  Replaying (see `logdog.replay`) uses the same logic with its own
+  `handle` and `correlate`. Field statistics are only collected by the
+  handler processes.
+
+  Args:
+      handler_name (str): the handler the events belong to
+      handle (callable, optional): called with the event, its context
+          lines, its fields and its time (float) for every event that
+          has not been dropped. Defaults to None (run the actions of
+          the event).
+      correlate (callable, optional): called with the handler name, the
+          event name, the key fields and the time of every event that
+          takes part in correlations. Defaults to None (send the event
+          to the correlator of the main process).
+
+  Returns:
+      callable: a function that takes an event, its context lines and
+          its fields
+  """
+
+  seen = set()  # Event and dedup keys within their window
+  seen_lock = threading.Lock()
+  timers = scheduler.get()
+  watched = correlation.watched_events(handler_name)
+  log_times = "timestamp" in config.get_handler_data(handler_name)
+  if handle is None:
+    handle = __handle(handler_name)
+    field_statistics, statistics_lock = __start_statistics(handler_name)
+  else:
+    field_statistics, statistics_lock = {}, None
+  if correlate is None:
+    correlate = lambda *record: __records.put(record)
+
+  # Lookups per event: (field, table, match, tag)
+  lookups = {}
+  for e, event_data in config.get_handler_data(handler_name)["events"].items():
+    if event_data["active"] and "lookups" in event_data:
+      lookups[e] = [(l["field"], lookup.open_table(l["table"]),
+                     l.get("match", "require"), l.get("tag", l["table"]))
+                    for l in event_data["lookups"]]
+
+  def emit(event: dict, lines: list, fields: dict):
+    if event is canary.PROBE:
+      # Internal: never looked up, counted, correlated or deduplicated
+      handle(event, lines, fields, time.time())
+      return
+
+    event_data = config.get_event_data(handler_name, event["name"])
+    event_time = time.time()
+    if log_times:
+      fields, event_time = timestamps.stamp(fields, event_time)
+
+    if event["name"] in lookups:
+      tags = []
+      for field, table, match, tag in lookups[event["name"]]:
+        found = strings.get_field(fields, field) in table
+        if match == "require" and not found:
+          return
+        if match == "suppress" and found:
+          return
+        if match == "tag" and found:
+          tags.append(tag)
+      if tags:
+        fields = dict(fields)
+        fields["tags"] = ",".join(tags)
+
+    if event["name"] in field_statistics:
+      with statistics_lock:
+        for s in field_statistics[event["name"]]:
+          s.add(fields)
+
+    if event["name"] in watched:
+      # Send the event to the correlator
+      correlate(handler_name, event["name"], {
+          k: strings.get_field(fields, k) for k in watched[event["name"]]
+      }, time.time())
+
+    if "dedup" in event_data:
+      key = (event["name"],) + tuple(
+          strings.get_field(fields, k)
+          for k in event_data["dedup"].get("keys", []))
+      with seen_lock:
+        if key in seen:
+          return
+        seen.add(key)
+      timers.call_later(event_data["dedup"].get("window", 60), seen.discard,
+                        key)
+
+    handle(event, lines, fields, event_time)
+
+  return emit
+
+
+def __regexp_guard(handler_name: str, handler_data: dict, events: list):
+  """Set up the regexp guard of `handler_name`
+
+  The `regexp_guard` object of the handler overrides the one of the
+  `logdog` object. Searches that take longer than `budget` seconds are
+  reported as the internal event `logdog`/`slow_regexp` (at most once
+  per minute and event). If `disable` is set, the event is disabled
+  until logdog is restarted.
+
+  Args:
+      handler_name (str): the handler
+      handler_data (dict): the config data of the handler
+      events (list): the compiled events of the handler
+
+  Returns:
+      regexguard.Guard: the guard or None if there is no
+          `regexp_guard` object
+  """
+
+  try:
+    guard_data = dict(config.get_regexp_guard_data())
+  except KeyError:
+    guard_data = None
+  if "regexp_guard" in handler_data:
+    guard_data = dict(guard_data or {}, **handler_data["regexp_guard"])
+  if guard_data is None or handler_data.get("format") == "json":
+    return None
+
+  reported = {}  # Last report and suppressed reports per event
+
+  def exceeded(event_name: str, seconds: float, line: str):
+    now = time.monotonic()
+    last, suppressed = reported.get(event_name, (-60, 0))
+    if now - last < 60:
+      reported[event_name] = (last, suppressed + 1)
+      return
+    reported[event_name] = (now, 0)
+
+    handle_event(
+        "logdog",
+        "slow_regexp",
+        brief_information=
+        f"[logdog] Slow regexp {handler_name}:{event_name}",
+        detailed_information=
+        f"$TIMESTAMP logdog[slow_regexp]: Regexp of event {event_name} of handler {handler_name} took {seconds * 1000:.0f} ms (budget: {guard.budget * 1000:.0f} ms, {suppressed} more since the last report)"
+        + (", event disabled" if guard.disable else "") +
+        f"\nLine: {line[:200]}",
+        timestamp=time.localtime(),
+        fields={
+            "handler": handler_name,
+            "event": event_name,
+            "seconds": round(seconds, 3),
+        },
+    )
+
+  guard = regexguard.Guard(guard_data.get("budget", 0.1),
+                           disable=guard_data.get("disable", False),
+                           exceeded=exceeded)
+  guard.install(events)
+  return guard
+
+
+def __shedder(handler_name: str, handler_data: dict, lines, matchers):
+  """Shed load of `handler_name` if it is overloaded
+
+  The `overload` object of the handler overrides the one of the
+  `logdog` object. Raising the shedding level is reported as the
+  internal event `logdog`/`overload` (once per level until the handler
+  has recovered), recovering as `logdog`/`overload_recovered`.
+
+  Args:
+      handler_name (str): the handler
+      handler_data (dict): the config data of the handler
+      lines (iterable): the lines of the input
+      matchers (callable): returns the `Matcher` objects of the handler
+
+  Returns:
+      iterable: `lines` or an `overload.Shedder` if there is an
+          `overload` object
+  """
+
+  try:
+    overload_data = dict(config.get_overload_data())
+  except KeyError:
+    overload_data = None
+  if "overload" in handler_data:
+    overload_data = dict(overload_data or {}, **handler_data["overload"])
+  if overload_data is None:
+    return lines
+
+  levels = {
+      overload.DEGRADED: "degraded, low priority events are skipped",
+      overload.CRITICAL: "critical, only high priority events are checked",
+  }
+
+  worst = [overload.NORMAL]  # Highest level since the last recovery
+
+  def changed(level: int, lag: float, shed: int):
+    for m in matchers():
+      m.shed(level)
+    if overload.NORMAL < level <= worst[0]:
+      # Only report the first time a level is reached
+      return
+    worst[0] = level
+
+    if level == overload.NORMAL:
+      event_name = "overload_recovered"
+      state = f"recovered after {shed} shed lines"
+    else:
+      event_name = "overload"
+      state = levels[level]
+    print(f"logdog: handler {handler_name} {state} (lag: {lag:.1f} s)")
+    handle_event(
+        "logdog",
+        event_name,
+        brief_information=f"[logdog] Handler {handler_name} {state}",
+        detailed_information=
+        f"$TIMESTAMP logdog[{event_name}]: Handler {handler_name} {state}. Lag: {lag:.1f} s, shed lines: {shed}",
+        timestamp=time.localtime(),
+        fields={
+            "handler": handler_name,
+            "level": level,
+            "lag": round(lag, 1),
+            "shed": shed,
+        },
+    )
+
+  return overload.Shedder(lines,
+                          lag=overload_data.get("lag", 5),
+                          sample=overload_data.get("sample", 100),
+                          max_lines=overload_data.get("max_lines", 100000),
+                          changed=changed)
+
+
+def __check_regexps():
+  """Warn about event regexps that can backtrack catastrophically
+  """
+
+  for handler_name in config.get_handler_names():
+    handler_data = config.get_handler_data(handler_name)
+    if handler_data.get("format") == "json":
+      continue
+    for event_name, event_data in handler_data["events"].items():
+      if not event_data["active"]:
+        continue
+      for w in regexguard.analyze(event_data["regexp"]):
+        sys.stderr.write(
+            f"Warning: regexp of event {event_name} of handler {handler_name} contains {w}\n"
+        )
+
 
-      # Add event to event list
-      events.append((
-          e,
-          re.compile(handler_data["events"][e]["regexp"], re.IGNORECASE),
-          num_prev_lines,
-          num_next_lines,
-      ))
+def __run_watcher(handler_name: str, handler_data: dict) -> sp.Popen:
+  """Run the watcher of `handler_name`
 
-    # Update max_prev_lines if necessary
-    if num_prev_lines > max_prev_lines:
-      max_prev_lines = num_prev_lines
+  Args:
+      handler_name (str): the handler a watcher should be run for
+      handler_data (dict): the config data of the handler
+
+  Returns:
+      sp.Popen: the watcher process
+  """
 
   # Process command and cwd of watcher to run watcher (cwd: current working directory)
   try:
@@ -244,83 +669,779 @@ def __handler(handler_name: str):
       timestamp=time.localtime(),
   )
 
+  return f
+
+
+def __canary_handlers() -> dict:
+  """Get the handlers that are probed with canaries
+
+  Only handlers with an `input` (except stdin) or a `file` can be
+  probed.
+
+  Returns:
+      dict: the config data per probed handler
+  """
+
+  try:
+    names = config.get_canary_data().get("handlers",
+                                          config.get_handler_names())
+  except KeyError:
+    return {}
+  handlers = {}
+  for h in names:
+    handler_data = config.get_handler_data(h)
+    if handler_data.get("input", {}).get("type") == "stdin":
+      continue
+    if "input" in handler_data or "file" in handler_data:
+      handlers[h] = handler_data
+  return handlers
+
+
+def __probe(handler_name: str):
+  """Get the probe of the `Matcher`s of `handler_name`
+
+  The probe recognizes the canaries of all handlers, so canaries of
+  other handlers (that read the same input) never run actions either.
+  The `Matcher` emits them as `canary.PROBE` (see `__handle()`).
+
+  Args:
+      handler_name (str): the handler
+
+  Returns:
+      callable: the probe or None if no handler is probed
+  """
+
+  if not __canary_handlers():
+    return None
+  return canary.Filter(__canary_key).check
+
+
+def __watcher_lines(handler_name: str, handler_data: dict, events: list,
+                    stdout):
+  """Get the lines of a watcher or a stream that need to be checked
+
+  If the handler has a `prefilter`, only lines that contain a literal
+  of an event regexp (and their previous and next lines) are passed.
+  The filter runs in a `grep` process (`"prefilter": "grep"`) or
+  in-process on the raw output (`"prefilter": "inline"`). Handlers with
+  `multiline` rules are not prefiltered, because the lines of a record
+  do not contain the literals.
+
+  Args:
+      handler_name (str): the handler the watcher belongs to
+      handler_data (dict): the config data of the handler
+      events (list): the compiled events of the handler
+      stdout: the `stdout` of the watcher process or the pipe of the
+          stream (binary file object)
+
+  Returns:
+      generator: the lines
+  """
+
+  fd = stdout.fileno()
+  mode = handler_data.get("prefilter")
+  if "multiline" in handler_data:
+    return sources.read_lines(fd, keep_indent=True)
+  if not mode:
+    return sources.read_lines(fd)
+
+  literals = prefilter.required_literals(events)
+  if literals is None:
+    sys.stderr.write(
+        f"Handler {handler_name}: prefilter disabled, an event regexp contains no literal\n"
+    )
+    return sources.read_lines(fd)
+
+  if handler_name in __canary_handlers():
+    literals = literals + [canary.MARK]
+  prev_lines = max([e["prev_lines"] for e in events], default=0)
+  next_lines = max([e["next_lines"] for e in events], default=0)
+  if mode == "grep":
+    g = sp.Popen(prefilter.grep_command(literals, prev_lines, next_lines),
+                 stdin=stdout,
+                 stdout=sp.PIPE)
+    stdout.close()
+    return sources.read_lines(g.stdout.fileno())
+  return prefilter.filter_lines(fd, literals, prev_lines, next_lines)
+
+
+def __open_input(handler_name: str, handler_data: dict):
+  """Open the socket input of `handler_name`
+
+  Args:
+      handler_name (str): the handler the input should be opened for
+      handler_data (dict): the config data of the handler
+
+  Returns:
+      generator: the received syslog messages of the configured
+          programs and facilities
+  """
+
+  input_data = handler_data["input"]
+  messages = sources.syslog_filter(
+      sources.open_input(input_data),
+      handler_data.get("programs"),
+      handler_data.get("facilities"),
+  )
+
+  # Event: Input has successfully been opened -> inform user
+  handle_event(
+      "logdog",
+      "input_started",
+      detailed_information=
+      f"$TIMESTAMP logdog[input_started]: Input {input_data['type']} of handler {handler_name} opened successfully",
+      brief_information=
+      f"[logdog] Input {handler_name}:{input_data['type']} opened successfully",
+      timestamp=time.localtime(),
+  )
+
+  return messages
+
+
+def __open_stream(handler_name: str, handler_data: dict):
+  """Open the pipe of the routed lines of the stream of `handler_name`
+
+  Args:
+      handler_name (str): the handler the stream should be opened for
+      handler_data (dict): the config data of the handler
+
+  Returns:
+      the pipe (binary file object)
+  """
+
+  f = os.fdopen(os.dup(__stream.fileno()), "rb", buffering=0)
+  __stream.close()
+
+  input_data = handler_data["input"]
+  name = input_data.get("path", input_data["type"])
+  # Event: Stream has successfully been opened -> inform user
+  handle_event(
+      "logdog",
+      "input_started",
+      detailed_information=
+      f"$TIMESTAMP logdog[input_started]: Input {name} of handler {handler_name} opened successfully",
+      brief_information=
+      f"[logdog] Input {handler_name}:{name} opened successfully",
+      timestamp=time.localtime(),
+  )
+
+  return f
+
+
+def __handler(handler_name: str, shared: dict):
+  """Reads the input of `handler_name` to discover and process events
+
+  The input is either the `stdout` of a watcher or a socket that
+  receives syslog messages (if the handler has an `input` object).
+
+  This is the main entrypoint for the spawning handler processes. For
+  each handler this function gets called exactly once.
+
+  Args:
+      handler_name (str): the handler an input should be read for
+      shared (dict): the queues and the lock shared with the main
+          process, its profiling settings and the stream of the handler
+          (see `spawn_handlers()`)
+  """
+
+  global __output_lock
+  global __records
+  global __forwarded
+  global __ready
+  global __stream
+  global __canary_key
+
+  # Processes forked from a server have not inherited them
+  __output_lock = shared["output_lock"]
+  __records = shared["records"]
+  __forwarded = shared["forwarded"]
+  __ready = shared["ready"]
+  __canary_key = shared["canary_key"]
+  if shared["profile"] is not None:
+    config.set_profile_data(shared["profile"])
+  if "stream" in shared:
+    __stream = shared["stream"]
+    config.set_handler_data(
+        handler_name,
+        dict(config.get_handler_data(handler_name), input=shared["input"]))
+
+  # Forked processes have inherited the pipes of all streams
+  for fd in __stream_writers:
+    os.close(fd)
+
+  profiling.setup(handler_name)
+  try:
+    __handle_lines(handler_name)
+  finally:
+    # Processes exit without running `atexit` functions
+    actions.flush_actions()
+    profiling.finish()
+
+
+def __handle_lines(handler_name: str):
+  """Reads the input of `handler_name` and feeds it to a `Matcher`
+
+  Args:
+      handler_name (str): the handler an input should be read for
+  """
+
+  # Initializations
+  handler_data = config.get_handler_data(handler_name)
+  events = preload.events(handler_name)
+  guard = __regexp_guard(handler_name, handler_data, events)
+  parser = None
+  if "timestamp" in handler_data:
+    parser = timestamps.Parser(**handler_data["timestamp"])
+  probe = __probe(handler_name)
+  m = matcher.Matcher(handler_name, events, emitter(handler_name), guard,
+                      parser, probe, scheduler.get())
+
+  if "input" in handler_data and handler_data["input"]["type"] in streams.TYPES:
+    f = __open_stream(handler_name, handler_data)
+    lines = __watcher_lines(handler_name, handler_data, events, f)
+  elif "input" in handler_data:
+    lines = __open_input(handler_name, handler_data)
+  elif discovery.is_glob(handler_data.get("file", "")):
+    __ready.put(handler_name)
+    __handle_files(handler_name, handler_data, events, guard, parser, probe)
+    return
+  else:
+    f = __run_watcher(handler_name, handler_data)
+    lines = __watcher_lines(handler_name, handler_data, events, f.stdout)
+  if "multiline" in handler_data:
+    lines = multiline.assemble(lines, handler_data["multiline"])
+  lines = __shedder(handler_name, handler_data, lines, lambda: [m])
+  shedder = lines if isinstance(lines, overload.Shedder) else None
+  __ready.put(handler_name)
+
   # Wait for events to occur
-  current_line = 0  # Number of current line in history
-  while True:
-    # Get new line from log, only if all previous lines have been processed
-    if current_line == len(history):
-      # Check if handler is still alive
-      if f.poll():
-        return
-      history.append(f.stdout.readline().decode("UTF-8").strip())
-      if config.debug:
-        print(f"{handler_name}[STDOUT]: {history[-1]}")
-
-    # Loop through all possible events...
-    for p in events:
-      # and check if an event has occurred
-      if p[1].search(history[current_line]):
-        # Check if handler is still alive
-        if f.poll():
-          return
+  for line in lines:
+    if config.debug and (shedder is None or shedder.sampled()):
+      print(f"{handler_name}[STDOUT]: {line}")
+    if m.feed(line) and shedder:
+      shedder.skipped()
 
-        # Append necessary number of next lines
-        for _ in range(p[3]):
-          history.append(f.stdout.readline().decode("UTF-8").strip())
-          if config.debug:
-            print(f"{handler_name}[STDOUT]: {history[-1]}")
+  # Input has been closed (e.g. watcher died)
+  m.flush()
 
-        print(f"{handler_name}[{p[0]}]: {history[current_line]}")
 
-        # Print num_prev_lines + num_next_lines + 1 (current_line) lines
-        handle_event(
-            handler_name,
-            p[0],
-            brief_information=config.get_event_data(handler_name,
-                                                    p[0])["brief_information"],
-            detailed_information=config.get_event_data(
-                handler_name, p[0])["detailed_information"],
-            stdout=strings.list_to_string(history[(-p[2] - p[3] - 1):],
-                                          "\n\n"),
-            timestamp=time.localtime(),
-        )
+def __handle_files(handler_name: str, handler_data: dict, events: list,
+                   guard: regexguard.Guard, parser: timestamps.Parser,
+                   probe):
+  """Follows the files that match the glob `file` of `handler_name`
+
+  All files share the compiled events and the process of the handler.
+  Each file has its own `Matcher`, so previous and next lines of an
+  event are taken from the same file. The path of the file is added to
+  the fields of an event as `file`.
+
+  Args:
+      handler_name (str): the handler the files should be followed for
+      handler_data (dict): the config data of the handler
+      events (list): the compiled events of the handler
+      guard (regexguard.Guard): the regexp guard of the handler or None
+      parser (timestamps.Parser): the timestamp parser of the handler
+          or None
+      probe (callable): the canary probe of the handler or None
+  """
+
+  emit = emitter(handler_name)
+  matchers = {}  # Matcher per followed file
+
+  def file_emitter(path: str):
+    return lambda event, lines, fields: emit(event, lines,
+                                             dict(fields, file=path))
+
+  lines = discovery.follow(handler_data["file"],
+                           keep_indent="multiline" in handler_data)
+  if "multiline" in handler_data:
+    lines = multiline.assemble(lines, handler_data["multiline"], keyed=True)
+  lines = __shedder(handler_name, handler_data, lines,
+                    lambda: matchers.values())
+  shedder = lines if isinstance(lines, overload.Shedder) else None
+
+  # Event: Files are followed -> inform user
+  handle_event(
+      "logdog",
+      "input_started",
+      detailed_information=
+      f"$TIMESTAMP logdog[input_started]: Files {handler_data['file']} of handler {handler_name} are followed",
+      brief_information=
+      f"[logdog] Input {handler_name}:{handler_data['file']} opened successfully",
+      timestamp=time.localtime(),
+  )
+
+  for path, line in lines:
+    m = matchers.get(path)
+    if line is None:
+      # The file has been closed (e.g. rotated)
+      if m:
+        m.flush()
+        del matchers[path]
+      continue
+    if m is None:
+      m = matcher.Matcher(handler_name, events, file_emitter(path), guard,
+                          parser, probe, scheduler.get())
+      matchers[path] = m
+      if shedder:
+        m.shed(shedder.level)
+    if config.debug and (shedder is None or shedder.sampled()):
+      print(f"{handler_name}[{path}]: {line}")
+    if m.feed(line) and shedder:
+      shedder.skipped()
+
+  for m in matchers.values():
+    m.flush()
+
+
+def fire_correlation(name: str, correlation_data: dict, key: str,
+                       count: int):
+  """Runs the actions of a correlation that fired
+
+  Args:
+      name (str): the name of the correlation
+      correlation_data (dict): the config data of the correlation
+      key (str): the value of the key field
+      count (int): the number of correlated events
+  """
+
+  print(f"correlations[{name}]: {key} ({count} events)")
+  handle_event(
+      "correlations",
+      name,
+      brief_information=correlation_data.get("brief_information",
+                                             f"[logdog] {name}: $KEY"),
+      detailed_information=correlation_data.get(
+          "detailed_information",
+          f"$TIMESTAMP correlations[{name}]: $COUNT events for $KEY"),
+      timestamp=time.localtime(),
+      fields={
+          "correlation": name,
+          "key": "" if key is None else key,
+          "count": count,
+      },
+      action_names=correlation_data.get("actions"),
+  )
+
+
+def __aggregate(record: dict):
+  """Runs the actions of an event forwarded by an agent
+
+  The event takes part in the correlations of the aggregator. The host
+  of the agent is added to the fields as `host`.
+
+  Args:
+      record (dict): the record (see `forwarding.encode_record()`)
+  """
+
+  fields = dict(record["fields"], host=record["host"])
+  print(f"{record['host']}:{record['handler']}[{record['event']}]")
+  __records.put((record["handler"], record["event"], fields, record["time"]))
+  handle_event(
+      record["handler"],
+      record["event"],
+      brief_information=record["brief_information"],
+      detailed_information=record["detailed_information"],
+      stdout=record["stdout"],
+      timestamp=time.localtime(record["time"]),
+      fields=fields,
+  )
+
+
+def __forwarding_key(data: dict) -> bytes:
+  """Get the key of the `agent` or `aggregator` object
+
+  Raises:
+      KeyError: if there is no key
+      ValueError: if the key is empty
+  """
+
+  if not data["key"]:
+    raise ValueError("The key of agents and aggregator must not be empty")
+  return data["key"].encode("UTF-8")
+
+
+def __start_forwarding():
+  """Start the forwarder (agent mode) and the aggregator server
+
+  The forwarder sends the events of all handlers over one connection.
+  Undelivered events are spooled to `spool` (default: `agent.spool` in
+  the state directory, see `logdog.state`). Agents and aggregator
+  authenticate the events with the shared `key`.
+  """
+
+  try:
+    agent_data = config.get_agent_data()
+  except KeyError:
+    pass
+  else:
+    if "spool" in agent_data:
+      spool = agent_data["spool"]
+      state.private_directory(os.path.dirname(os.path.abspath(spool)))
+    else:
+      spool = os.path.join(state.state_directory(), "agent.spool")
+    forwarder = forwarding.Forwarder(
+        __forwarded,
+        forwarding.parse_address(agent_data["aggregator"]),
+        __forwarding_key(agent_data),
+        spool,
+        batch_size=agent_data.get("batch_size", 100),
+        batch_timeout=agent_data.get("batch_timeout", 1),
+        retry=agent_data.get("retry", 5),
+        max_spool=agent_data.get("max_spool", 100 * 1024 * 1024),
+    )
+    threading.Thread(target=forwarder.run, daemon=True).start()
+
+  try:
+    aggregator_data = config.get_aggregator_data()
+  except KeyError:
+    pass
+  else:
+    forwarding.serve(forwarding.parse_address(aggregator_data["listen"]),
+                     __forwarding_key(aggregator_data), __aggregate)
+    handle_event(
+        "logdog",
+        "aggregator_started",
+        detailed_information=
+        f"$TIMESTAMP logdog[aggregator_started]: Aggregator listens on {aggregator_data['listen']}",
+        brief_information=
+        f"[logdog] Aggregator listens on {aggregator_data['listen']}",
+        timestamp=time.localtime(),
+    )
+
+
+def __canary_missed(handler_name: str, serial: int):
+  """Runs the actions of a canary that has not been seen in time
+
+  Args:
+      handler_name (str): the probed handler
+      serial (int): the serial of the canary
+  """
+
+  handle_event(
+      "logdog",
+      "canary_missed",
+      detailed_information=
+      f"$TIMESTAMP logdog[canary_missed]: Handler {handler_name} has not seen canary {serial} in time",
+      brief_information=f"[logdog] Canary of {handler_name} missed",
+      timestamp=time.localtime(),
+      fields={
+          "handler": handler_name,
+          "serial": serial,
+      },
+  )
+
+
+def __report_latency(handler_name: str, report: dict):
+  """Report the canary latencies of a handler
+
+  Args:
+      handler_name (str): the probed handler
+      report (dict): the latency distribution (see `canary.Probes.report()`)
+  """
+
+  def ms(seconds: float) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+  keys = ("min", "p50", "p90", "p99", "max")
+  latencies = ", ".join(f"{k} {ms(report[k])} ms" for k in keys)
+  handle_event(
+      "logdog",
+      "canary_latency",
+      detailed_information=
+      f"$TIMESTAMP logdog[canary_latency]: Handler {handler_name} has seen {report['count']} canaries ({report['missed']} missed): {latencies}",
+      brief_information=f"[logdog] Canary latency {handler_name}",
+      timestamp=time.localtime(),
+      fields={
+          "handler": handler_name,
+          "count": report["count"],
+          "missed": report["missed"],
+          **{k: ms(report[k]) for k in keys},
+      },
+  )
+
+
+def __start_probes(timers: scheduler.Scheduler) -> canary.Probes:
+  """Set up the canary probes of the handlers (see `logdog.canary`)
+
+  Canaries are sent every `interval` seconds (default 60) and their
+  latencies are reported every `report_interval` seconds (default 3600)
+  by timers of `timers`.
+
+  Args:
+      timers (scheduler.Scheduler): the scheduler of the main process
+
+  Returns:
+      canary.Probes: the probes or None if no handler is probed
+  """
+
+  handlers = __canary_handlers()
+  if not handlers:
+    return None
+  canary_data = config.get_canary_data()
+  deadline = canary_data.get("deadline", 10)
+  interval = canary_data.get("interval", 60)
+  report_interval = canary_data.get("report_interval", 3600)
+  probes = canary.Probes(handlers, deadline, __canary_missed, __canary_key)
+
+  def send(t: float):
+    timers.call_at(t + interval, send, t + interval)
+    for h, e in probes.send(time.time()):
+      sys.stderr.write(f"Canary of handler {h} not written: {e}\n")
+    timers.call_later(deadline, lambda: probes.expire(time.time()))
+
+  def report(t: float):
+    timers.call_at(t + report_interval, report, t + report_interval)
+    for h in probes.handlers:
+      __report_latency(h, probes.report(h))
+
+  now = time.monotonic()
+  timers.call_at(now + interval, send, now + interval)
+  timers.call_at(now + report_interval, report, now + report_interval)
+  return probes
+
 
-    if current_line >= max_prev_lines:
-      # Cleanup history
-      history.pop(0)
+def __open_streams() -> dict:
+  """Open a pipe per handler that reads a stream (see `logdog.streams`)
+
+  The handlers of one stream share a `streams.Router`.
+
+  Returns:
+      dict: the read end of the pipe (`mp.connection.Connection`) per
+          handler
+  """
+
+  readers = {}
+  routes = {}  # (input object, routes, default pipes) per stream
+  for h in config.get_handler_names():
+    input_data = config.get_handler_data(h).get("input")
+    if input_data is None or input_data["type"] not in streams.TYPES:
+      continue
+    r, w = os.pipe()
+    readers[h] = mp.connection.Connection(r, writable=False)
+    __stream_writers.append(w)
+
+    stream = routes.setdefault(streams.stream_key(input_data),
+                               (input_data, {}, []))
+    if "route" in input_data:
+      stream[1].setdefault(input_data["route"].encode("UTF-8"), []).append(w)
     else:
-      # Build up history
-      current_line += 1
+      stream[2].append(w)
+
+  for input_data, r, default in routes.values():
+    __routers.append((input_data, streams.Router(r, default)))
+  return readers
+
+
+def __route(input_data: dict, router: streams.Router):
+  """Route the lines of a stream to its handlers until it ends
+
+  Args:
+      input_data (dict): the `input` object of the stream
+      router (streams.Router): the router of the stream
+  """
+
+  try:
+    for chunk in streams.read_chunks(input_data):
+      router.feed(chunk)
+  except Exception:
+    handle_exception(f"Error: Reading {input_data['type']} failed")
+  if input_data["type"] == "stdin":
+    __stdin_closed.set()
+  router.close()
+
+
+def __watch_processes():
+  """Spawn an event for every handler process that has exited
+
+  Waits for the sentinels of the processes instead of polling them.
+  Once all processes have exited, None is put into the records.
+  """
+
+  while __processes:
+    sentinels = {p.sentinel: p for p in __processes}
+    for sentinel in mp.connection.wait(list(sentinels)):
+      p = sentinels[sentinel]
+      handle_event(
+          "logdog",
+          "worker_died",
+          detailed_information=f"$TIMESTAMP logdog[worker_died]: {p.name} died",
+          brief_information=f"[logdog] Worker {p.name} died",
+          timestamp=time.localtime(),
+      )
+      __processes.remove(p)
+      # TODO: add restart (for a defined number of retries) (maybe in action?)
+  __records.put(None)
 
 
 def monitor_handlers():
   """Check if handlers are still alive and spawn event if not
+
+  Meanwhile the events of the handlers that take part in correlations
+  are correlated and the handlers are probed with canaries. Their
+  timers are run by this loop (see `logdog.scheduler`). Monitoring
+  ends when stdin has been closed and all handlers have exited.
   """
 
+  timers = scheduler.Scheduler(resolution=0.1)
+  try:
+    correlator = correlation.Correlator(fire_correlation, timers)
+  except KeyError:
+    correlator = None
+  probes = __start_probes(timers)
+  threading.Thread(target=__watch_processes, daemon=True).start()
+
   while True:
-    for p in __processes:
-      if not p.is_alive():
-        handle_event(
-            "logdog",
-            "worker_died",
-            detailed_information=
-            f"$TIMESTAMP logdog[worker_died]: {p.name} died",
-            brief_information=f"[logdog] Worker {p.name} died",
-            timestamp=time.localtime(),
-        )
-        __processes.remove(p)
-        # TODO: add restart (for a defined number of retries) (maybe in action?)
-      time.sleep(1)
+    try:
+      record = __records.get(timeout=timers.timeout())
+    except queue.Empty:
+      pass
+    else:
+      if record is None:
+        # All handlers have exited
+        if __stdin_closed.is_set():
+          return
+      elif record[:2] == ("logdog", canary.EVENT):
+        if probes:
+          probes.seen(record[2]["handler"], record[2]["serial"],
+                      record[2]["sent"], record[3])
+      elif correlator:
+        correlator.record(*record)
+    timers.run()
+
+
+def __report_ready(handler_names: list, start: float, start_method: str):
+  """Report when all handler processes have started reading their input
+
+  The time since the first handler process was started and the memory
+  usage of the handler processes are reported as internal event
+  `handlers_ready`. The proportional set size (PSS) divides the pages
+  a process shares with others by the number of sharing processes, so
+  it shows how much memory the handlers really need.
+
+  Args:
+      handler_names (list): the handlers that have been started
+      start (float): the time the first handler was started
+      start_method (str): the start method of the handler processes
+  """
+
+  waiting = set(handler_names)
+  deadline = start + 60
+  while waiting:
+    try:
+      waiting.discard(
+          __ready.get(timeout=max(0, deadline - time.monotonic())))
+    except queue.Empty:
+      break
+  seconds = time.monotonic() - start
+
+  usage = [preload.memory(p.pid) for p in list(__processes)]
+  pss = sum(u.get("pss", 0) for u in usage) / 1024
+  rss = sum(u.get("rss", 0) for u in usage) / 1024
+  ready = len(handler_names) - len(waiting)
+  not_ready = f", not ready: {', '.join(sorted(waiting))}" if waiting else ""
+
+  # Event: handlers are ready -> inform user
+  handle_event(
+      "logdog",
+      "handlers_ready",
+      detailed_information=
+      f"$TIMESTAMP logdog[handlers_ready]: {ready} of {len(handler_names)} handlers ready after {seconds:.3f} s (start method {start_method}), handler processes use {pss:.1f} MiB PSS ({rss:.1f} MiB RSS){not_ready}",
+      brief_information=
+      f"[logdog] {ready} of {len(handler_names)} handlers ready in {seconds:.2f} s",
+      timestamp=time.localtime(),
+  )
 
 
 def spawn_handlers():
   """Spawning one subprocess per handler defined in the config file
+
+  The lookup tables are built before, so that all handlers share them.
+  Event regexps that can backtrack catastrophically are reported. The
+  threads of the main process (watching the tables, forwarding events,
+  routing streams) are started after the handlers have been forked.
+
+  Handlers that read stdin or a named pipe get their lines through a
+  pipe from the main process (see `logdog.streams`).
+
+  The state of the handler processes is preloaded (see
+  `logdog.preload`): by the main process before it forks the handlers
+  (start method `fork`) or by a server process the handlers are forked
+  from (start method `forkserver`).
+
+  Raises:
+      ValueError: if the start method is not supported
   """
 
+  global __output_lock
+  global __records
+  global __forwarded
+  global __ready
+
+  try:
+    start_method = config.get_workers_data().get("start_method", "fork")
+  except KeyError:
+    start_method = "fork"
+  if start_method not in ("fork", "forkserver"):
+    raise ValueError(f"Unsupported start method {start_method}")
+  context = mp.get_context(start_method)
+
+  if start_method == "forkserver":
+    # Queues and locks can only be shared with processes of the context
+    # that created them
+    __output_lock = context.Lock()
+    __records = context.Queue()
+    __forwarded = context.Queue()
+    __ready = context.Queue()
+    os.environ[preload.CONFIG_VARIABLE] = os.path.abspath(config.config_path)
+    context.set_forkserver_preload(["logdog.forkserver"])
+  else:
+    preload.load()
+
+  __check_regexps()
+  lookup.build_tables()
+
+  try:
+    profile_data = config.get_profile_data()
+  except KeyError:
+    profile_data = None
+  shared = {
+      "output_lock": __output_lock,
+      "records": __records,
+      "forwarded": __forwarded,
+      "ready": __ready,
+      "profile": profile_data,
+      "canary_key": __canary_key,
+  }
+
+  readers = __open_streams()
+
   # Spawn a subprocess for each handler this is no internal one
-  for handler in config.get_handler_names():
+  start = time.monotonic()
+  handler_names = config.get_handler_names()
+  for handler in handler_names:
+    s = shared
+    if handler in readers:
+      s = dict(shared,
+               stream=readers[handler],
+               input=config.get_handler_data(handler)["input"])
     __processes.append(
-        mp.Process(target=__handler,
-                   args=(handler, ),
-                   name=f"Worker: {handler}"))
+        context.Process(target=__handler,
+                        args=(handler, s),
+                        name=f"Worker: {handler}"))
     __processes[-1].start()
+  os.environ.pop(preload.CONFIG_VARIABLE, None)
+
+  # Threads are only started after forking, so no handler inherits a
+  # lock held by one of them
+  lookup.watch_tables()
+  __start_forwarding()
+  for r in readers.values():
+    r.close()
+  for input_data, router in __routers:
+    threading.Thread(target=__route, args=(input_data, router),
+                     daemon=True).start()
+
+  threading.Thread(target=__report_ready,
+                   args=(handler_names, start, start_method),
+                   daemon=True).start()
@@ -0,0 +1,239 @@
+"""Match events in structured (`json`) log lines
+
+Filename: jsonlog.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Handlers with `"format": "json"` parse every line as a `json` object.
+Their events are defined by predicates on single fields instead of a
+regexp on the whole line. The predicates of an event are compiled to
+closures once. Before a line is parsed, it is checked for literals
+that every matching line has to contain (field names and compared
+string values), so most lines can be skipped without parsing them.
+
+`orjson` is used for parsing if it is installed, `json` otherwise.
+
+Functions:
+    loads(str) -> dict: parse a line (None if it is no json object)
+    compile_event(str, dict) -> dict: compile the predicates of an event
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import collections.abc
+import json
+import operator
+import re
+
+try:
+  import orjson
+
+  __loads = orjson.loads
+  __errors = (orjson.JSONDecodeError, TypeError)
+except ImportError:
+  __loads = json.loads
+  __errors = (json.JSONDecodeError, TypeError)
+
+# Numeric comparison operators
+__comparisons = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def loads(line: str) -> dict:
+  """Parse a log line
+
+  Args:
+      line (str): the line
+
+  Returns:
+      dict: the parsed object or None if the line is no `json` object
+  """
+
+  try:
+    o = __loads(line)
+  except __errors:
+    return None
+  return o if isinstance(o, dict) else None
+
+
+def __getter(path: str):
+  """Get a function that returns the field `path` of an object
+
+  Args:
+      path (str): the field name. Nested fields are separated by ".".
+
+  Returns:
+      callable: returns the value or `__missing` if it does not exist
+  """
+
+  keys = path.split(".")
+  if len(keys) == 1:
+    return lambda o: o.get(path, __missing)
+
+  def get(o):
+    for k in keys:
+      if not isinstance(o, dict):
+        return __missing
+      o = o.get(k, __missing)
+    return o
+
+  return get
+
+
+__missing = object()  # Value of a field that does not exist
+
+
+def __number(value) -> float:
+  """Convert a field value to a number
+
+  Returns:
+      float: the number or None if `value` is no number
+  """
+
+  if isinstance(value, bool):
+    return None
+  if isinstance(value, (int, float)):
+    return value
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def __is_literal(s: str) -> bool:
+  """Check if `s` appears unescaped in a `json` line
+
+  Args:
+      s (str): a field name or string value
+
+  Returns:
+      bool: `True` if `s` needs no escaping, `False` otherwise
+  """
+
+  return s.isascii() and s.isprintable() and '"' not in s and "\\" not in s
+
+
+def __contains(values: frozenset, value) -> bool:
+  """Check if `value` is in `values`
+
+  Lists and objects of a line are never in `values`.
+  """
+
+  return isinstance(value, collections.abc.Hashable) and value in values
+
+
+def __predicate(path: str, condition):
+  """Compile a predicate on one field
+
+  `condition` is either a value (the field has to be equal) or an
+  object with one or more of the operators `==`, `!=`, `in`, `not_in`,
+  `<`, `<=`, `>`, `>=`, `regexp` and `exists`.
+
+  Args:
+      path (str): the field name
+      condition: the condition
+
+  Returns:
+      tuple: (cost (int), predicate (callable), literals (list))
+
+  Raises:
+      ValueError: if an operator is unknown
+  """
+
+  get = __getter(path)
+  if not isinstance(condition, dict):
+    condition = {"==": condition}
+
+  predicates = []  # (cost, predicate)
+  key = path.split(".")[-1]
+  literals = [f'"{key}"'] if __is_literal(key) else []
+  for op, value in condition.items():
+    if op == "==":
+      predicates.append((0, lambda o, v=value: get(o) == v))
+      if isinstance(value, str) and __is_literal(value):
+        literals.append(value)
+      elif isinstance(value, int) and not isinstance(value, bool):
+        literals.append(str(value))
+    elif op == "!=":
+      predicates.append((0, lambda o, v=value: get(o) != v))
+    elif op == "in":
+      values = frozenset(value)
+      predicates.append((1, lambda o, v=values: __contains(v, get(o))))
+    elif op == "not_in":
+      values = frozenset(value)
+      predicates.append((1, lambda o, v=values: not __contains(v, get(o))))
+    elif op in __comparisons:
+
+      def compare(o, f=__comparisons[op], v=value):
+        n = __number(get(o))
+        return n is not None and f(n, v)
+
+      predicates.append((2, compare))
+    elif op == "regexp":
+
+      def search(o, p=re.compile(value, re.IGNORECASE)):
+        v = get(o)
+        return isinstance(v, str) and p.search(v) is not None
+
+      predicates.append((3, search))
+    elif op == "exists":
+      predicates.append(
+          (0, lambda o, v=bool(value): (get(o) is not __missing) == v))
+    else:
+      raise ValueError(f"Unknown operator {op} for field {path}")
+
+  if condition.get("exists", True) is False or "!=" in condition or \
+      "not_in" in condition:
+    # A missing field may satisfy the condition
+    literals = []
+
+  cost = max([c for c, _ in predicates], default=0)
+  if len(predicates) == 1:
+    return (cost, predicates[0][1], literals)
+  predicates = [p for _, p in sorted(predicates, key=lambda p: p[0])]
+  return (cost, lambda o: all(p(o) for p in predicates), literals)
+
+
+def compile_event(name: str, event_data: dict) -> dict:
+  """Compile the field predicates of an event
+
+  Args:
+      name (str): the name of the event
+      event_data (dict): the config data of the event with a `fields`
+          object that maps field names to conditions
+
+  Returns:
+      dict: the event with the keys `name`, `predicate`, `literals`,
+          `prev_lines` and `next_lines`
+  """
+
+  compiled = sorted(
+      (__predicate(path, condition)
+       for path, condition in event_data["fields"].items()),
+      key=lambda p: p[0],
+  )
+  predicates = [p for _, p, _ in compiled]
+  # Check long (more selective) literals first
+  literals = sorted({l for _, _, ls in compiled for l in ls},
+                    key=len,
+                    reverse=True)
+
+  if len(predicates) == 1:
+    predicate = predicates[0]
+  else:
+    predicate = lambda o: all(p(o) for p in predicates)
+
+  return {
+      "name": name,
+      "predicate": predicate,
+      "literals": literals,
+      "prev_lines": event_data.get("prev_lines", 0),
+      "next_lines": event_data.get("next_lines", 0),
+  }
@@ -29,10 +29,11 @@ import time
 import logdog.actions_ as actions
 import logdog.config as config
 import logdog.handlers as handlers
+import logdog.profiling as profiling
 import logdog.strings as strings
 
 
-def logdog(config_file: str):
+def logdog(config_file: str, profile: bool = False, stdin_handler: str = None):
   """The logdog: an event handling daemon mainly designed for logfiles
 
   The configuration is obtained from a config file. Please look at the
@@ -41,6 +42,10 @@ def logdog(config_file: str):
 
   Args:
       config_file (str): The config file to configure the logdog daemon
+      profile (bool, optional): Profile the main process and all
+          handlers. Defaults to False.
+      stdin_handler (str, optional): The handler that reads stdin
+          instead of its configured input. Defaults to None.
 
   Raises:
       FileNotFoundError: if `config_file` does not exist
@@ -71,6 +76,19 @@ def logdog(config_file: str):
   try:
     config.parse_config(config_file)
     actions.discover_actions()
+    if profile:
+      try:
+        profile_data = config.get_profile_data()
+      except KeyError:
+        profile_data = {}
+      profile_data["enabled"] = True
+      profile_data.pop("handlers", None)
+      config.set_profile_data(profile_data)
+    if stdin_handler:
+      config.set_handler_data(
+          stdin_handler,
+          dict(config.get_handler_data(stdin_handler),
+               input={"type": "stdin"}))
   except Exception as e:
     # Fatal error occurred -> no action handling possible
     handlers.handle_exception("Error: Watchdog cannot be executed")
@@ -88,6 +106,13 @@ def logdog(config_file: str):
         "$TIMESTAMP logdog[no_exit_notify]: there may be no exit notify",
         timestamp=time.localtime())
 
+  # Profile the main process (dispatches internal events)
+  try:
+    profiling.setup("main")
+    atexit.register(profiling.finish)
+  except Exception as e:
+    handlers.handle_exception("Warning: profiling not available")
+
   # Spawn and monitor the handlers
   try:
     atexit.register(handlers.handle_exit)
@@ -0,0 +1,351 @@
+"""Lookup tables for event fields
+
+Filename: lookup.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Lookup tables are loaded from text files with one value per line.
+A table of type `cidr` contains IP addresses and networks, a table of
+type `set` contains exact values. Events can check a field against a
+table after their regexp matched.
+
+The main process builds an index file per table: `cidr` tables are
+stored as sorted, merged address ranges (a flattened prefix tree),
+`set` tables as sorted 64 bit hashes. The handler processes map the
+index files read-only, so all processes share the same pages and
+lookups are binary searches. If a source file changes, the main
+process rebuilds the index in the background and replaces it
+atomically. The handler processes notice the new index and map it.
+
+Classes:
+    Table: a read-only lookup table
+
+Functions:
+    address_key(str) -> bytes: get the key of an IP address
+    value_key(str) -> bytes: get the key of a value of a `set` table
+    build_index(str, str, str): build the index file of a table
+    index_path(str) -> str: get the path of the index file of a table
+    build_tables(): build the index files of all tables
+    watch_tables(): rebuild index files if the source files change
+    open_table(str) -> Table: open a table of the config file
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import hashlib
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import logdog.config as config
+import logdog.scheduler as scheduler
+import logdog.state as state
+
+MAGIC = b"LDLT"  # Magic bytes of an index file
+HEADER = struct.Struct("!4sBQ")  # Magic, type, number of records
+TYPES = {"cidr": 1, "set": 2}  # Table types
+RECORD_SIZES = {1: 32, 2: 8}  # Record size per table type
+CHECK_INTERVAL = 1  # Seconds between checks for a new index file
+
+__tables = {}  # Opened tables of this process
+
+
+def address_key(value: str) -> bytes:
+  """Convert an IP address to 16 bytes (IPv4 mapped to IPv6)
+
+  Args:
+      value (str): the address
+
+  Returns:
+      bytes: the address or None if `value` is no IP address
+  """
+
+  try:
+    a = ipaddress.ip_address(value.strip())
+  except ValueError:
+    return None
+  if a.version == 4:
+    return b"\0" * 10 + b"\xff\xff" + a.packed
+  return a.packed
+
+
+def value_key(value: str) -> bytes:
+  """Get the hash of a value of a `set` table
+
+  Args:
+      value (str): the value
+
+  Returns:
+      bytes: the hash
+  """
+
+  return hashlib.blake2b(value.strip().encode("UTF-8"),
+                         digest_size=8).digest()
+
+
+def build_index(table_type: str, source_path: str, path: str):
+  """Build the index file of a table
+
+  Empty lines and lines starting with "#" are ignored. The index file
+  is written to a temporary file first and replaces `path` atomically.
+
+  Args:
+      table_type (str): `cidr` or `set`
+      source_path (str): the text file with one value per line
+      path (str): the index file
+
+  Raises:
+      KeyError: if `table_type` is unknown
+      ValueError: if a `cidr` table contains an invalid network
+  """
+
+  t = TYPES[table_type]
+  with open(source_path, "r") as f:
+    values = [l.strip() for l in f]
+  values = [v for v in values if v and not v.startswith("#")]
+
+  if t == TYPES["cidr"]:
+    ranges = []
+    for v in values:
+      n = ipaddress.ip_network(v, strict=False)
+      if n.version == 4:
+        offset = 0xffff00000000
+      else:
+        offset = 0
+      ranges.append((offset + int(n.network_address),
+                     offset + int(n.broadcast_address)))
+    ranges.sort()
+
+    # Merge overlapping and adjacent ranges
+    merged = []
+    for start, end in ranges:
+      if merged and start <= merged[-1][1] + 1:
+        merged[-1][1] = max(merged[-1][1], end)
+      else:
+        merged.append([start, end])
+    records = [
+        start.to_bytes(16, "big") + end.to_bytes(16, "big")
+        for start, end in merged
+    ]
+  else:
+    records = sorted(set(value_key(v) for v in values))
+
+  directory = os.path.dirname(path) or "."
+  os.makedirs(directory, exist_ok=True)
+  fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+  with os.fdopen(fd, "wb") as f:
+    f.write(HEADER.pack(MAGIC, t, len(records)))
+    for r in records:
+      f.write(r)
+  os.replace(tmp, path)
+
+
+def index_path(table: str) -> str:
+  """Get the path of the index file of `table`
+
+  The index files are stored in `table_dir` of the `logdog` object of
+  the config file (default: `tables` in the state directory, see
+  `logdog.state`). Only the current user may write the directory.
+
+  Args:
+      table (str): the name of the table
+
+  Returns:
+      str: the path
+
+  Raises:
+      PermissionError: if the directory can be written by other users
+  """
+
+  try:
+    directory = state.private_directory(config.get_table_dir())
+  except KeyError:
+    directory = state.state_directory("tables")
+  return os.path.join(directory, f"{table}.idx")
+
+
+def build_tables():
+  """Build the index files of all tables of the config file
+  """
+
+  try:
+    names = config.get_table_names()
+  except KeyError:
+    return
+  for name in names:
+    table_data = config.get_table_data(name)
+    build_index(table_data["type"], table_data["path"], index_path(name))
+
+
+def watch_tables():
+  """Rebuild the index files of tables whose source files change
+
+  A timer of the scheduler checks the source files every
+  `reload_interval` seconds (default: 10). Changed tables are rebuilt
+  in a thread, so building an index does not delay other timers.
+  """
+
+  try:
+    names = config.get_table_names()
+  except KeyError:
+    return
+  if not names:
+    return
+
+  mtimes = {}
+  for name in names:
+    mtimes[name] = os.stat(config.get_table_data(name)["path"]).st_mtime
+  interval = min(
+      config.get_table_data(n).get("reload_interval", 10) for n in names)
+  timers = scheduler.get()
+
+  def rebuild(changed: list):
+    for name in changed:
+      table_data = config.get_table_data(name)
+      try:
+        build_index(table_data["type"], table_data["path"], index_path(name))
+      except Exception as e:
+        sys.stderr.write(f"Reloading table {name} failed: {e}\n")
+      else:
+        print(f"logdog: table {name} reloaded")
+    timers.call_later(interval, check)
+
+  def check():
+    changed = []
+    for name in names:
+      try:
+        mtime = os.stat(config.get_table_data(name)["path"]).st_mtime
+      except OSError as e:
+        sys.stderr.write(f"Reloading table {name} failed: {e}\n")
+        continue
+      if mtime != mtimes[name]:
+        mtimes[name] = mtime
+        changed.append(name)
+    if changed:
+      threading.Thread(target=rebuild, args=(changed, ), daemon=True).start()
+    else:
+      timers.call_later(interval, check)
+
+  timers.call_later(interval, check)
+
+
+class Table:
+  """A read-only lookup table backed by an index file
+
+  The index file is mapped into memory. If the index file has been
+  replaced (checked at most every `CHECK_INTERVAL` seconds), the new
+  file is mapped and the old one is unmapped.
+
+  Args:
+      path (str): the index file
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self.inode = None
+    self.next_check = 0
+    self.map = None
+    self.lock = threading.Lock()  # Events may be emitted by timers
+    self.__open()
+
+  def __open(self):
+    with open(self.path, "rb") as f:
+      inode = os.fstat(f.fileno()).st_ino
+      m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, t, count = HEADER.unpack_from(m)
+    if magic != MAGIC or t not in RECORD_SIZES:
+      m.close()
+      raise ValueError(f"{self.path} is no index file")
+
+    if self.map is not None:
+      self.map.close()
+    self.map = m
+    self.inode = inode
+    self.type = t
+    self.count = count
+    self.record_size = RECORD_SIZES[t]
+
+  def __refresh(self):
+    now = time.monotonic()
+    if now < self.next_check:
+      return
+    self.next_check = now + CHECK_INTERVAL
+    try:
+      if os.stat(self.path).st_ino != self.inode:
+        self.__open()
+    except (OSError, ValueError) as e:
+      sys.stderr.write(f"Opening table {self.path} failed: {e}\n")
+
+  def __search(self, key: bytes) -> int:
+    """Get the index of the last record whose first bytes are <= `key`
+
+    Returns:
+        int: the index or -1
+    """
+
+    m = self.map
+    size = self.record_size
+    low = 0
+    high = self.count
+    while low < high:
+      middle = (low + high) // 2
+      offset = HEADER.size + middle * size
+      if m[offset:offset + len(key)] <= key:
+        low = middle + 1
+      else:
+        high = middle
+    return low - 1
+
+  def __contains__(self, value) -> bool:
+    if value is None:
+      return False
+    with self.lock:
+      return self.__lookup(str(value))
+
+  def __lookup(self, value: str) -> bool:
+    """Check if `value` is in the table (`lock` is held)
+    """
+
+    self.__refresh()
+
+    if self.type == TYPES["cidr"]:
+      key = address_key(value)
+      if key is None:
+        return False
+      i = self.__search(key)
+      if i < 0:
+        return False
+      offset = HEADER.size + i * self.record_size
+      return key <= self.map[offset + 16:offset + 32]
+
+    key = value_key(value)
+    i = self.__search(key)
+    if i < 0:
+      return False
+    offset = HEADER.size + i * self.record_size
+    return self.map[offset:offset + 8] == key
+
+
+def open_table(table: str) -> Table:
+  """Open the table `table` of the config file
+
+  Each process opens a table only once.
+
+  Args:
+      table (str): the name of the table
+
+  Returns:
+      Table: the table
+  """
+
+  if table not in __tables:
+    __tables[table] = Table(index_path(table))
+  return __tables[table]
@@ -0,0 +1,373 @@
+"""Match lines against the events of a handler
+
+Filename: matcher.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+A `Matcher` gets fed the lines of one input (e.g. the `stdout` of a
+watcher) and checks every line against the events of a handler. It
+keeps the history that is needed for the previous lines of an event
+and collects the next lines of an event before the event is emitted.
+
+Classes:
+    Fields: named groups of a match, extracted on first access
+    Matcher: match lines against events
+
+Functions:
+    compile_events(dict) -> list: compile the events of a handler
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import collections
+import collections.abc
+import itertools
+import re
+import threading
+
+import logdog.canary as canary
+import logdog.jsonlog as jsonlog
+
+# Priorities of events (see `Matcher.shed()`)
+PRIORITIES = {"low": 0, "normal": 1, "high": 2}
+
+
+def compile_events(handler_data: dict) -> list:
+  """Compile the active events of a handler
+
+  Events of handlers with `"format": "json"` are compiled by
+  `jsonlog.compile_event()`.
+
+  Args:
+      handler_data (dict): the config data of the handler
+
+  Returns:
+      list: a dict per active event with the keys `name`, `regexp`
+          (compiled), `prev_lines`, `next_lines`, `next_lines_timeout`
+          (seconds or None) and `priority` (int, see `PRIORITIES`)
+  """
+
+  structured = handler_data.get("format") == "json"
+  events = []
+  for name, event_data in handler_data["events"].items():
+    if not event_data["active"]:
+      continue
+    if structured:
+      e = jsonlog.compile_event(name, event_data)
+    else:
+      e = {
+          "name": name,
+          "regexp": re.compile(event_data["regexp"], re.IGNORECASE),
+          "prev_lines": event_data.get("prev_lines", 0),
+          "next_lines": event_data.get("next_lines", 0),
+      }
+    e["priority"] = PRIORITIES[event_data.get("priority", "normal")]
+    e["next_lines_timeout"] = event_data.get("next_lines_timeout", 10)
+    events.append(e)
+  return events
+
+
+class Fields(collections.abc.Mapping):
+  """The named groups of a match as a read-only mapping
+
+  The groups are only extracted from the match if a field is accessed
+  (e.g. because a template contains a field keyword), so events whose
+  fields are not used do not pay for the extraction. Groups that did
+  not participate in the match are left out.
+
+  Args:
+      match (re.Match, optional): the match of the event regexp.
+          Defaults to None (no fields).
+  """
+
+  def __init__(self, match: re.Match = None):
+    self.__match = match
+    self.__fields = None
+
+  def __materialize(self) -> dict:
+    if self.__fields is None:
+      if self.__match is None or not self.__match.re.groupindex:
+        self.__fields = {}
+      else:
+        self.__fields = {
+            k: v for k, v in self.__match.groupdict().items() if v is not None
+        }
+      self.__match = None
+    return self.__fields
+
+  def __getitem__(self, key: str) -> str:
+    return self.__materialize()[key]
+
+  def __iter__(self):
+    return iter(self.__materialize())
+
+  def __len__(self) -> int:
+    return len(self.__materialize())
+
+  def __repr__(self) -> str:
+    return f"Fields({self.__materialize()!r})"
+
+
+class Matcher:
+  """Match lines against events and collect their context
+
+  Every line that is fed to the matcher is checked against all events.
+  Events with a `predicate` (see `jsonlog.compile_event()`) are checked
+  against the parsed `json` line. The line is only parsed if it
+  contains the `literals` of such an event. If an event matches, the
+  `prev_lines` lines before the line are taken from the history. The
+  event is emitted as soon as its `next_lines` lines have been fed as
+  well. If a `scheduler.Scheduler` is given, an event is also emitted
+  `next_lines_timeout` seconds after its match, even if its next lines
+  have not been fed yet (e.g. because the input is quiet).
+
+  If a `regexguard.Guard` is given, every regexp search has a time
+  budget. Events whose search exceeded the budget are reported to the
+  guard and removed from `events` if the guard disables them.
+
+  If a `timestamps.Parser` is given, the time of the timestamp of the
+  matching line is added to the fields of an event as `log_time`
+  (float or None).
+
+  If a `probe` is given, lines that contain `canary.MARK` are passed to
+  it. Lines it recognizes as canaries are removed from multi-line
+  records and not added to the history. They are checked against the
+  events like any other line, but instead of their matches the
+  internal event `canary.PROBE` is emitted with the fields `handler`,
+  `serial` and `sent` of the canary (see `logdog.canary`). All other
+  lines are checked as usual.
+
+  Args:
+      handler_name (str): the name of the handler
+      events (list): the events as returned by `compile_events()`
+      emit (callable): called with the event (dict), its context
+          lines (list) and its fields (`Fields`) whenever an event is
+          complete
+      guard (regexguard.Guard, optional): the guard of the regexp
+          searches. Defaults to None.
+      timestamps (timestamps.Parser, optional): the parser of the
+          timestamps of the lines. Defaults to None.
+      probe (callable, optional): called with every line that
+          contains `canary.MARK`, returns the handler, serial and time
+          (tuple) if the line is a canary, else None (see
+          `canary.Filter.check()`). Defaults to None.
+      timers (scheduler.Scheduler, optional): the scheduler of the
+          deadlines of events waiting for next lines. Defaults to None.
+  """
+
+  def __init__(self,
+               handler_name: str,
+               events: list,
+               emit,
+               guard=None,
+               timestamps=None,
+               probe=None,
+               timers=None):
+    self.handler_name = handler_name
+    self.events = events
+    self.emit = emit
+    self.guard = guard
+    self.timestamps = timestamps
+    self.probe = probe
+    self.timers = timers
+    self.active = events  # Events that are checked (see `shed()`)
+
+    # History of the recent lines (including the current line)
+    max_prev_lines = max([e["prev_lines"] for e in events], default=0)
+    self.history = collections.deque(maxlen=max_prev_lines + 1)
+
+    # Events waiting for their next lines:
+    # [event, context, remaining, fields, deadline timer]
+    self.pending = []
+    self.lock = threading.Lock()  # Lock for `pending` (see `timers`)
+
+    if any("predicate" in e for e in events):
+      self.__matches = self.__match_json
+    elif guard:
+      self.__matches = self.__match_guarded
+    else:
+      self.__matches = self.__match_regexp
+
+  def __match_regexp(self, line: str) -> list:
+    """Get the events whose regexp matches `line`
+
+    Returns:
+        list: (event, fields) per matching event
+    """
+
+    matches = []
+    for e in self.active:
+      match = e["regexp"].search(line)
+      if match:
+        matches.append((e, Fields(match)))
+    return matches
+
+  def __match_guarded(self, line: str) -> list:
+    """Get the events whose regexp matches `line` within the budget
+
+    Returns:
+        list: (event, fields) per matching event
+    """
+
+    matches = []
+    slow = []
+    for e in self.active:
+      match, seconds = self.guard.search(e["regexp"], line)
+      if match:
+        matches.append((e, Fields(match)))
+      if seconds > self.guard.budget:
+        slow.append((e, seconds))
+
+    for e, seconds in slow:
+      if self.guard.disable:
+        for events in (self.events, self.active):
+          if e in events:
+            events.remove(e)
+      self.guard.exceeded(e["name"], seconds, line)
+    return matches
+
+  def __match_json(self, line: str) -> list:
+    """Get the events whose predicate matches the parsed `line`
+
+    Returns:
+        list: (event, fields) per matching event
+    """
+
+    matches = []
+    o = None
+    for e in self.active:
+      for l in e["literals"]:
+        if l not in line:
+          break
+      else:
+        if o is None:
+          o = jsonlog.loads(line)
+          if o is None:
+            return matches
+        if e["predicate"](o):
+          matches.append((e, o))
+    return matches
+
+  def shed(self, level: int):
+    """Skip the events whose priority is lower than `level`
+
+    Lines are still added to the history and to events that are
+    waiting for next lines.
+
+    Args:
+        level (int): the lowest priority that is checked (0: all events)
+    """
+
+    self.active = [e for e in self.events if e["priority"] >= level]
+
+  def feed(self, line: str) -> bool:
+    """Check `line` for events
+
+    Args:
+        line (str): the line to check
+
+    Returns:
+        bool: True if the line has been shed: events have been skipped
+            (see `shed()`) and none of the checked events matched
+    """
+
+    if self.probe is not None and canary.MARK in line:
+      lines = []
+      canaries = []
+      for l in line.split("\n"):
+        c = self.probe(l) if canary.MARK in l else None
+        if c is None:
+          lines.append(l)
+        else:
+          canaries.append((l, c))
+      shed = bool(lines) and self.__check("\n".join(lines))
+      for l, c in canaries:
+        # Canaries take the time of matching, their matches are dropped
+        self.__matches(l)
+        self.emit(canary.PROBE, [l], {
+            "handler": c[0],
+            "serial": c[1],
+            "sent": c[2],
+        })
+      return shed
+    return self.__check(line)
+
+  def __check(self, line: str) -> bool:
+    """Check `line` for events (see `feed()`)
+    """
+
+    self.history.append(line)
+
+    # Complete events that are waiting for next lines
+    if self.pending:
+      complete = []
+      with self.lock:
+        waiting = []
+        for p in self.pending:
+          p[1].append(line)
+          p[2] -= 1
+          if p[2]:
+            waiting.append(p)
+          else:
+            complete.append(p)
+        self.pending = waiting
+      for p in complete:
+        if p[4] is not None:
+          self.timers.cancel(p[4])
+        self.emit(p[0], p[1], p[3])
+
+    # Loop through all occurred events
+    log_time = False  # Not parsed yet
+    matches = self.__matches(line)
+    for e, fields in matches:
+      print(f"{self.handler_name}[{e['name']}]: {line}")
+
+      if self.timestamps is not None:
+        if log_time is False:
+          log_time = self.timestamps.parse(line)
+        fields = dict(fields, log_time=log_time)
+
+      context = list(
+          itertools.islice(self.history,
+                           max(0,
+                               len(self.history) - e["prev_lines"] - 1),
+                           None))
+      if e["next_lines"]:
+        p = [e, context, e["next_lines"], fields, None]
+        with self.lock:
+          self.pending.append(p)
+          if self.timers is not None and e["next_lines_timeout"]:
+            p[4] = self.timers.call_later(e["next_lines_timeout"],
+                                          self.__expire, p)
+      else:
+        self.emit(e, context, fields)
+    return not matches and len(self.active) < len(self.events)
+
+  def __expire(self, p: list):
+    """Emit an event whose next lines have not been fed in time
+    """
+
+    with self.lock:
+      for i, q in enumerate(self.pending):
+        if q is p:
+          del self.pending[i]
+          break
+      else:
+        # Completed meanwhile
+        return
+    self.emit(p[0], p[1], p[3])
+
+  def flush(self):
+    """Emit all events that are still waiting for next lines
+    """
+
+    with self.lock:
+      pending = self.pending
+      self.pending = []
+    for p in pending:
+      if p[4] is not None:
+        self.timers.cancel(p[4])
+      self.emit(p[0], p[1], p[3])
@@ -0,0 +1,227 @@
+"""Assemble multi-line records before matching
+
+Filename: multiline.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Stack traces and other multi-line messages arrive as many lines. An
+`Assembler` merges the lines of such a message into one record (lines
+joined by a newline), so the events of a handler check one record
+instead of every line and can match the whole message.
+
+A line continues the current record if it matches the `continuation`
+regexp, if it is indented (`indent`) or if it does not match the
+`start` regexp. Records are bounded by `max_lines` and `max_bytes`:
+further lines of a record that is full are dropped and counted. The
+last record of a burst is emitted once no line has arrived for
+`timeout` seconds. This deadline is a timer of the scheduler (see
+`logdog.scheduler`).
+
+Classes:
+    Assembler: merge the lines of multi-line records
+
+Functions:
+    assemble(generator, dict, bool, Scheduler) -> generator: yield the
+        records of a line source
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import queue
+import re
+import threading
+import time
+
+import logdog.scheduler as scheduler
+
+__expired = object()  # Put into the queue when a record may be complete
+
+class Assembler:
+  """Merge the lines of multi-line records
+
+  If none of `start`, `continuation` and `indent` is given, indented
+  lines continue a record.
+
+  Args:
+      start (str, optional): regexp that matches the first line of a
+          record. Defaults to None.
+      continuation (str, optional): regexp that matches the following
+          lines of a record. Defaults to None.
+      indent (bool, optional): indented lines continue a record.
+          Defaults to False.
+      max_lines (int, optional): maximum number of lines of a record.
+          Defaults to 500.
+      max_bytes (int, optional): maximum size of a record in bytes.
+          Defaults to 65536.
+  """
+
+  def __init__(self,
+               start: str = None,
+               continuation: str = None,
+               indent: bool = False,
+               max_lines: int = 500,
+               max_bytes: int = 65536):
+    self.start = re.compile(start) if start else None
+    self.continuation = re.compile(continuation) if continuation else None
+    self.indent = indent or not (start or continuation)
+    self.max_lines = max_lines
+    self.max_bytes = max_bytes
+
+    self.lines = []  # Lines of the current record
+    self.size = 0  # Bytes of the current record
+    self.dropped = 0  # Dropped lines of the current record
+
+  def continues(self, line: str) -> bool:
+    """Check if `line` continues the current record
+
+    Args:
+        line (str): the line
+
+    Returns:
+        bool: True if the line belongs to the current record
+    """
+
+    if self.continuation and self.continuation.search(line):
+      return True
+    if self.indent and line[:1] in (" ", "\t"):
+      return True
+    return self.start is not None and not self.start.search(line)
+
+  def feed(self, line: str) -> str:
+    """Add a line
+
+    Args:
+        line (str): the line
+
+    Returns:
+        str: the previous record if `line` starts a new one, else None
+    """
+
+    if self.lines and self.continues(line):
+      size = len(line) + 1 if line.isascii() else len(line.encode()) + 1
+      if (len(self.lines) < self.max_lines and
+          self.size + size <= self.max_bytes):
+        self.lines.append(line)
+        self.size += size
+      else:
+        self.dropped += 1
+      return None
+
+    record = self.flush()
+    self.lines.append(line.lstrip())
+    self.size = len(line)
+    return record
+
+  def flush(self) -> str:
+    """Complete the current record
+
+    Returns:
+        str: the record or None if there is no record
+    """
+
+    if not self.lines:
+      return None
+    if self.dropped:
+      self.lines.append(f"[{self.dropped} lines dropped]")
+    record = "\n".join(self.lines)
+    self.lines = []
+    self.size = 0
+    self.dropped = 0
+    return record
+
+
+def __read(lines, items: queue.SimpleQueue):
+  """Put the lines into `items`, followed by None or the exception
+  """
+
+  try:
+    for line in lines:
+      items.put(line)
+  except Exception as e:
+    items.put(e)
+  else:
+    items.put(None)
+
+
+def assemble(lines, rules: dict, keyed: bool = False, timers=None):
+  """Yield the records of a line source
+
+  The lines are read in a thread, so records can be completed after
+  `timeout` seconds even if the source does not yield another line.
+  One timer of `timers` at a time wakes the generator when the oldest
+  record may be complete.
+
+  Args:
+      lines (iterable): the lines
+      rules (dict): the arguments of `Assembler` and `timeout`
+          (float, seconds, defaults to 1)
+      keyed (bool, optional): `lines` yields tuples (key, line), each
+          key (e.g. a file) has its own records and a line None
+          completes the record of its key (see `discovery.follow()`).
+          Defaults to False.
+      timers (scheduler.Scheduler, optional): the scheduler of the
+          timeouts. Defaults to None (the scheduler of the process).
+
+  Yields:
+      str: the records (tuples (key, record) if `keyed`)
+  """
+
+  timeout = rules.get("timeout", 1)
+  arguments = {k: v for k, v in rules.items() if k != "timeout"}
+  if timers is None:
+    timers = scheduler.get()
+  items = queue.SimpleQueue()
+  threading.Thread(target=__read, args=(lines, items), daemon=True).start()
+
+  assemblers = {}  # Assembler per key
+  pending = {}  # Time of the last line per key with a record, oldest first
+  timer = None  # Timer of the oldest record
+  while True:
+    if pending and timer is None:
+      timer = timers.call_at(
+          next(iter(pending.values())) + timeout, items.put, __expired)
+    item = items.get()
+    if item is __expired:
+      # Complete the records that have not been continued in time
+      timer = None
+      now = time.monotonic()
+      while pending and next(iter(pending.values())) + timeout <= now:
+        key = next(iter(pending))
+        del pending[key]
+        record = assemblers[key].flush()
+        yield (key, record) if keyed else record
+      continue
+
+    if item is None or isinstance(item, Exception):
+      if timer is not None:
+        timers.cancel(timer)
+      for key, a in assemblers.items():
+        record = a.flush()
+        if record is not None:
+          yield (key, record) if keyed else record
+      if item is not None:
+        raise item
+      return
+
+    key, line = item if keyed else (None, item)
+    a = assemblers.get(key)
+    if a is None:
+      a = assemblers[key] = Assembler(**arguments)
+
+    if line is None:
+      # The source of `key` has been closed
+      pending.pop(key, None)
+      record = assemblers.pop(key).flush()
+      if record is not None:
+        yield (key, record)
+      yield item
+      continue
+
+    record = a.feed(line)
+    pending.pop(key, None)
+    pending[key] = time.monotonic()
+    if record is not None:
+      yield (key, record) if keyed else record
@@ -0,0 +1,156 @@
+"""Detect overloaded handlers and shed load
+
+Filename: overload.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+If a log storm produces lines faster than a handler can check them, the
+pipe of the watcher fills and alerting is delayed for all events. A
+`Shedder` reads the input in a thread as fast as possible, so the
+watcher is not blocked, and measures the lag between reading a line
+and checking it. If the lag exceeds the configured `lag`, the handler
+is degraded: events with the priority `low` are skipped and debug
+output is sampled. If the lag exceeds twice the `lag`, events with the
+priority `normal` are skipped as well. Events with the priority `high`
+are always checked. A line is shed if events have been skipped and
+none of the checked events matched it.
+
+Classes:
+    Shedder: read lines ahead and choose the shedding level
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import queue
+import threading
+import time
+
+# Shedding levels
+NORMAL = 0  # Check all events
+DEGRADED = 1  # Skip low priority events
+CRITICAL = 2  # Skip low and normal priority events
+
+
+class Shedder:
+  """Read lines ahead in a thread and choose the shedding level
+
+  The level is raised as soon as the lag exceeds `lag` (`DEGRADED`) or
+  twice the `lag` (`CRITICAL`). It is lowered again once the lag is
+  below `lag` (from `CRITICAL`) or half the `lag` (from `DEGRADED`), so
+  the level does not change with every line.
+
+  Args:
+      lines (iterable): the lines of the input
+      lag (float, optional): seconds of lag at which the handler is
+          degraded. Defaults to 5.
+      sample (int, optional): print only every `sample`th debug line
+          if degraded. Defaults to 100.
+      max_lines (int, optional): number of lines that may be read
+          ahead. Defaults to 100000.
+      changed (callable, optional): called with the new level (int),
+          the lag (float) and the number of shed lines (int, see
+          `skipped()`) whenever the level changes. Defaults to None.
+  """
+
+  def __init__(self,
+               lines,
+               lag: float = 5,
+               sample: int = 100,
+               max_lines: int = 100000,
+               changed=None):
+    self.lag = lag
+    self.sample = sample
+    self.max_lines = max_lines
+    self.changed = changed or (lambda *args: None)
+    self.level = NORMAL
+    self.shed = 0  # Lines shed since the level left NORMAL
+    self.count = 0  # Lines read
+    self.closed = False  # The lines are not iterated anymore
+
+    # Once it is full, the pipe of the watcher fills instead of the memory
+    self.queue = queue.Queue(max_lines)
+    threading.Thread(target=self.__read, args=(lines, ), daemon=True).start()
+
+  def __put(self, item: tuple) -> bool:
+    """Put `item` into the queue, wait while it is full
+
+    Returns:
+        bool: False if the lines are not iterated anymore
+    """
+
+    while True:
+      try:
+        self.queue.put(item, timeout=1)
+        return True
+      except queue.Full:
+        if self.closed:
+          return False
+
+  def __read(self, lines):
+    """Put the lines into the queue with the time they have been read
+    """
+
+    try:
+      for line in lines:
+        if not self.__put((time.monotonic(), line)):
+          return
+    except Exception as e:
+      self.__put((None, e))
+    else:
+      self.__put((None, None))
+
+  def __update(self, lag: float):
+    """Change the level depending on the `lag`
+    """
+
+    level = self.level
+    if level < CRITICAL and lag >= 2 * self.lag:
+      level = CRITICAL
+    elif level < DEGRADED and lag >= self.lag:
+      level = DEGRADED
+    elif level == CRITICAL and lag < self.lag:
+      level = DEGRADED
+    elif level == DEGRADED and lag < self.lag / 2:
+      level = NORMAL
+    if level == self.level:
+      return
+
+    if self.level == NORMAL:
+      self.shed = 0
+    self.level = level
+    self.changed(level, lag, self.shed)
+
+  def __iter__(self):
+    try:
+      while True:
+        t, line = self.queue.get()
+        if t is None:
+          if line is not None:
+            raise line
+          return
+        self.__update(time.monotonic() - t)
+        self.count += 1
+        yield line
+    finally:
+      self.closed = True
+
+  def skipped(self):
+    """Count the current line as shed
+
+    Called for lines that have not been checked against all events and
+    did not match any of the checked events.
+    """
+
+    self.shed += 1
+
+  def sampled(self) -> bool:
+    """Check if the debug output of the current line is printed
+
+    Returns:
+        bool: True if the handler is not degraded or the line is sampled
+    """
+
+    return self.level == NORMAL or self.count % self.sample == 0
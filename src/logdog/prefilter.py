@@ -0,0 +1,227 @@
+"""Skip lines that cannot contain events before they are matched
+
+Filename: prefilter.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Most event regexps contain literal text that every matching line has
+to contain (e.g. "Accepted publickey"). If a line contains none of the
+literals of all events of a handler, no event can match it. Such lines
+can be dropped by a `grep -F` process between the watcher and logdog
+or in-process on the raw chunks read from the watcher, before they are
+decoded and checked against the event regexps.
+
+Lines needed as previous or next lines of an event are passed as well
+(`grep -B/-A` or a side buffer of the recent raw lines).
+
+Functions:
+    required_literals(list) -> list: get literals one of which every
+        event line contains
+    grep_command(list, int, int) -> list: get a prefilter command
+    filter_lines(int, list, int, int) -> generator: yield lines that
+        may contain events and their context
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import collections
+import os
+
+try:
+  import re._parser as sre_parse
+  import re._constants as sre_constants
+except ImportError:
+  import sre_parse
+  import sre_constants
+
+import logdog.sources as sources
+
+MIN_LITERAL_LENGTH = 3  # Shorter literals do not filter enough lines
+
+
+def __better(a: set, b: set) -> set:
+  """Choose the more selective of two literal sets
+
+  Args:
+      a (set): a literal set or None
+      b (set): a literal set or None
+
+  Returns:
+      set: the set whose shortest literal is longer
+  """
+
+  if not a:
+    return b
+  if not b:
+    return a
+  return a if min(map(len, a)) >= min(map(len, b)) else b
+
+
+def __literals(parsed) -> set:
+  """Get literals one of which every match of `parsed` contains
+
+  Args:
+      parsed: a parsed regular expression (or a part of it)
+
+  Returns:
+      set: the literals or None if there are no required literals
+  """
+
+  best = None
+  run = ""
+  for op, av in parsed:
+    if op is sre_constants.LITERAL:
+      run += chr(av)
+      continue
+
+    if run:
+      best = __better(best, {run})
+      run = ""
+
+    if op is sre_constants.SUBPATTERN:
+      best = __better(best, __literals(av[-1]))
+    elif op is sre_constants.BRANCH:
+      alternatives = [__literals(b) for b in av[1]]
+      if all(alternatives):
+        best = __better(best, set().union(*alternatives))
+    elif op in (sre_constants.MAX_REPEAT,
+                sre_constants.MIN_REPEAT) and av[0] >= 1:
+      best = __better(best, __literals(av[2]))
+
+  if run:
+    best = __better(best, {run})
+  return best
+
+
+def required_literals(events: list) -> list:
+  """Get literals one of which every line that matches an event contains
+
+  Args:
+      events (list): the events as returned by
+          `matcher.compile_events()`
+
+  Returns:
+      list: the lowercase literals or None if an event has no literals
+          that are long enough
+  """
+
+  literals = set()
+  for e in events:
+    if "literals" in e:
+      # Structured events: every literal is required, use the longest
+      l = {max(e["literals"], key=len)} if e["literals"] else None
+    else:
+      try:
+        l = __literals(sre_parse.parse(e["regexp"].pattern))
+      except Exception:
+        return None
+    if not l or min(map(len, l)) < MIN_LITERAL_LENGTH:
+      return None
+    if not all(s.isascii() for s in l):
+      # Raw chunks are only lowercased for ASCII characters
+      return None
+    literals.update(s.lower() for s in l)
+  return sorted(literals)
+
+
+def grep_command(literals: list, prev_lines: int, next_lines: int) -> list:
+  """Get a `grep` command that passes the lines containing a literal
+
+  Args:
+      literals (list): the literals
+      prev_lines (int): number of lines to pass before a matching line
+      next_lines (int): number of lines to pass after a matching line
+
+  Returns:
+      list: the command
+  """
+
+  command = [
+      "grep",
+      "--fixed-strings",
+      "--ignore-case",
+      "--line-buffered",
+      "--no-group-separator",
+      f"--before-context={prev_lines}",
+      f"--after-context={next_lines}",
+  ]
+  for l in literals:
+    command += ["-e", l]
+  return command
+
+
+def filter_lines(fd: int,
+                 literals: list,
+                 prev_lines: int,
+                 next_lines: int,
+                 chunk_size: int = sources.CHUNK_SIZE,
+                 counts: dict = None):
+  """Yield the lines read from `fd` that contain a literal
+
+  Chunks that contain none of the literals are skipped without
+  decoding them. Up to `prev_lines` skipped lines are kept in a side
+  buffer and yielded before a line that contains a literal. The
+  `next_lines` lines after such a line are yielded as well.
+
+  Args:
+      fd (int): the file descriptor to read from
+      literals (list): the lowercase literals
+      prev_lines (int): number of lines to yield before a line that
+          contains a literal
+      next_lines (int): number of lines to yield after a line that
+          contains a literal
+      chunk_size (int, optional): bytes to read at once.
+          Defaults to sources.CHUNK_SIZE.
+      counts (dict, optional): its key `lines` is increased by the
+          number of lines read, including the skipped lines.
+          Defaults to None.
+
+  Yields:
+      str: the lines without surrounding whitespace
+  """
+
+  literals = [l.encode("UTF-8") for l in literals]
+  side = collections.deque(maxlen=prev_lines)  # Skipped recent lines
+  remaining = 0  # Next lines that still have to be yielded
+  rest = b""
+
+  while True:
+    chunk = os.read(fd, chunk_size)
+    if not chunk:
+      break
+    data = rest + chunk
+    end = data.rfind(b"\n") + 1
+    rest = data[end:]
+    data = data[:end]
+    if not data:
+      continue
+    if counts is not None:
+      counts["lines"] += data.count(b"\n")
+
+    # Fast path: no literal in the whole chunk
+    lower = data.lower()
+    if not remaining and not any(l in lower for l in literals):
+      if prev_lines:
+        side.extend(data.split(b"\n")[-prev_lines - 1:-1])
+      continue
+
+    for l in data.split(b"\n")[:-1]:
+      if any(x in l.lower() for x in literals):
+        while side:
+          yield side.popleft().decode("UTF-8", "replace").strip()
+        remaining = next_lines
+      elif remaining:
+        remaining -= 1
+      else:
+        if prev_lines:
+          side.append(l)
+        continue
+      yield l.decode("UTF-8", "replace").strip()
+
+  if rest:
+    if counts is not None:
+      counts["lines"] += 1
+    yield rest.decode("UTF-8", "replace").strip()
@@ -0,0 +1,113 @@
+"""Preload the state of handler processes
+
+Filename: preload.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Handler processes need the logdog modules, the parsed config file and
+the compiled events of their handler. `load()` prepares all of them
+once, before the handler processes are forked, so they start without
+importing or compiling anything and share the pages of this state
+copy-on-write. `gc.freeze()` moves the preloaded objects out of the
+reach of the garbage collector, so collections in the handler
+processes do not touch (and thereby copy) their pages.
+
+With the start method `forkserver` the server process imports
+`logdog.forkserver` before it forks the first handler, which calls
+`load()` with the config file of the environment variable
+`LOGDOG_PRELOAD`.
+
+Functions:
+    load(str): preload the state of the handler processes
+    events(str) -> list: get the compiled events of a handler
+    memory(int) -> dict: get the memory usage of a process
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import gc
+
+import logdog.actions_ as actions
+import logdog.config as config
+import logdog.matcher as matcher
+import logdog.strings as strings
+
+CONFIG_VARIABLE = "LOGDOG_PRELOAD"  # Config file of the server process
+
+__events = {}  # Compiled events per handler
+__loaded = False  # The state has been preloaded
+
+
+def load(config_file: str = ""):
+  """Preload the state of the handler processes
+
+  Args:
+      config_file (str, optional): the config file to parse. Defaults
+          to "" (the config file has already been parsed).
+  """
+
+  global __loaded
+
+  if __loaded:
+    return
+  if config_file:
+    config.parse_config(config_file)
+    actions.discover_actions()
+
+  for handler_name in config.get_handler_names():
+    try:
+      __events[handler_name] = matcher.compile_events(
+          config.get_handler_data(handler_name))
+    except Exception:
+      # Reported by the handler process
+      pass
+
+  # Compile the keyword patterns of the templates
+  strings.parse_string("")
+
+  gc.collect()
+  gc.freeze()
+  __loaded = True
+
+
+def events(handler_name: str) -> list:
+  """Get the compiled events of a handler
+
+  Args:
+      handler_name (str): the handler
+
+  Returns:
+      list: the events as returned by `matcher.compile_events()`
+  """
+
+  if handler_name in __events:
+    return __events[handler_name]
+  return matcher.compile_events(config.get_handler_data(handler_name))
+
+
+def memory(pid: int) -> dict:
+  """Get the memory usage of a process
+
+  Args:
+      pid (int): the process
+
+  Returns:
+      dict: `rss` and `pss` (proportional set size: shared pages are
+          divided by the number of processes sharing them) in KiB or
+          an empty dict if unknown
+  """
+
+  usage = {}
+  try:
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+      for line in f:
+        key, _, value = line.partition(":")
+        if key in ("Rss", "Pss"):
+          usage[key.lower()] = int(value.split()[0])
+  except (OSError, ValueError):
+    pass
+  return usage
+
@@ -0,0 +1,161 @@
+"""Profile handler processes and the action dispatcher
+
+Filename: profiling.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Profiling is configured by the `profile` object of the `logdog` object
+of the config file or enabled by `logdog --profile`. Each process
+(the main process, which also dispatches internal events, and every
+handler process, which dispatches the actions of its events) profiles
+itself with `cProfile` and optionally takes `tracemalloc` snapshots.
+
+Signals:
+    SIGUSR1: toggle profiling of the process at runtime (e.g. to
+        profile only one handler)
+    SIGUSR2: write the profile (and snapshot) of the process
+
+The profiles are also written when a process exits. They are stored
+as `logdog-<name>-<pid>.prof` (readable with `pstats`) and
+`logdog-<name>-<pid>.tracemalloc` in the profile directory (default:
+`profiles` in the state directory). The profile directory must be
+private (see `state.private_directory()`), because the file names are
+predictable.
+
+No profiler is installed if profiling is disabled, so there is no
+overhead besides the signal handlers.
+
+Functions:
+    setup(str): set up profiling for the current process
+    enable(): start profiling
+    disable(): stop profiling
+    dump(): write the profile of the current process
+    finish(): write the profile and stop profiling
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import cProfile
+import os
+import signal
+import sys
+import tracemalloc
+
+import logdog.config as config
+import logdog.state as state
+
+__name = "main"  # Name of the profiled process
+__profile = None  # Running profiler (None: disabled)
+__tracemalloc = False  # Take tracemalloc snapshots
+__directory = None  # Configured directory of the profile files
+
+
+def setup(name: str):
+  """Set up profiling for the current process
+
+  Installs the signal handlers and starts profiling if it is enabled
+  for `name` in the config file.
+
+  Args:
+      name (str): the handler name or "main"
+  """
+
+  global __name
+  global __profile
+  global __tracemalloc
+  global __directory
+
+  __name = name
+  if __profile:
+    # Profiler inherited from the parent process
+    __profile.disable()
+    __profile = None
+  try:
+    profile_data = config.get_profile_data()
+  except KeyError:
+    profile_data = {}
+  __tracemalloc = profile_data.get("tracemalloc", False)
+  __directory = profile_data.get("dir")
+
+  signal.signal(signal.SIGUSR1, lambda *args: disable()
+                if __profile else enable())
+  signal.signal(signal.SIGUSR2, lambda *args: dump())
+
+  names = profile_data.get("handlers")
+  if profile_data.get("enabled", False) and (names is None or name in names):
+    enable()
+
+
+def enable():
+  """Start profiling the current process
+  """
+
+  global __profile
+
+  if __profile:
+    return
+  print(f"logdog: profiling {__name} (pid {os.getpid()})")
+  if __tracemalloc and not tracemalloc.is_tracing():
+    tracemalloc.start(config.get_profile_data().get("frames", 10))
+  __profile = cProfile.Profile()
+  __profile.enable()
+
+
+def disable():
+  """Stop profiling the current process and write the profile
+  """
+
+  global __profile
+
+  if not __profile:
+    return
+  dump()
+  # dump() enables the profiler again
+  __profile.disable()
+  __profile = None
+  if tracemalloc.is_tracing():
+    tracemalloc.stop()
+  print(f"logdog: stopped profiling {__name} (pid {os.getpid()})")
+
+
+def dump():
+  """Write the profile of the current process
+
+  The `tracemalloc` snapshot is written as well if it is enabled. The
+  biggest allocations are printed.
+  """
+
+  if not __profile:
+    return
+  try:
+    if __directory:
+      directory = state.private_directory(__directory)
+    else:
+      directory = state.state_directory("profiles")
+  except OSError as e:
+    sys.stderr.write(f"logdog: cannot write profile of {__name}: {e}\n")
+    return
+  path = os.path.join(directory, f"logdog-{__name}-{os.getpid()}")
+
+  # dump_stats() disables the profiler
+  __profile.dump_stats(f"{path}.prof")
+  __profile.enable()
+  print(f"logdog: profile of {__name} written to {path}.prof")
+
+  if tracemalloc.is_tracing():
+    snapshot = tracemalloc.take_snapshot()
+    snapshot.dump(f"{path}.tracemalloc")
+    print(f"logdog: tracemalloc snapshot of {__name} written to "
+          f"{path}.tracemalloc")
+    for s in snapshot.statistics("lineno")[:10]:
+      sys.stderr.write(f"{__name}: {s}\n")
+
+
+def finish():
+  """Write the profile and stop profiling (e.g. at exit)
+  """
+
+  disable()
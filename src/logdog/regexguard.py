@@ -0,0 +1,273 @@
+"""Guard against event regexps that backtrack catastrophically
+
+Filename: regexguard.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+A regexp like `(\\w+\\s?)+$` can take seconds on a single line and stall
+the whole handler. Such constructs (nested unbounded quantifiers and
+quantified alternatives that can match the same text) are found by
+`analyze()` when logdog starts.
+
+At runtime a `Guard` enforces a time budget per search. If the
+`regex` module is installed, its `timeout` is used. Otherwise a
+`SIGALRM` watchdog interrupts searches of the main thread that run
+longer than the budget (the `re` module checks for signals while it
+backtracks). The watchdog timer is one-shot: it is armed by a search
+and only armed again while searches are running, so an idle handler
+gets no signals. In other threads the time of a search is only
+measured.
+
+Classes:
+    Timeout: a search exceeded its budget
+    Guard: enforce a time budget per search
+
+Functions:
+    analyze(str) -> list: find constructs that can backtrack
+        catastrophically
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import signal
+import threading
+import time
+
+try:
+  import re._parser as sre_parse
+  import re._constants as sre_constants
+except ImportError:
+  import sre_parse
+  import sre_constants
+
+try:
+  import regex
+except ImportError:
+  regex = None
+
+__repeats = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+
+def __first(parsed) -> set:
+  """Get the (lowercase) characters a match of `parsed` can start with
+
+  Args:
+      parsed: a parsed regular expression (or a part of it)
+
+  Returns:
+      set: the characters or None if they are unknown
+  """
+
+  for op, av in parsed:
+    if op is sre_constants.AT:
+      # Anchors do not consume characters
+      continue
+    if op is sre_constants.LITERAL:
+      return {chr(av).lower()}
+    if op is sre_constants.IN:
+      chars = set()
+      for o, a in av:
+        if o is sre_constants.LITERAL:
+          chars.add(chr(a).lower())
+        elif o is sre_constants.RANGE and a[1] - a[0] < 256:
+          chars.update(chr(c).lower() for c in range(a[0], a[1] + 1))
+        else:
+          return None
+      return chars
+    if op is sre_constants.SUBPATTERN:
+      return __first(av[-1])
+    if op in __repeats and av[0] >= 1:
+      return __first(av[2])
+    return None
+  return None
+
+
+def __overlapping(alternatives: list) -> bool:
+  """Check if two alternatives can start with the same character
+
+  Args:
+      alternatives (list): the parsed alternatives of a branch
+
+  Returns:
+      bool: True if they can (or if it is unknown)
+  """
+
+  seen = set()
+  for a in alternatives:
+    chars = __first(a)
+    if chars is None or chars & seen:
+      return True
+    seen |= chars
+  return False
+
+
+def __branches(parsed) -> list:
+  """Get the alternations of `parsed` that are not inside a quantifier
+
+  Args:
+      parsed: a parsed regular expression (or a part of it)
+
+  Returns:
+      list: the arguments of the alternations
+  """
+
+  branches = []
+  for op, av in parsed:
+    if op is sre_constants.BRANCH:
+      branches.append(av)
+    elif op is sre_constants.SUBPATTERN:
+      branches.extend(__branches(av[-1]))
+  return branches
+
+
+def __walk(parsed, repeated: bool, warnings: list):
+  """Collect the risky constructs of `parsed`
+
+  Args:
+      parsed: a parsed regular expression (or a part of it)
+      repeated (bool): `parsed` is inside an unbounded quantifier
+      warnings (list): the found constructs
+  """
+
+  for op, av in parsed:
+    if op in __repeats:
+      unbounded = av[1] == sre_constants.MAXREPEAT
+      if unbounded and repeated:
+        warnings.append("nested unbounded quantifiers (e.g. `(a+)+`)")
+      if unbounded and any(
+          __overlapping(a[1]) for a in __branches(av[2])):
+        warnings.append("quantified alternatives that can match the "
+                        "same text (e.g. `(a|ab)*`)")
+      __walk(av[2], repeated or unbounded, warnings)
+    elif op is sre_constants.SUBPATTERN:
+      __walk(av[-1], repeated, warnings)
+    elif op is sre_constants.BRANCH:
+      for b in av[1]:
+        __walk(b, repeated, warnings)
+    elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+      __walk(av[1], repeated, warnings)
+    elif op is sre_constants.GROUPREF_EXISTS:
+      __walk(av[1], repeated, warnings)
+      if av[2]:
+        __walk(av[2], repeated, warnings)
+    # Possessive quantifiers and atomic groups do not backtrack
+
+
+def analyze(pattern: str) -> list:
+  """Find constructs of `pattern` that can backtrack catastrophically
+
+  Args:
+      pattern (str): the regexp
+
+  Returns:
+      list: a description per found construct (empty if none)
+  """
+
+  warnings = []
+  try:
+    __walk(sre_parse.parse(pattern), False, warnings)
+  except Exception:
+    return []
+  return list(dict.fromkeys(warnings))
+
+
+class Timeout(Exception):
+  """A search exceeded its time budget
+  """
+
+
+class Guard:
+  """Enforce a time budget per search
+
+  Args:
+      budget (float): seconds a search may take
+      disable (bool, optional): disable events whose search exceeded
+          the budget. Defaults to False.
+      exceeded (callable, optional): called with the event name (str),
+          the seconds the search took (float) and the line (str)
+          whenever a search exceeded the budget. Defaults to None.
+  """
+
+  def __init__(self, budget: float, disable: bool = False, exceeded=None):
+    self.budget = budget
+    self.disable = disable
+    self.exceeded = exceeded or (lambda *args: None)
+    self.searching = False
+    self.serial = 0  # Number of the current search
+    self.seen = -1  # Search that was running at the last watchdog tick
+    self.watchdog = False
+    self.armed = False  # The watchdog timer is running
+
+  def install(self, events: list):
+    """Prepare the compiled events of a handler for guarded searches
+
+    The regexps are compiled with `regex` if it is installed. Otherwise
+    the watchdog is started if this is the main thread.
+
+    Args:
+        events (list): the events as returned by
+            `matcher.compile_events()`
+    """
+
+    if regex is not None:
+      for e in events:
+        if "regexp" in e:
+          e["regexp"] = regex.compile(e["regexp"].pattern, regex.IGNORECASE)
+      return
+
+    if threading.current_thread() is threading.main_thread():
+      signal.signal(signal.SIGALRM, self.__tick)
+      self.watchdog = True
+
+  def __arm(self):
+    """Start the one-shot watchdog timer
+    """
+
+    self.armed = True
+    signal.setitimer(signal.ITIMER_REAL, self.budget)
+
+  def __tick(self, *args):
+    """Interrupt a search that was already running at the last tick
+
+    The timer is only armed again while a search is running.
+    """
+
+    self.armed = False
+    if not self.searching:
+      return
+    if self.seen == self.serial:
+      raise Timeout()
+    self.seen = self.serial
+    self.__arm()
+
+  def search(self, pattern, line: str) -> tuple:
+    """Search `line` within the budget
+
+    A search that is interrupted does not match.
+
+    Args:
+        pattern: the compiled regexp
+        line (str): the line
+
+    Returns:
+        tuple: (the match or None, the seconds the search took)
+    """
+
+    start = time.perf_counter()
+    self.serial += 1
+    if self.watchdog and not self.armed:
+      self.__arm()
+    try:
+      self.searching = True
+      if regex is not None and isinstance(pattern, regex.Pattern):
+        match = pattern.search(line, timeout=self.budget)
+      else:
+        match = pattern.search(line)
+    except (Timeout, TimeoutError):
+      match = None
+    finally:
+      self.searching = False
+    return (match, time.perf_counter() - start)
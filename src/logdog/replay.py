@@ -0,0 +1,262 @@
+"""Replay log files through the events of a handler
+
+Filename: replay.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Replaying feeds files through the same matching and context logic as
+a running handler, including its lookups, dedup windows and
+correlations (see `handlers.emitter()`). It prints the events that
+would fire with their context and a report of the throughput, the
+matches per event and the CPU time spent per event, so slow regexps
+can be found before deploying a config file. Actions are only run if
+requested.
+
+Functions:
+    replay(str, str, list, bool) -> dict: replay files
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import os
+import time
+
+import logdog.actions_ as actions
+import logdog.config as config
+import logdog.correlation as correlation
+import logdog.handlers as handlers
+import logdog.lookup as lookup
+import logdog.matcher as matcher
+import logdog.multiline as multiline
+import logdog.prefilter as prefilter
+import logdog.regexguard as regexguard
+import logdog.scheduler as scheduler
+import logdog.sources as sources
+import logdog.strings as strings
+import logdog.timestamps as timestamps
+
+
+class TimedPattern:
+  """A compiled regexp that measures the CPU time of its searches
+
+  Args:
+      pattern (re.Pattern): the compiled regexp
+  """
+
+  def __init__(self, pattern):
+    self.pattern = pattern
+    self.cpu_time = 0.0
+    self.calls = 0
+
+  def search(self, line: str):
+    """Search `line` and add the CPU time to `cpu_time`
+
+    Args:
+        line (str): the line
+
+    Returns:
+        re.Match: the match or None
+    """
+
+    t = time.process_time()
+    m = self.pattern.search(line)
+    self.cpu_time += time.process_time() - t
+    self.calls += 1
+    return m
+
+
+class TimedPredicate(TimedPattern):
+  """A predicate of a `json` event that measures its CPU time
+
+  Args:
+      predicate (callable): the predicate
+  """
+
+  def __call__(self, o: dict) -> bool:
+    t = time.process_time()
+    r = self.pattern(o)
+    self.cpu_time += time.process_time() - t
+    self.calls += 1
+    return r
+
+
+def replay(config_file: str,
+           handler_name: str,
+           files: list,
+           run_actions: bool = False) -> dict:
+  """Replay `files` through the events of `handler_name`
+
+  Args:
+      config_file (str): the config file
+      handler_name (str): the handler whose events are used
+      files (list): the files to replay ("-" for stdin)
+      run_actions (bool, optional): run the actions of matched events.
+          Defaults to False.
+
+  Returns:
+      dict: the report with the keys `lines` (lines read), `checked`
+          (lines or multi-line records checked for events after the
+          prefilter), `seconds`, `events` (matches and CPU time per
+          event) and `correlations` (number of times each correlation
+          fired)
+
+  Raises:
+      FileNotFoundError: if `config_file` or a file does not exist
+      JSONDecodeError: if content of `config_file` has wrong format
+      KeyError: if the handler does not exist
+  """
+
+  config.parse_config(config_file)
+  actions.discover_actions()
+  lookup.build_tables()
+  handler_data = config.get_handler_data(handler_name)
+
+  # Measure the CPU time of every event
+  events = matcher.compile_events(handler_data)
+  for e in events:
+    if "regexp" in e:
+      for w in regexguard.analyze(e["regexp"].pattern):
+        print(f"Warning: regexp of event {e['name']} contains {w}")
+  timers = {}
+  for e in events:
+    if "predicate" in e:
+      e["predicate"] = TimedPredicate(e["predicate"])
+      timers[e["name"]] = e["predicate"]
+    else:
+      e["regexp"] = TimedPattern(e["regexp"])
+      timers[e["name"]] = e["regexp"]
+  matches = {e["name"]: 0 for e in events}
+  correlations = {}
+  parser = None
+  if "timestamp" in handler_data:
+    parser = timestamps.Parser(**handler_data["timestamp"])
+
+  def handle(event: dict, lines: list, fields: dict, event_time: float):
+    matches[event["name"]] += 1
+    print(f"--- {handler_name}[{event['name']}]")
+    for l in lines:
+      print(f"    {l}")
+    if fields:
+      print(f"    fields: {dict(fields)}")
+
+    if run_actions:
+      event_data = config.get_event_data(handler_name, event["name"])
+      handlers.handle_event(
+          handler_name,
+          event["name"],
+          brief_information=event_data["brief_information"],
+          detailed_information=event_data["detailed_information"],
+          stdout=strings.list_to_string(lines, "\n\n"),
+          timestamp=time.localtime(event_time),
+          fields=fields,
+      )
+
+  def fire(name: str, correlation_data: dict, key: str, count: int):
+    correlations[name] = correlations.get(name, 0) + 1
+    if run_actions:
+      handlers.fire_correlation(name, correlation_data, key, count)
+    else:
+      print(f"=== correlations[{name}]: {key} ({count} events)")
+
+  # Correlations of the events of this handler (their expiry timers run
+  # after every recorded event)
+  expiries = scheduler.Scheduler()
+  try:
+    correlator = correlation.Correlator(fire, expiries)
+  except KeyError:
+    # No correlations: no event is correlated
+    correlator = None
+
+  def correlate(*record):
+    correlator.record(*record)
+    expiries.run()
+
+  emit = handlers.emitter(handler_name, handle, correlate)
+
+  literals = None
+  if handler_data.get("prefilter") and "multiline" not in handler_data:
+    literals = prefilter.required_literals(
+        matcher.compile_events(handler_data))
+  prev_lines = max([e["prev_lines"] for e in events], default=0)
+  next_lines = max([e["next_lines"] for e in events], default=0)
+
+  counts = {"lines": 0}  # Lines read
+
+  def counted(source):
+    for line in source:
+      counts["lines"] += 1
+      yield line
+
+  checked = 0
+  start = time.perf_counter()
+  for path in files:
+    fd = 0 if path == "-" else os.open(path, os.O_RDONLY)
+    try:
+      if literals:
+        source = prefilter.filter_lines(fd,
+                                        literals,
+                                        prev_lines,
+                                        next_lines,
+                                        counts=counts)
+      elif "multiline" in handler_data:
+        # Records are assembled like in the handler
+        source = multiline.assemble(
+            counted(sources.read_lines(fd, keep_indent=True)),
+            handler_data["multiline"])
+      else:
+        source = counted(sources.read_lines(fd))
+
+      # Each file has its own history
+      m = matcher.Matcher(handler_name, events, emit, timestamps=parser)
+      for line in source:
+        checked += 1
+        m.feed(line)
+      m.flush()
+    finally:
+      if fd:
+        os.close(fd)
+  seconds = time.perf_counter() - start
+
+  report = {
+      "lines": counts["lines"],
+      "checked": checked,
+      "seconds": seconds,
+      "events": {
+          name: {
+              "matches": matches[name],
+              "cpu_time": timers[name].cpu_time,
+              "calls": timers[name].calls,
+          } for name in matches
+      },
+      "correlations": correlations,
+  }
+  __print_report(report)
+  return report
+
+
+def __print_report(report: dict):
+  """Print a replay report
+
+  Args:
+      report (dict): the report returned by `replay()`
+  """
+
+  seconds = max(report["seconds"], 1e-9)
+  print()
+  print(f"{report['lines']} lines in {report['seconds']:.3f} s "
+        f"({report['lines'] / seconds:.0f} lines/s)")
+  if report["checked"] != report["lines"]:
+    print(f"{report['checked']} lines or records checked after prefilter "
+          "and multi-line assembly")
+  print(f"{'event':<24} {'matches':>9} {'cpu [s]':>10} {'cpu/line [us]':>14}")
+  for name, e in sorted(report["events"].items(),
+                        key=lambda i: i[1]["cpu_time"],
+                        reverse=True):
+    per_line = e["cpu_time"] / e["calls"] * 1e6 if e["calls"] else 0
+    print(f"{name:<24} {e['matches']:>9} {e['cpu_time']:>10.3f} "
+          f"{per_line:>14.2f}")
+  for name, count in sorted(report["correlations"].items()):
+    print(f"correlation {name} fired {count} times")
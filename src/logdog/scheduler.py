@@ -0,0 +1,200 @@
+"""Run calls at deadlines on a monotonic clock
+
+Filename: scheduler.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Time-driven work (expiring dedup keys and correlations, completing
+events that wait for next lines and multi-line records, flushing
+batches, sending canaries, reporting statistics, checking lookup tables
+for changes) registers a deadline with a `Scheduler` instead of
+polling. The timers are kept in a timer wheel (see
+`logdog.timerwheel`), so scheduling and cancelling a timer is O(1),
+even for the many short-lived timers of dedup windows, and finding the
+next deadline is O(log n) for n occupied slots. Timers run at most
+`resolution` seconds late.
+
+A scheduler is either run by the loop of its owner, which waits at most
+`timeout()` seconds for its own input and calls `run()` afterwards (e.g.
+the main process while it waits for records of the handlers), or by a
+thread (`start()`). `get()` returns the scheduler thread of the current
+process, so each handler process gets its own.
+
+Classes:
+    Timer: a scheduled call
+    Scheduler: run calls at their deadlines
+
+Functions:
+    get() -> Scheduler: get the scheduler thread of the current process
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import os
+import sys
+import threading
+import time
+
+import logdog.timerwheel as timerwheel
+
+__scheduler = None  # Scheduler thread of the current process
+__pid = None  # Process the scheduler thread belongs to
+__lock = threading.Lock()  # Lock for starting the scheduler thread
+
+
+class Timer:
+  """A scheduled call (see `Scheduler.call_at()`)
+
+  Args:
+      deadline (float): the monotonic time the call is due
+      callback (callable): the function to call
+      args (tuple): the arguments of the call
+  """
+
+  __slots__ = ("deadline", "callback", "args", "slot")
+
+  def __init__(self, deadline: float, callback, args: tuple):
+    self.deadline = deadline
+    self.callback = callback
+    self.args = args
+    self.slot = None  # Slot of the timer wheel
+
+
+class Scheduler:
+  """Run calls at their deadlines
+
+  Deadlines further away than `horizon` seconds are checked again
+  after `horizon` seconds (see `timerwheel.TimerWheel`).
+
+  Args:
+      resolution (float, optional): width of a slot of the timer wheel
+          in seconds. Defaults to 0.05.
+      horizon (float, optional): time span covered by the timer wheel
+          in seconds. Defaults to 60.
+  """
+
+  def __init__(self, resolution: float = 0.05, horizon: float = 60):
+    self.wheel = timerwheel.TimerWheel(resolution, horizon, time.monotonic())
+    self.condition = threading.Condition()
+    self.wake = float("inf")  # Time the scheduler thread wakes up
+
+  def call_at(self, deadline: float, callback, *args) -> Timer:
+    """Call `callback(*args)` at a monotonic time
+
+    Args:
+        deadline (float): the time (see `time.monotonic()`)
+        callback (callable): the function to call
+
+    Returns:
+        Timer: the timer (needed to cancel it)
+    """
+
+    timer = Timer(deadline, callback, args)
+    with self.condition:
+      timer.slot = self.wheel.add(timer, deadline)
+      if deadline < self.wake:
+        self.condition.notify()
+    return timer
+
+  def call_later(self, delay: float, callback, *args) -> Timer:
+    """Call `callback(*args)` in `delay` seconds
+
+    Args:
+        delay (float): the delay in seconds
+        callback (callable): the function to call
+
+    Returns:
+        Timer: the timer (needed to cancel it)
+    """
+
+    return self.call_at(time.monotonic() + delay, callback, *args)
+
+  def cancel(self, timer: Timer):
+    """Cancel a timer that has not run yet
+
+    Args:
+        timer (Timer): the timer
+    """
+
+    with self.condition:
+      self.wheel.cancel(timer, timer.slot)
+
+  def timeout(self) -> float:
+    """Get the seconds until the next timer is due
+
+    Returns:
+        float: the seconds or None if no timer is scheduled
+    """
+
+    with self.condition:
+      due = self.wheel.next_due()
+    return None if due is None else max(0, due - time.monotonic())
+
+  def run(self) -> int:
+    """Run the calls that are due
+
+    Returns:
+        int: the number of calls
+    """
+
+    now = time.monotonic()
+    due = []
+    with self.condition:
+      for timer in self.wheel.advance(now):
+        if timer.deadline > now:
+          timer.slot = self.wheel.add(timer, timer.deadline)
+        else:
+          due.append(timer)
+
+    due.sort(key=lambda t: t.deadline)
+    for timer in due:
+      try:
+        timer.callback(*timer.args)
+      except Exception as e:
+        sys.stderr.write(f"Timer {timer.callback} failed: {e}\n")
+    return len(due)
+
+  def __loop(self):
+    """Run the calls until the process exits
+    """
+
+    while True:
+      with self.condition:
+        due = self.wheel.next_due()
+        self.wake = float("inf") if due is None else due
+        if due is None or due > time.monotonic():
+          self.condition.wait(None if due is None else due -
+                              time.monotonic())
+        self.wake = 0  # Awake: no need to notify
+      self.run()
+
+  def start(self):
+    """Run the calls in a thread
+    """
+
+    threading.Thread(target=self.__loop, daemon=True,
+                     name="Scheduler").start()
+
+
+def get() -> Scheduler:
+  """Get the scheduler thread of the current process
+
+  The scheduler is started on first use in each process.
+
+  Returns:
+      Scheduler: the scheduler
+  """
+
+  global __scheduler
+  global __pid
+
+  with __lock:
+    # Threads are not inherited by forked processes
+    if __pid != os.getpid():
+      __scheduler = Scheduler()
+      __scheduler.start()
+      __pid = os.getpid()
+  return __scheduler
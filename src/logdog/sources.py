@@ -0,0 +1,337 @@
+"""Read lines from the inputs of handlers
+
+Filename: sources.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+A source is a generator that yields the lines of an input. Besides the
+`stdout` of a watcher, handlers can receive syslog messages directly
+via UDP, TCP (octet-counting or newline framing, see RFC 6587) or a
+Unix datagram socket.
+
+Functions:
+    read_lines(int) -> generator: yield lines from a file descriptor
+    parse_syslog(str) -> tuple: get facility, program and message text
+    syslog_filter(generator, list, list) -> generator: yield syslog
+        messages of the given programs and facilities
+    open_input(dict) -> generator: open a socket input
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import os
+import selectors
+import socket
+
+# Syslog facilities (RFC 5424)
+FACILITIES = {
+    "kern": 0,
+    "user": 1,
+    "mail": 2,
+    "daemon": 3,
+    "auth": 4,
+    "syslog": 5,
+    "lpr": 6,
+    "news": 7,
+    "uucp": 8,
+    "cron": 9,
+    "authpriv": 10,
+    "ftp": 11,
+    "ntp": 12,
+    "security": 13,
+    "console": 14,
+    "solaris-cron": 15,
+    "local0": 16,
+    "local1": 17,
+    "local2": 18,
+    "local3": 19,
+    "local4": 20,
+    "local5": 21,
+    "local6": 22,
+    "local7": 23,
+}
+
+CHUNK_SIZE = 65536  # Bytes to read at once
+
+
+def read_lines(fd: int,
+               chunk_size: int = CHUNK_SIZE,
+               keep_indent: bool = False):
+  """Yield the lines that are read from `fd` until EOF
+
+  Data is read in chunks instead of line by line to save system calls
+  if many lines are available at once.
+
+  Args:
+      fd (int): the file descriptor to read from
+      chunk_size (int, optional): bytes to read at once.
+          Defaults to CHUNK_SIZE.
+      keep_indent (bool, optional): keep leading whitespace (e.g. for
+          `multiline.Assembler`). Defaults to False.
+
+  Yields:
+      str: the lines without surrounding whitespace
+  """
+
+  strip = str.rstrip if keep_indent else str.strip
+  rest = b""
+  while True:
+    chunk = os.read(fd, chunk_size)
+    if not chunk:
+      break
+    lines = (rest + chunk).split(b"\n")
+    rest = lines.pop()
+    for l in lines:
+      yield strip(l.decode("UTF-8", "replace"))
+  if rest:
+    yield strip(rest.decode("UTF-8", "replace"))
+
+
+def parse_syslog(message: str) -> tuple:
+  """Get facility, program and text of a syslog message
+
+  Supports RFC 3164 (BSD) and RFC 5424 messages. Only string
+  operations are used to keep this cheap.
+
+  Args:
+      message (str): the raw syslog message
+
+  Returns:
+      tuple: (facility (int), program (str), message without priority
+          (str)). Facility is -1 and program is "" if unknown.
+  """
+
+  facility = -1
+  if message.startswith("<"):
+    end = message.find(">", 1, 5)
+    if end > 0 and message[1:end].isdigit():
+      facility = int(message[1:end]) >> 3
+      message = message[end + 1:]
+
+  if message.startswith("1 "):
+    # RFC 5424: VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID ...
+    fields = message.split(" ", 4)
+    program = fields[3] if len(fields) > 3 and fields[3] != "-" else ""
+    return (facility, program, message)
+
+  # RFC 3164: "Mmm dd hh:mm:ss HOSTNAME TAG[PID]: MSG"
+  fields = message[16:].split(" ", 2) if len(message) > 16 else []
+  program = ""
+  if len(fields) > 1:
+    tag = fields[1]
+    for i, c in enumerate(tag):
+      if c == "[" or c == ":":
+        tag = tag[:i]
+        break
+    program = tag
+  return (facility, program, message)
+
+
+def syslog_filter(messages, programs: list = None, facilities: list = None):
+  """Yield syslog messages of the given programs and facilities
+
+  The priority is removed from the messages, so that they look like
+  lines of a log file written by a syslog daemon.
+
+  Args:
+      messages (generator): the raw syslog messages
+      programs (list, optional): the programs to pass. Defaults to None
+          (all programs).
+      facilities (list, optional): the facility names to pass.
+          Defaults to None (all facilities).
+
+  Yields:
+      str: the messages without priority
+  """
+
+  programs = set(programs) if programs else None
+  facilities = set(FACILITIES[f] for f in facilities) if facilities else None
+
+  for m in messages:
+    facility, program, m = parse_syslog(m)
+    if programs is not None and program not in programs:
+      continue
+    if facilities is not None and facility not in facilities:
+      continue
+    yield m.strip()
+
+
+def __datagrams(sock: socket.socket, batch: int):
+  """Yield the datagrams received on `sock`
+
+  After waiting for the first datagram, up to `batch` datagrams that
+  are already queued are received without waiting again.
+
+  Args:
+      sock (socket.socket): a bound datagram socket
+      batch (int): maximum number of datagrams to receive at once
+
+  Yields:
+      str: the received datagrams
+  """
+
+  while True:
+    sock.setblocking(True)
+    received = [sock.recv(65535)]
+    sock.setblocking(False)
+    try:
+      while len(received) < batch:
+        received.append(sock.recv(65535))
+    except BlockingIOError:
+      pass
+    for d in received:
+      yield d.decode("UTF-8", "replace")
+
+
+def __frames(buffer: bytearray, max_buffer: int) -> list:
+  """Take the complete frames of a TCP stream from `buffer`
+
+  Octet-counting ("LEN MSG") is used if a frame starts with a digit,
+  newline framing ("MSG\\n") otherwise. If a frame does not complete
+  within `max_buffer` bytes, the buffered data is returned as a
+  truncated frame to keep the buffer bounded.
+
+  Args:
+      buffer (bytearray): received data (complete frames are removed)
+      max_buffer (int): maximum size of the buffer in bytes
+
+  Returns:
+      list: the complete frames
+  """
+
+  frames = []
+  while buffer:
+    if buffer[:1].isdigit():
+      space = buffer.find(b" ", 0, 10)
+      if space > 0 and buffer[:space].isdigit():
+        length = int(buffer[:space])
+        if len(buffer) - space - 1 >= length:
+          frames.append(bytes(buffer[space + 1:space + 1 + length]))
+          del buffer[:space + 1 + length]
+          continue
+        if length <= max_buffer:
+          break
+
+    end = buffer.find(b"\n")
+    if end < 0:
+      if len(buffer) > max_buffer:
+        frames.append(bytes(buffer[:max_buffer]))
+        del buffer[:max_buffer]
+      break
+    frames.append(bytes(buffer[:end]))
+    del buffer[:end + 1]
+  return frames
+
+
+def __stream(server: socket.socket, batch: int, max_buffer: int):
+  """Yield the syslog messages of all connections to `server`
+
+  Args:
+      server (socket.socket): a listening stream socket
+      batch (int): maximum number of receives per connection and wakeup
+      max_buffer (int): maximum buffer size per connection in bytes
+
+  Yields:
+      str: the received messages
+  """
+
+  selector = selectors.DefaultSelector()
+  server.setblocking(False)
+  selector.register(server, selectors.EVENT_READ)
+  buffers = {}  # Receive buffer per connection
+
+  while True:
+    for key, _ in selector.select():
+      if key.fileobj is server:
+        try:
+          connection, _ = server.accept()
+        except BlockingIOError:
+          continue
+        connection.setblocking(False)
+        selector.register(connection, selectors.EVENT_READ)
+        buffers[connection] = bytearray()
+        continue
+
+      connection = key.fileobj
+      buffer = buffers[connection]
+      closed = False
+      for _ in range(batch):
+        try:
+          data = connection.recv(CHUNK_SIZE)
+        except BlockingIOError:
+          break
+        except OSError:
+          data = b""
+        if not data:
+          closed = True
+          break
+        buffer += data
+        if len(buffer) > max_buffer:
+          break
+
+      for f in __frames(buffer, max_buffer):
+        yield f.decode("UTF-8", "replace")
+
+      if closed:
+        if buffer:
+          yield bytes(buffer).decode("UTF-8", "replace")
+        selector.unregister(connection)
+        connection.close()
+        del buffers[connection]
+
+
+def open_input(input_data: dict):
+  """Open a socket input and yield the received syslog messages
+
+  The input is configured by the `input` object of a handler:
+      type (str): `udp`, `tcp` or `unix`
+      address (str, optional): address to bind to. Defaults to
+          "0.0.0.0".
+      port (int, optional): port to bind to. Defaults to 514.
+      path (str): path of the Unix datagram socket (type `unix` only)
+      batch (int, optional): maximum number of receives per wakeup.
+          Defaults to 64.
+      max_buffer (int, optional): maximum buffer size per TCP
+          connection in bytes. Defaults to 65536.
+
+  Args:
+      input_data (dict): the `input` object of the handler
+
+  Returns:
+      generator: the received messages
+
+  Raises:
+      ValueError: if the input type is unknown
+  """
+
+  input_type = input_data["type"]
+  address = input_data.get("address", "0.0.0.0")
+  port = input_data.get("port", 514)
+  batch = input_data.get("batch", 64)
+  max_buffer = input_data.get("max_buffer", 65536)
+
+  if input_type == "udp":
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((address, port))
+    return __datagrams(sock, batch)
+  if input_type == "unix":
+    try:
+      os.unlink(input_data["path"])
+    except FileNotFoundError:
+      pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(input_data["path"])
+    return __datagrams(sock, batch)
+  if input_type == "tcp":
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((address, port))
+    sock.listen()
+    return __stream(sock, batch, max_buffer)
+  raise ValueError(f"Unknown input type {input_type}")
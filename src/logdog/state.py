@@ -0,0 +1,83 @@
+"""Private directories for the files of logdog
+
+Filename: state.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Logdog trusts the files it keeps between runs (e.g. the index files of
+lookup tables). Another user who can write such a file could bypass a
+blocklist or inject events, so these files are kept in directories that
+only the user running logdog can write. A predictable path in a
+world-writable directory (e.g. `/tmp`) is never used.
+
+The state directory is `state_dir` of the `logdog` object of the config
+file (default: `/var/lib/logdog` for root and `~/.local/state/logdog`
+for other users).
+
+Functions:
+    private_directory(str) -> str: create or check a private directory
+    state_directory(str) -> str: get a directory in the state directory
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import os
+
+import logdog.config as config
+
+DEFAULT = "/var/lib/logdog"  # State directory of root
+
+
+def private_directory(path: str) -> str:
+  """Create a directory with mode 0700 or check an existing one
+
+  Args:
+      path (str): the directory
+
+  Returns:
+      str: the directory
+
+  Raises:
+      PermissionError: if the directory is not owned by the current
+          user or can be written by other users
+  """
+
+  os.makedirs(path, mode=0o700, exist_ok=True)
+  st = os.stat(path)
+  if st.st_uid != os.geteuid():
+    raise PermissionError(
+        f"{path} is not owned by uid {os.geteuid()} (owner {st.st_uid})")
+  if st.st_mode & 0o022:
+    raise PermissionError(f"{path} can be written by other users")
+  return path
+
+
+def state_directory(name: str = "") -> str:
+  """Get a private directory in the state directory
+
+  Args:
+      name (str, optional): the subdirectory. Defaults to "" (the state
+          directory itself).
+
+  Returns:
+      str: the directory
+
+  Raises:
+      PermissionError: if the directory is not private (see
+          `private_directory()`)
+  """
+
+  try:
+    directory = config.get_state_dir()
+  except KeyError:
+    if os.geteuid() == 0:
+      directory = DEFAULT
+    else:
+      directory = os.path.join(
+          os.environ.get("XDG_STATE_HOME",
+                         os.path.expanduser("~/.local/state")), "logdog")
+  private_directory(directory)
+  return private_directory(os.path.join(directory, name)) if name else directory
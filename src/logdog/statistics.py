@@ -0,0 +1,268 @@
+"""Streaming statistics over event fields
+
+Filename: statistics.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Events can track statistics of a field without storing the values:
+the most frequent values are estimated with a count-min sketch and a
+top-k heap, the number of distinct values with a HyperLogLog. The
+memory of the statistics is fixed by their configuration. The
+statistics are reported periodically as the internal event
+`logdog`/`statistics`.
+
+Classes:
+    CountMinSketch: estimate frequencies
+    TopK: keep the most frequent values
+    HyperLogLog: estimate the number of distinct values
+    FieldStatistics: statistics of one field of an event
+
+Functions:
+    hash_value(str) -> int: get a 64 bit hash of a value
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import array
+import hashlib
+import heapq
+import math
+
+import logdog.strings as strings
+
+
+def hash_value(value: str) -> int:
+  """Get a 64 bit hash of `value` that is equal in all processes
+
+  Args:
+      value (str): the value
+
+  Returns:
+      int: the hash
+  """
+
+  return int.from_bytes(
+      hashlib.blake2b(value.encode("UTF-8"), digest_size=8).digest(), "big")
+
+
+class CountMinSketch:
+  """Estimate the frequency of values
+
+  The estimate is never lower than the real frequency and higher by at
+  most `e / width * total` with probability `1 - exp(-depth)`.
+
+  Args:
+      width (int): counters per row
+      depth (int): rows (hash functions)
+  """
+
+  def __init__(self, width: int = 2048, depth: int = 4):
+    self.width = width
+    self.depth = depth
+    self.counters = array.array("Q", bytes(8 * width * depth))
+
+  def __indices(self, h: int) -> list:
+    # Derive `depth` hash functions from two (Kirsch-Mitzenmacher)
+    h1 = h & 0xffffffff
+    h2 = h >> 32
+    return [
+        i * self.width + (h1 + i * h2) % self.width for i in range(self.depth)
+    ]
+
+  def add(self, h: int) -> int:
+    """Count a value
+
+    Args:
+        h (int): the hash of the value
+
+    Returns:
+        int: the estimated frequency of the value
+    """
+
+    estimate = None
+    for i in self.__indices(h):
+      self.counters[i] += 1
+      if estimate is None or self.counters[i] < estimate:
+        estimate = self.counters[i]
+    return estimate
+
+  def estimate(self, h: int) -> int:
+    """Estimate the frequency of a value
+
+    Args:
+        h (int): the hash of the value
+
+    Returns:
+        int: the estimated frequency
+    """
+
+    return min(self.counters[i] for i in self.__indices(h))
+
+
+class TopK:
+  """Keep the `k` values with the highest estimated frequency
+
+  Args:
+      k (int): number of values to keep
+  """
+
+  def __init__(self, k: int = 10):
+    self.k = k
+    self.heap = []  # (estimate, value), lowest estimate first
+    self.values = {}  # value -> estimate in heap
+
+  def update(self, value: str, estimate: int):
+    """Offer a value with its current estimate
+
+    Args:
+        value (str): the value
+        estimate (int): the estimated frequency of the value
+    """
+
+    if value in self.values:
+      self.values[value] = estimate
+      # Heap entries are updated lazily in `__evict()`
+      return
+    if len(self.values) < self.k:
+      self.values[value] = estimate
+      heapq.heappush(self.heap, (estimate, value))
+      return
+    self.__evict(estimate, value)
+
+  def __evict(self, estimate: int, value: str):
+    while self.heap:
+      e, v = self.heap[0]
+      if self.values[v] != e:
+        # Outdated entry: reinsert with the current estimate
+        heapq.heapreplace(self.heap, (self.values[v], v))
+        continue
+      if e >= estimate:
+        return
+      heapq.heapreplace(self.heap, (estimate, value))
+      del self.values[v]
+      self.values[value] = estimate
+      return
+
+  def top(self) -> list:
+    """Get the kept values
+
+    Returns:
+        list: (value, estimate) ordered by estimate (highest first)
+    """
+
+    return sorted(self.values.items(), key=lambda i: i[1], reverse=True)
+
+
+class HyperLogLog:
+  """Estimate the number of distinct values
+
+  Uses `2^precision` registers of one byte. The standard error is about
+  `1.04 / sqrt(2^precision)`.
+
+  Args:
+      precision (int): number of bits used to choose a register (4-16)
+  """
+
+  def __init__(self, precision: int = 12):
+    self.precision = precision
+    self.m = 1 << precision
+    self.registers = bytearray(self.m)
+
+  def add(self, h: int):
+    """Add a value
+
+    Args:
+        h (int): the hash of the value
+    """
+
+    i = h >> (64 - self.precision)
+    rest = h & ((1 << (64 - self.precision)) - 1)
+    rank = (64 - self.precision) - rest.bit_length() + 1
+    if rank > self.registers[i]:
+      self.registers[i] = rank
+
+  def count(self) -> int:
+    """Estimate the number of distinct values
+
+    Returns:
+        int: the estimate
+    """
+
+    alpha = 0.7213 / (1 + 1.079 / self.m)
+    estimate = alpha * self.m * self.m / sum(2.0**-r for r in self.registers)
+    zeros = self.registers.count(0)
+    if estimate <= 2.5 * self.m and zeros:
+      # Small range correction (linear counting)
+      estimate = self.m * math.log(self.m / zeros)
+    return round(estimate)
+
+
+class FieldStatistics:
+  """Statistics of one field of an event
+
+  Args:
+      field (str): the field
+      top (int, optional): number of most frequent values to report.
+          Defaults to 10.
+      width (int, optional): width of the count-min sketch.
+          Defaults to 2048.
+      depth (int, optional): depth of the count-min sketch.
+          Defaults to 4.
+      precision (int, optional): precision of the HyperLogLog.
+          Defaults to 12.
+  """
+
+  def __init__(self,
+               field: str,
+               top: int = 10,
+               width: int = 2048,
+               depth: int = 4,
+               precision: int = 12):
+    self.field = field
+    self.top = top
+    self.width = width
+    self.depth = depth
+    self.precision = precision
+    self.reset()
+
+  def reset(self):
+    """Start a new reporting interval
+    """
+
+    self.total = 0
+    self.sketch = CountMinSketch(self.width, self.depth)
+    self.heavy_hitters = TopK(self.top)
+    self.distinct = HyperLogLog(self.precision)
+
+  def add(self, fields: dict):
+    """Add the value of the field of an event
+
+    Args:
+        fields (dict): the fields of the event
+    """
+
+    value = strings.get_field(fields, self.field)
+    if value is None:
+      return
+    value = str(value)
+    h = hash_value(value)
+    self.total += 1
+    self.heavy_hitters.update(value, self.sketch.add(h))
+    self.distinct.add(h)
+
+  def report(self) -> str:
+    """Get a report of the current interval
+
+    Returns:
+        str: the report
+    """
+
+    lines = [
+        f"{self.field}: {self.total} values, ~{self.distinct.count()} distinct"
+    ]
+    for value, estimate in self.heavy_hitters.top():
+      lines.append(f"  {estimate:>10} {value}")
+    return "\n".join(lines)
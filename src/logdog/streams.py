@@ -0,0 +1,175 @@
+"""Route the lines of stdin and named pipes to handlers
+
+Filename: streams.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Handlers with an `input` of type `stdin` or `fifo` read a stream that
+is shared with other handlers, e.g. `journalctl -f -o cat | logdog`.
+Only one process can read a stream, so the main process reads it in
+chunks and routes the lines through a pipe per handler. The handler
+process reads its pipe like the `stdout` of a watcher.
+
+A handler with a `route` gets the lines whose first word is its route,
+without the route (e.g. route `sys` gets `kernel: ...` of the line
+`sys kernel: ...`). Lines without a known route go to the handlers
+without a `route`.
+
+A named pipe is created if it does not exist and is opened again when
+its last writer has closed it.
+
+Classes:
+    Router: route the lines of a stream to pipes
+
+Functions:
+    read_chunks(dict) -> generator: yield the chunks of a stream
+    stream_key(dict) -> tuple: get the stream of an input
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import os
+import stat
+import sys
+
+import logdog.sources as sources
+
+TYPES = ("stdin", "fifo")  # Input types that are streams
+
+
+def stream_key(input_data: dict) -> tuple:
+  """Get the stream of an input
+
+  Args:
+      input_data (dict): the `input` object of a handler
+
+  Returns:
+      tuple: the key of the stream (handlers of the same stream share
+          one `Router`)
+  """
+
+  if input_data["type"] == "fifo":
+    return ("fifo", os.path.abspath(input_data["path"]))
+  return ("stdin",)
+
+
+def read_chunks(input_data: dict, chunk_size: int = sources.CHUNK_SIZE):
+  """Yield the chunks of a stream
+
+  Stdin ends at EOF. A named pipe is opened again (blocking until the
+  next writer opens it) whenever its writers have closed it.
+
+  Args:
+      input_data (dict): the `input` object of a handler
+      chunk_size (int, optional): bytes to read at once.
+          Defaults to sources.CHUNK_SIZE.
+
+  Yields:
+      bytes: the chunks
+
+  Raises:
+      ValueError: if `path` exists and is not a named pipe
+  """
+
+  if input_data["type"] == "stdin":
+    fd = sys.stdin.fileno()
+    while True:
+      chunk = os.read(fd, chunk_size)
+      if not chunk:
+        return
+      yield chunk
+
+  path = input_data["path"]
+  try:
+    os.mkfifo(path, input_data.get("mode", 0o600))
+  except FileExistsError:
+    if not stat.S_ISFIFO(os.stat(path).st_mode):
+      raise ValueError(f"{path} is no named pipe")
+  while True:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+      while True:
+        chunk = os.read(fd, chunk_size)
+        if not chunk:
+          break
+        yield chunk
+    finally:
+      os.close(fd)
+
+
+class Router:
+  """Route the lines of a stream to pipes
+
+  Lines are collected per pipe and written once per chunk.
+
+  Args:
+      routes (dict): the pipes (list of file descriptors) per route
+          (bytes)
+      default (list): the pipes of lines without a known route
+  """
+
+  def __init__(self, routes: dict, default: list):
+    self.routes = routes
+    self.default = default
+    self.rest = b""
+
+  def __write(self, batches: dict):
+    """Write the collected lines to their pipes
+
+    Pipes of handlers that have exited are dropped.
+    """
+
+    for fd, lines in batches.items():
+      data = memoryview(b"".join(lines))
+      try:
+        while data:
+          data = data[os.write(fd, data):]
+      except OSError:
+        self.__drop(fd)
+
+  def __drop(self, fd: int):
+    """Stop routing to `fd`
+    """
+
+    for fds in list(self.routes.values()) + [self.default]:
+      if fd in fds:
+        fds.remove(fd)
+    try:
+      os.close(fd)
+    except OSError:
+      pass
+
+  def feed(self, chunk: bytes):
+    """Route the complete lines of a chunk
+
+    Args:
+        chunk (bytes): the chunk
+    """
+
+    lines = (self.rest + chunk).split(b"\n")
+    self.rest = lines.pop()
+    batches = {}
+    for l in lines:
+      route, _, text = l.partition(b" ")
+      fds = self.routes.get(route)
+      if fds is None:
+        fds, text = self.default, l
+      for fd in fds:
+        batch = batches.get(fd)
+        if batch is None:
+          batch = batches[fd] = []
+        batch.append(text + b"\n")
+    self.__write(batches)
+
+  def close(self):
+    """Route the last line and close the pipes
+    """
+
+    if self.rest:
+      self.feed(b"\n")
+    for fd in set(fd for fds in self.routes.values() for fd in fds) | set(
+        self.default):
+      os.close(fd)
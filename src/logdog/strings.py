@@ -9,6 +9,7 @@ License: `MIT`_ (Please look at license of surrounding project)
 Functions:
     parse_string(str, str, str) -> str: Replaces keywords in a string
         with more useful information
+    get_field(dict, str): get the value of a field
 
 .. _MIT:
    https://github.com/TheTimmoth/logdog/blob/main/LICENSE
@@ -18,23 +19,23 @@ import re
 import subprocess as sp
 import time
 
-# Supported keywords for parsing. Each keyword is a 2-tuple.
-# The first element denotes the keyword as used in a string
-# The second element denotes the keyword as regular expression
-__keywords = [
-    ("hostname", "hostname"),
-    ("detailed_information", "detailed\\_information"),
-    ("brief_information", "brief\\_information"),
-    ("stdout", "stdout"),
-    ("timestamp", "timestamp"),
-]
+# Built-in keywords. They take precedence over fields of the same name
+# and are also recognized as prefix of a longer word (e.g. `$STDOUTS`)
+__keywords = ("hostname", "detailed_information", "brief_information",
+              "stdout", "timestamp")
+
+# Finds the keywords of a string: ${NAME}, a built-in $NAME or $NAME
+__keyword = re.compile(
+    "\\$\\{(\\w+)\\}|\\$(?:(" + "|".join(__keywords) + ")|(\\w+))",
+    re.IGNORECASE)
 
 
 def parse_string(s: str,
                  detailed_information: str = "",
                  brief_information: str = "",
                  stdout: str = "",
-                 timestamp: time.struct_time = None) -> str:
+                 timestamp: time.struct_time = None,
+                 fields: dict = None) -> str:
   """Replaces keywords in `s`with more useful information
 
   Any occurrance of a keyword in `s` is replaced with information.
@@ -48,9 +49,15 @@ def parse_string(s: str,
       $BRIEF_INFORMATION: some brief information
       $STDOUT: the output of the watcher (which contains the event)
       $TIMESTAMP: the time of the event
+      $NAME: the field `name` of the event (e.g. the named group
+          (?P<name>...) of the event regexp). Field names are case
+          insensitive.
 
   Please note that the `detailed_information` or `brief_information` strings gets also parsed for keywords.
 
+  `s` is scanned once, so keywords contained in the replacements (e.g.
+  a `$user` in the watcher output) are not replaced.
+
   Example:
       handler: "Test string $HOSTNAME" gets converted to
           "Test string machine.example.com"
@@ -63,44 +70,84 @@ def parse_string(s: str,
           brief_information. Defaults to "".
       stdout (str, optional): collected stdout from watcher. Defaults to "".
       timestamp (time.struct_time, optional): a given timestamp. Defaults to None.
+      fields (dict, optional): the fields of the event. Defaults to None.
 
   Returns:
       str: the processed string
   """
 
+  if "$" not in s:
+    return s
+
   # Parse detailed_information for keywords
   # (The detailed_information keyword is not supported)
   if detailed_information:
     detailed_information = parse_string(detailed_information,
                                         brief_information=brief_information,
                                         stdout=stdout,
-                                        timestamp=timestamp)
+                                        timestamp=timestamp,
+                                        fields=fields)
 
   # Parse brief_information for keywords
   # (The keywords brief_information, detailed_information and stdout
   # are not supported)
   if brief_information:
-    brief_information = parse_string(brief_information)
+    brief_information = parse_string(brief_information, fields=fields)
+
+  hostname = None
+  values = None
 
-  # Parse the search string
-  for k in __keywords:
-    p = re.compile(f"(\\$\\{{{k[1]}\\}})|(\\${k[1]})", re.IGNORECASE)
-    m = p.search(s)
+  def replace(m: re.Match) -> str:
+    nonlocal hostname
+    nonlocal values
 
-    if m:
-      if k[0] == "hostname":
+    name = (m.group(1) or m.group(2) or m.group(3)).casefold()
+    if name == "hostname":
+      if hostname is None:
         f = sp.run(["hostname", "-f"], capture_output=True)
-        s = s.replace(m.group(0), f.stdout.decode("UTF-8").strip())
-      elif k[0] == "detailed_information":
-        s = s.replace(m.group(0), detailed_information)
-      elif k[0] == "brief_information":
-        s = s.replace(m.group(0), brief_information)
-      elif k[0] == "stdout" and stdout:
-        s = s.replace(m.group(0), stdout)
-      elif k[0] == "timestamp" and timestamp:
-        s = s.replace(m.group(0), time.strftime("%b %d %H:%M:%S", timestamp))
-
-  return s
+        hostname = f.stdout.decode("UTF-8").strip()
+      return hostname
+    if name == "detailed_information":
+      return detailed_information
+    if name == "brief_information":
+      return brief_information
+    if name == "stdout" and stdout:
+      return stdout
+    if name == "timestamp" and timestamp:
+      return time.strftime("%b %d %H:%M:%S", timestamp)
+    if name in __keywords or fields is None:
+      return m.group(0)
+
+    # The fields are only accessed if `s` contains field keywords
+    if values is None:
+      values = {k.casefold(): v for k, v in fields.items()}
+    return str(values[name]) if name in values else m.group(0)
+
+  return __keyword.sub(replace, s)
+
+
+def get_field(fields: dict, name: str):
+  """Get the value of a field
+
+  Field names are case insensitive.
+
+  Args:
+      fields (dict): the fields (may be None)
+      name (str): the name of the field
+
+  Returns:
+      the value or None if there is no field `name`
+  """
+
+  if fields is None:
+    return None
+  value = fields.get(name)
+  if value is None:
+    name = name.casefold()
+    for k, v in fields.items():
+      if k.casefold() == name:
+        return v
+  return value
 
 
 def list_to_string(l: list, s: str = "\n") -> str:
@@ -0,0 +1,113 @@
+"""Expire many timers cheaply
+
+Filename: timerwheel.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+A timer wheel is a ring of slots. Each slot collects the items whose
+deadline falls into one `resolution` wide interval. Adding and
+cancelling an item is O(1). A heap of the occupied ticks (a tick is
+the number of a slot interval since the epoch) makes finding the next
+due slot O(log n) for n occupied slots, so advancing the wheel and
+waiting for the next deadline never scan the empty slots.
+
+Classes:
+    TimerWheel: a hashed timer wheel
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import heapq
+import math
+
+
+class TimerWheel:
+  """A hashed timer wheel
+
+  Deadlines further away than `horizon` seconds are put into the last
+  slot of the wheel. Such items are returned by `advance()` before
+  their deadline, so the caller has to check the real deadline and add
+  the item again if it is not due yet.
+
+  All items of a slot belong to the same tick. `ticks` contains the
+  tick of every slot with items. Ticks of slots that have been emptied
+  by `cancel()` are removed lazily.
+
+  Args:
+      resolution (float): width of a slot in seconds
+      horizon (float): time span covered by the wheel in seconds
+      now (float): the current time
+  """
+
+  def __init__(self, resolution: float, horizon: float, now: float):
+    self.resolution = resolution
+    self.slots = [set() for _ in range(math.ceil(horizon / resolution) + 1)]
+    self.tick = int(now / resolution)
+    self.ticks = []  # Heap of the ticks of the occupied slots
+    self.queued = set()  # Ticks in `ticks`
+
+  def add(self, item, deadline: float) -> int:
+    """Add `item` to the slot of `deadline`
+
+    Args:
+        item: a hashable item
+        deadline (float): the time the item is due
+
+    Returns:
+        int: the slot of the item (needed to cancel it)
+    """
+
+    tick = min(max(int(deadline / self.resolution), self.tick + 1),
+               self.tick + len(self.slots) - 1)
+    slot = tick % len(self.slots)
+    self.slots[slot].add(item)
+    if tick not in self.queued:
+      self.queued.add(tick)
+      heapq.heappush(self.ticks, tick)
+    return slot
+
+  def cancel(self, item, slot: int):
+    """Remove `item` from `slot`
+
+    Args:
+        item: the item
+        slot (int): the slot returned by `add()`
+    """
+
+    self.slots[slot].discard(item)
+
+  def advance(self, now: float) -> list:
+    """Advance the wheel to `now`
+
+    Args:
+        now (float): the current time
+
+    Returns:
+        list: the items of all slots that have become due
+    """
+
+    due = []
+    tick = int(now / self.resolution)
+    while self.ticks and self.ticks[0] <= tick:
+      t = heapq.heappop(self.ticks)
+      self.queued.discard(t)
+      slot = self.slots[t % len(self.slots)]
+      due.extend(slot)
+      slot.clear()
+    self.tick = max(tick, self.tick)
+    return due
+
+  def next_due(self) -> float:
+    """Get the time the next slot with items becomes due
+
+    Returns:
+        float: the time or None if the wheel is empty
+    """
+
+    while self.ticks and not self.slots[self.ticks[0] % len(self.slots)]:
+      # All items of the slot have been cancelled
+      self.queued.discard(heapq.heappop(self.ticks))
+    return self.ticks[0] * self.resolution if self.ticks else None
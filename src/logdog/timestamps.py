@@ -0,0 +1,263 @@
+"""Parse the timestamps of log lines
+
+Filename: timestamps.py
+Author: Tim Schlottmann
+Copyright (c) 2021 Tim Schlottmann
+
+License: `MIT`_ (Please look at license of surrounding project)
+
+Events are stamped with the time they are detected. While a handler
+catches up (e.g. after a restart or during a replay) this is not the
+time the event was logged. A `Parser` extracts the time from the line
+of an event, so events carry the log time, the detection time and the
+lag between them.
+
+Parsing a timestamp with `strptime` is slow, but consecutive lines
+mostly share the same second. The parser caches the time of the
+timestamp text without its fraction of a second, so only the first
+line of every second is parsed.
+
+Timestamps without a year (e.g. syslog) get the year that puts them
+closest before the current time. Timestamps without a time zone are in
+the configured `timezone` (default: local time).
+
+Classes:
+    Parser: parse the timestamp of a line
+
+Functions:
+    pattern(str) -> str: get a regexp that finds timestamps of a format
+    stamp(dict, float) -> tuple: add the log time, detection time and
+        lag to the fields of an event
+
+.. _MIT:
+   https://github.com/TheTimmoth/logdog/blob/main/LICENSE
+"""
+
+import datetime
+import re
+import time
+
+try:
+  import zoneinfo
+except ImportError:
+  zoneinfo = None
+
+# Formats with a name
+FORMATS = {
+    "syslog": "%b %d %H:%M:%S",  # e.g. "May  4 13:00:01"
+    "iso8601": None,  # e.g. "2021-05-04T13:00:01.123+02:00"
+}
+
+# Regexps of the supported `strptime` directives
+__directives = {
+    "Y": "\\d{4}",
+    "y": "\\d\\d",
+    "m": "[ \\d]?\\d",
+    "d": "[ \\d]?\\d",
+    "j": "\\d{1,3}",
+    "H": "[ \\d]?\\d",
+    "I": "[ \\d]?\\d",
+    "M": "\\d\\d",
+    "S": "\\d\\d",
+    "f": "(?P<fraction>\\d{1,6})",
+    "p": "[AaPp][Mm]",
+    "b": "[A-Za-z]{3}",
+    "h": "[A-Za-z]{3}",
+    "B": "[A-Za-z]+",
+    "a": "[A-Za-z]{3}",
+    "A": "[A-Za-z]+",
+    "z": "(?:Z|[+-]\\d\\d:?\\d\\d)",
+    "Z": "[A-Za-z]{1,5}",
+    "%": "%",
+}
+
+# Finds ISO 8601 timestamps
+ISO8601 = re.compile(
+    "(?P<second>\\d{4}-\\d\\d-\\d\\d[T ]\\d\\d:\\d\\d:\\d\\d)"
+    "(?:[.,](?P<fraction>\\d+))?\\s?(?P<zone>Z|[+-]\\d\\d:?\\d\\d)?")
+
+__format = "%Y-%m-%d %H:%M:%S"  # Format of the times added to fields
+
+
+def pattern(format: str) -> str:
+  """Get a regexp that finds timestamps of a `strptime` format
+
+  Args:
+      format (str): the format
+
+  Returns:
+      str: the regexp (the fraction of a second is the group `fraction`)
+
+  Raises:
+      ValueError: if the format contains an unsupported directive
+  """
+
+  parts = []
+  i = 0
+  while i < len(format):
+    c = format[i]
+    if c == "%" and i + 1 < len(format):
+      d = format[i + 1]
+      if d not in __directives:
+        raise ValueError(f"Unsupported directive %{d} in {format}")
+      parts.append(__directives[d])
+      i += 2
+    elif c == " ":
+      parts.append(" +")
+      i += 1
+    else:
+      parts.append(re.escape(c))
+      i += 1
+  return "".join(parts)
+
+
+class Parser:
+  """Parse the timestamp of a line
+
+  Args:
+      format (str, optional): "syslog", "iso8601" or a `strptime`
+          format. Defaults to "iso8601".
+      timezone (str, optional): the time zone of timestamps without a
+          time zone (e.g. "UTC" or "Europe/Berlin"). Defaults to None
+          (local time).
+
+  Raises:
+      ValueError: if the format or the time zone is not supported
+  """
+
+  def __init__(self, format: str = "iso8601", timezone: str = None):
+    self.format = FORMATS.get(format, format)
+    if self.format is None:
+      self.pattern = ISO8601
+    else:
+      self.pattern = re.compile(pattern(self.format))
+      # Timestamps without a year are parsed with a year prepended
+      self.year = "%Y" not in self.format and "%y" not in self.format
+      self.strptime_format = self.format.replace("%f", "")
+      if self.year:
+        self.strptime_format = "%Y " + self.strptime_format
+
+    if timezone is None:
+      self.timezone = None
+    elif timezone.upper() == "UTC":
+      self.timezone = datetime.timezone.utc
+    elif zoneinfo is not None:
+      try:
+        self.timezone = zoneinfo.ZoneInfo(timezone)
+      except (zoneinfo.ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown time zone {timezone}") from e
+    else:
+      raise ValueError(f"Time zone {timezone} needs zoneinfo")
+
+    self.fractions = "fraction" in self.pattern.groupindex
+    self.cache = {}  # Time per timestamp text without fraction
+
+  def __seconds(self, dt: datetime.datetime) -> float:
+    """Get the seconds since the epoch of `dt`
+    """
+
+    if dt.tzinfo is None and self.timezone is not None:
+      dt = dt.replace(tzinfo=self.timezone)
+    # Naive datetimes are local time
+    return dt.timestamp()
+
+  def __parse(self, text: str, zone: str) -> float:
+    """Parse the timestamp text without its fraction
+
+    Raises:
+        ValueError: if `text` is not a valid timestamp
+    """
+
+    if self.format is None:
+      if zone:
+        zone = "+00:00" if zone == "Z" else zone
+        if ":" not in zone:
+          zone = zone[:3] + ":" + zone[3:]
+      return self.__seconds(
+          datetime.datetime.fromisoformat(text.replace(" ", "T") + zone))
+
+    if self.format.endswith("%z") and text.endswith("Z"):
+      text = text[:-1] + "+0000"
+    if not self.year:
+      return self.__seconds(
+          datetime.datetime.strptime(text, self.strptime_format))
+
+    # Take the year that puts the timestamp closest before now (up to a
+    # day ahead for clocks that are not in sync). February 29 is only
+    # valid in leap years.
+    now = time.time()
+    year = time.localtime(now).tm_year
+    for y in range(year, year - 8, -1):
+      try:
+        t = self.__seconds(
+            datetime.datetime.strptime(f"{y} {text}", self.strptime_format))
+      except ValueError:
+        continue
+      if t <= now + 86400:
+        return t
+    raise ValueError(f"No year for timestamp {text}")
+
+  def parse(self, line: str) -> float:
+    """Get the time of the first timestamp of `line`
+
+    Args:
+        line (str): the line
+
+    Returns:
+        float: the seconds since the epoch or None if `line` contains
+            no valid timestamp
+    """
+
+    m = self.pattern.search(line)
+    if m is None:
+      return None
+
+    fraction = m.group("fraction") if self.fractions else None
+    if self.format is None:
+      key = m.group("second")
+      zone = m.group("zone") or ""
+    elif fraction:
+      key = (line[m.start():m.start("fraction")] +
+             line[m.end("fraction"):m.end()])
+      zone = ""
+    else:
+      key = m.group(0)
+      zone = ""
+
+    t = self.cache.get((key, zone))
+    if t is None:
+      try:
+        t = self.__parse(key, zone)
+      except (ValueError, OverflowError):
+        return None
+      if len(self.cache) >= 1024:
+        self.cache.clear()
+      self.cache[(key, zone)] = t
+
+    if fraction:
+      t += float("0." + fraction)
+    return t
+
+
+def stamp(fields, detected: float) -> tuple:
+  """Add the log time, detection time and lag to the fields of an event
+
+  Args:
+      fields: the fields of the event with the parsed log time as
+          `log_time` (float or None, see `matcher.Matcher`)
+      detected (float): the time the event has been detected
+
+  Returns:
+      tuple: (the fields (dict) with `log_time`, `detection_time` and
+          `lag` (seconds) as text, the log time (float) or `detected` if
+          the line contained no timestamp)
+  """
+
+  fields = dict(fields)
+  log_time = fields.pop("log_time", None)
+  fields["detection_time"] = time.strftime(__format, time.localtime(detected))
+  if log_time is None:
+    return (fields, detected)
+  fields["log_time"] = time.strftime(__format, time.localtime(log_time))
+  fields["lag"] = f"{detected - log_time:.3f}"
+  return (fields, log_time)